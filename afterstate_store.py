@@ -0,0 +1,215 @@
+import sys
+import numpy as np
+from state_store import StateStore, _grow
+
+
+# Увеличение ёмкости массива с заполнением новой части
+# значением fill
+#
+# Params:
+# array: np.ndarray - исходный массив
+# capacity: int - новая ёмкость
+# fill: number - значение новых элементов
+#
+# Returns -> np.ndarray
+def _grow_filled(array, capacity, fill):
+    length = len(array)
+    grown = _grow(array, capacity)
+    grown[length:] = fill
+    return grown
+
+
+class AfterstateStore(StateStore):
+
+    # Модель переходов через послеходовые состояния.
+    # Ход детерминирован, поэтому пара (состояние, действие)
+    # отображается в номер послеходового состояния (поле после
+    # сдвига до появления новой ячейки). Распределение появления
+    # новой ячейки хранится один раз на послеходовое состояние
+    # в формате CSR: переходы послеходового состояния a лежат
+    # в отрезке [after_offsets[a], after_offsets[a + 1]) массивов
+    # after_next и after_prob. Ценность послеходового состояния W -
+    # ожидаемая ценность следующего состояния, ценность состояния -
+    # максимум W по доступным действиям (см. ValueSolver.solve_afterstates)
+    #
+    # Params:
+    # capacity: int - начальная ёмкость массивов состояний
+    def __init__(self, capacity=1024):
+        super().__init__(capacity)
+        self.action_after = np.full(4 * capacity, -1, dtype=np.int32)
+
+        self.after_index = {}
+        self.after_count = 0
+        self.after_keys = np.zeros(capacity, dtype=np.uint64)
+        self.W = np.zeros(capacity, dtype=np.float64)
+        self.after_offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self.after_next = np.zeros(capacity, dtype=np.int32)
+        self.after_prob = np.zeros(capacity, dtype=np.float64)
+        self.after_edges = 0
+
+    # Создание хранилища только для чтения поверх готовых
+    # массивов (см. StateStore.from_arrays) вместе с массивами
+    # послеходовых состояний
+    #
+    # Params:
+    # action_after: np.ndarray - номера послеходовых состояний
+    # по парам (состояние, действие)
+    # after_keys: np.ndarray - поля послеходовых состояний
+    # W: np.ndarray - ценности послеходовых состояний
+    # after_offsets: np.ndarray - начала переходов послеходовых состояний
+    # after_next: np.ndarray - номера следующих состояний
+    # after_prob: np.ndarray - вероятности переходов
+    # arrays: dict - массивы состояний (см. StateStore.from_arrays)
+    #
+    # Returns -> AfterstateStore
+    @classmethod
+    def from_arrays(cls, action_after, after_keys, W, after_offsets, after_next,
+                    after_prob, **arrays):
+        store = super().from_arrays(**arrays)
+        store.action_after = action_after
+        store.after_index = None
+        store.after_count = len(after_keys)
+        store.after_keys = after_keys
+        store.W = W
+        store.after_offsets = after_offsets
+        store.after_next = after_next
+        store.after_prob = after_prob
+        store.after_edges = len(after_next)
+        return store
+
+    def thaw(self):
+        if self.index is not None:
+            return
+
+        super().thaw()
+        capacity = max(self.after_count, 1024)
+        self.action_after = _grow_filled(self.action_after[:4 * self.count],
+                                         4 * len(self.keys), -1)
+        self.after_keys = _grow(self.after_keys[:self.after_count], capacity)
+        self.W = _grow(self.W[:self.after_count], capacity)
+        self.after_offsets = _grow(self.after_offsets[:self.after_count + 1], capacity + 1)
+        self.after_next = _grow(self.after_next[:self.after_edges], max(self.after_edges, 1024))
+        self.after_prob = _grow(self.after_prob[:self.after_edges], max(self.after_edges, 1024))
+        self.after_index = {key: i for i, key in
+                            enumerate(self.after_keys[:self.after_count].tolist())}
+
+    def add(self, key):
+        state_id = super().add(key)
+        if len(self.action_after) < 4 * len(self.keys):
+            self.action_after = _grow_filled(self.action_after, 4 * len(self.keys), -1)
+        return state_id
+
+    def add_many(self, keys):
+        ids = super().add_many(keys)
+        if len(self.action_after) < 4 * len(self.keys):
+            self.action_after = _grow_filled(self.action_after, 4 * len(self.keys), -1)
+        return ids
+
+    # Проверка, есть ли послеходовое состояние в модели
+    #
+    # Params:
+    # after_key: int - поле после хода
+    #
+    # Returns -> bool
+    def has_afterstate(self, after_key):
+        self.thaw()
+        return after_key in self.after_index
+
+    # Добавление послеходового состояния с распределением
+    # появления новой ячейки. Следующие состояния добавляются,
+    # если их ещё нет
+    #
+    # Params:
+    # after_key: int - поле после хода
+    # prs: list - пары [вероятность, следующее состояние]
+    #
+    # Returns -> int:
+    # Номер послеходового состояния
+    def add_afterstate(self, after_key, prs):
+        self.thaw()
+        after_id = self.after_index.get(after_key)
+        if after_id is not None:
+            return after_id
+
+        if self.after_count + 1 == len(self.after_offsets):
+            capacity = 2 * len(self.after_keys)
+            self.after_keys = _grow(self.after_keys, capacity)
+            self.W = _grow(self.W, capacity)
+            self.after_offsets = _grow(self.after_offsets, capacity + 1)
+
+        end = self.after_edges + len(prs)
+        if end > len(self.after_next):
+            capacity = max(end, 2 * len(self.after_next))
+            self.after_next = _grow(self.after_next, capacity)
+            self.after_prob = _grow(self.after_prob, capacity)
+
+        for pr, next_key in prs:
+            self.after_next[self.after_edges] = self.add(next_key)
+            self.after_prob[self.after_edges] = pr
+            self.after_edges += 1
+
+        after_id = self.after_count
+        self.after_index[after_key] = after_id
+        self.after_keys[after_id] = after_key
+        self.after_count += 1
+        self.after_offsets[self.after_count] = self.after_edges
+        self.version += 1
+        return after_id
+
+    # Фиксирование послеходового состояния для действия
+    # action из состояния key
+    #
+    # Params:
+    # key: int - состояние среды
+    # action: int - действие
+    # after_key: int - поле после хода, уже добавленное
+    # в модель (см. add_afterstate)
+    #
+    # Returns -> void
+    def set_afterstate(self, key, action, after_key):
+        state_id = self.add(key)
+        self.action_after[4 * state_id + action] = self.after_index[after_key]
+        self.solved[state_id] = False
+        self.version += 1
+
+    # Массивы модели послеходовых состояний
+    #
+    # Returns -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
+    # Номера послеходовых состояний по действиям формы (count, 4),
+    # after_offsets, after_next и after_prob
+    def afterstates(self):
+        return (self.action_after[:4 * self.count].reshape(self.count, 4),
+                self.after_offsets[:self.after_count + 1],
+                self.after_next[:self.after_edges],
+                self.after_prob[:self.after_edges])
+
+    # Ценности действий: ценности послеходовых состояний,
+    # -inf - если действие недоступно
+    #
+    # Params:
+    # key: int - состояние среды
+    #
+    # Returns -> np.ndarray:
+    # Массив из 4 ценностей
+    def action_values(self, key):
+        state_id = self.id_of(key)
+        if state_id < 0:
+            raise KeyError(key)
+        afters = self.action_after[4 * state_id:4 * state_id + 4]
+        return np.where(afters >= 0, self.W[afters], -np.inf)
+
+    def q_values(self):
+        afters = self.afterstates()[0]
+        return np.where(afters >= 0, self.W[afters], -np.inf)
+
+    def memory_usage(self):
+        report = super().memory_usage()
+        del report['total']
+        report['after_index'] = 0 if self.after_index is None else \
+            (sys.getsizeof(self.after_index) +
+             sum(sys.getsizeof(key) for key in self.after_index))
+        report['afterstates'] = (self.action_after.nbytes + self.after_keys.nbytes +
+                                 self.W.nbytes + self.after_offsets.nbytes +
+                                 self.after_next.nbytes + self.after_prob.nbytes)
+        report['total'] = sum(report.values())
+        return report
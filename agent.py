@@ -1,14 +1,70 @@
 import json
+import os
 from time import sleep
 import numpy as np
-import sys
 import config
+import instrumentation
+from afterstate_store import AfterstateStore
+from compiled_policy import CompiledPolicy
 from exception import AttributeError
+from expectimax import ExpectimaxPlanner
+from exploration import RandomExploration
+from model_builder import ModelBuilder
+from solver import ValueSolver
+from spill_store import SpillStore
+from policy_file import read_policy, write_policy
+from state_store import StateStore
+from symmetry import Symmetry
+from trajectory_log import TrajectoryBuilder, read_trajectory
 
 
 class Agent:
-    def __init__(self):
-        self.states = {}
+
+    # Агент, решающий игру как марковский процесс
+    #
+    # Params:
+    # canonical: bool - если True, то симметричные поля хранятся
+    # как одно каноническое состояние (см. Symmetry). Среда должна
+    # возвращать состояния в формате BitGame2048.get_state
+    # states: StateStore - хранилище посещённых состояний,
+    # по умолчанию StateStore в памяти. Для моделей больше
+    # памяти - SpillStore
+    def __init__(self, canonical=False, states=None):
+        self.states = StateStore() if states is None else states
+        self.canonical = canonical
+        self.symmetry = None
+        self.planner = None
+        self.start_state = None
+        self.exploration = None
+        self.policy = None
+
+    # Подготовка канонизации состояний для среды environment.
+    # Вызывается перед заполнением модели в обход train и build
+    # (например, ParallelTrainer), чтобы поиск состояний в модели
+    # тоже шёл по каноническим ключам
+    #
+    # Params:
+    # rows: int - количество строк на игровом поле
+    # cols: int - количество столбцов на игровом поле
+    #
+    # Returns -> void
+    def init_symmetry(self, rows, cols):
+        if self.canonical and (self.symmetry is None or
+                               (self.symmetry.rows, self.symmetry.cols) != (rows, cols)):
+            self.symmetry = Symmetry(rows, cols)
+
+    # Каноническое представление состояния
+    #
+    # Params:
+    # state: int - состояние среды
+    #
+    # Returns -> (int, int):
+    # Каноническое состояние и номер симметрии
+    # (None, если канонизация выключена)
+    def __canonical(self, state):
+        if self.symmetry is None:
+            return state, None
+        return self.symmetry.canonical(state)
 
     # Проверка состояния на посещённость
     #
@@ -18,7 +74,7 @@ class Agent:
     # Returns -> bool:
     # True - если состояние уже было посещено
     def __is_visited_state(self, state):
-        return state in self.states.keys()
+        return state in self.states
 
     # Добавление состояния в список посещённых
     #
@@ -27,32 +83,7 @@ class Agent:
     #
     # Returns -> void
     def __add_new_state(self, state):
-        self.states[state] = {
-            'solved_V': False,
-            'R': 0,
-            'V': 0,
-            'actions': {
-                0: {
-                    'Prs': []
-                },
-                1: {
-                    'Prs': []
-                },
-                2: {
-                    'Prs': []
-                },
-                3: {
-                    'Prs': []
-                }
-            }
-        }
-
-    # Выбор следующего действия в среде
-    #
-    # Returns -> int:
-    # Следующее действие - целое число из диапазона [0, 3]
-    def __next_action(self):
-        return np.random.randint(0, 4)
+        self.states.add(state)
 
     # Проверка, является ли состояние терминальным
     # Начисляет награду, если состояние победное
@@ -68,7 +99,7 @@ class Agent:
         is_terminate_state = False
 
         if environment.max_tile_value == needed:
-            self.states[state]['R'] = config.WIN_REWARD
+            self.states.set_reward(state, config.WIN_REWARD)
             is_terminate_state = True
 
         if environment.game_over:
@@ -85,7 +116,7 @@ class Agent:
     # Returns -> float:
     # Вероятность перехода в текущее состояние
     def __get_state_pr(self, environment, value_plus):
-        free_tiles = environment.getFreeTiles() + 1
+        free_tiles = environment.get_free_tiles() + 1
         probabitily = 1 / free_tiles
 
         if value_plus == 2:
@@ -107,12 +138,10 @@ class Agent:
     # environment - среда
     #
     # Returns -> void
+    @instrumentation.timed('agent.add_transition')
     def __add_state_action_pr(self, state, action, next_state, value_plus, environment):
-        state_action_prs = self.states[state]['actions'][action]['Prs']
         state_pr = self.__get_state_pr(environment, value_plus)
-
-        if [state_pr, next_state] not in state_action_prs:
-            state_action_prs.append([state_pr, next_state])
+        self.states.add_transition(state, action, next_state, state_pr)
 
     # Вывод прогресса изучения среды
     #
@@ -136,36 +165,85 @@ class Agent:
     # environment - среда
     # bound_of_states: int - нужное количество состояний
     # needed: int - победное значение ячейки
+    # verbose: bool - если True, то выводится прогресс изучения
+    # checkpoint_every: int - период сохранения контрольной точки
+    # в состояниях (см. Agent.checkpoint). Если не задан, то
+    # контрольные точки не сохраняются
+    # exploration - стратегия изучения среды (см. exploration.py),
+    # по умолчанию RandomExploration. Стратегия сохраняется
+    # в self.exploration вместе со статистикой шагов
     #
     # Returns -> void
-    def train(self, environment, bound_of_states, needed):
-        states_count = len(self.states.keys())
+    @instrumentation.timed('agent.train')
+    def train(self, environment, bound_of_states, needed, verbose=True,
+              checkpoint_every=None, exploration=None):
+        if isinstance(self.states, AfterstateStore):
+            raise AttributeError('Модель послеходовых состояний строится методом build')
+        self.init_symmetry(environment.rows, environment.cols)
+        if exploration is not None:
+            self.exploration = exploration
+        elif self.exploration is None:
+            self.exploration = RandomExploration()
+        exploration = self.exploration
+        exploration.bind(self.states)
+
+        states_count = len(self.states)
+        if environment.start_state is None:
+            environment.start_state = self.start_state
+        next_checkpoint = states_count + checkpoint_every if checkpoint_every else None
 
         while states_count < bound_of_states:
-            if states_count == 0:
-                environment.init()
-            else:
-                environment.init(startState=True)
+            exploration.reset(environment, states_count == 0 or environment.start_state is None)
+            self.start_state = environment.start_state
+
+            if next_checkpoint is not None and states_count >= next_checkpoint:
+                self.checkpoint(environment)
+                next_checkpoint = states_count + checkpoint_every
+            if instrumentation.enabled:
+                instrumentation.count('train.episodes')
 
             while True:
-                state = environment.get_state()
+                state, transform = self.__canonical(environment.get_state())
                 value = environment.get_value()
 
                 if not self.__is_visited_state(state):
                     self.__add_new_state(state)
                     states_count += 1
-                    self.__progress_bar(states_count, bound_of_states)
+                    if instrumentation.enabled:
+                        instrumentation.count('train.new_states')
+                    if verbose:
+                        self.__progress_bar(states_count, bound_of_states)
 
                 if self.__check_terminate_state(environment, state, needed):
                     break
+                if exploration.should_restart(state):
+                    break
 
-                action = self.__next_action()
-                environment.forward(action)
-                next_state = environment.get_state()
+                legal = environment.legal_actions()
+                if transform is not None:
+                    legal = self.symmetry.to_canonical_mask(transform, legal)
+                action = exploration.select(state, legal)
+                if transform is None:
+                    environment.forward(action)
+                else:
+                    environment.forward(self.symmetry.from_canonical_action(transform, action))
+                next_state, _ = self.__canonical(environment.get_state())
                 value_plus = environment.get_value() - value
+                exploration.observe(state, action, next_state,
+                                    not self.__is_visited_state(next_state))
 
-                if next_state == state:
-                    continue
+                if instrumentation.enabled:
+                    instrumentation.count('train.steps')
+
+                if not self.__is_visited_state(next_state):
+                    self.__add_new_state(next_state)
+                    states_count += 1
+                    if instrumentation.enabled:
+                        instrumentation.count('train.new_states')
+                    if verbose:
+                        self.__progress_bar(states_count, bound_of_states)
+                elif instrumentation.enabled:
+                    instrumentation.count('train.revisits')
 
                 self.__add_state_action_pr(state,
                                            action,
@@ -173,45 +251,139 @@ class Agent:
                                            value_plus,
                                            environment)
 
-    # Рекурсивное вычисление ценности состояния
+        if verbose:
+            print("Шагов среды: " + str(exploration.steps) +
+                  ", новых состояний на шаг: " +
+                  format(exploration.new_states_per_step, '.4f'))
+
+    # Построение точной модели среды environment обходом
+    # в ширину из состояния S0 вместо случайного блуждания.
+    # Среда должна возвращать состояния в формате
+    # BitGame2048.get_state
     #
     # Params:
-    # state: int - состояние среды
+    # environment - среда
+    # bound_of_states: int - максимальное количество раскрытых состояний
+    # needed: int - победное значение ячейки
+    # afterstates: bool - если True, то модель строится через
+    # послеходовые состояния (см. AfterstateStore), и стратегия
+    # выбирает действие с максимальной ценностью
+    # verbose: bool - если True, то выводится статистика обхода
     #
-    # Returns -> float:
-    # Ценность состояния state
-    def __find_state_value(self, state):
-        if self.states[state]['solved_V']:
-            return self.states[state]['V']
-
-        if self.states[state]['R'] == config.WIN_REWARD:
-            self.states[state]['V'] = config.WIN_REWARD
-            self.states[state]['solved_V'] = True
-            return self.states[state]['V']
+    # Returns -> ModelBuilder:
+    # Построитель модели со статистикой обхода
+    def build(self, environment, bound_of_states, needed, afterstates=False, verbose=True):
+        if environment.start_state is None:
+            environment.init()
+
+        self.init_symmetry(environment.rows, environment.cols)
+        self.start_state = environment.start_state
+        builder = ModelBuilder(environment, needed, self.symmetry)
+        if afterstates:
+            self.__build_afterstates(builder, bound_of_states)
         else:
-            sum = 0
+            for state, reward, actions in builder.build(bound_of_states):
+                if not self.__is_visited_state(state):
+                    self.__add_new_state(state)
+                self.states.set_reward(state, reward)
+                for action in range(4):
+                    for pr, next_state in actions[action]:
+                        self.states.add_transition(state, action, next_state, pr)
+
+        if verbose:
+            print("Состояний: " + str(builder.states_count) +
+                  ", состояний в секунду: " + str(int(builder.states_per_sec)))
+        return builder
+
+    # Заполнение модели послеходовых состояний
+    #
+    # Params:
+    # builder: ModelBuilder - построитель модели
+    # bound_of_states: int - максимальное количество раскрытых состояний
+    #
+    # Returns -> void
+    def __build_afterstates(self, builder, bound_of_states):
+        if not isinstance(self.states, AfterstateStore):
+            if len(self.states):
+                raise AttributeError('Модель агента построена без послеходовых состояний')
+            self.states = AfterstateStore()
+
+        for state, reward, afters, spawns in builder.build_afterstates(bound_of_states):
+            self.states.add(state)
+            self.states.set_reward(state, reward)
+            for after, prs in spawns:
+                self.states.add_afterstate(after, prs)
             for action in range(4):
-                prs = self.states[state]['actions'][action]['Prs']
-                if prs:
-                    for elem in prs:
-                        pr = elem[0]
-                        next_state = elem[1]
-                        vs_plus = self.__find_state_value(next_state)
-                        sum += pr * vs_plus
-            self.states[state]['V'] = self.states[state]['R'] + config.Y * sum
-            self.states[state]['solved_V'] = True
-            return self.states[state]['V']
-
-    # Создание стратегии
+                if afters[action] is not None:
+                    self.states.set_afterstate(state, action, afters[action])
+
+    # Построение модели переходов по журналам траекторий
+    # (см. TrajectoryWriter) без повторного проигрывания игры.
+    # Журналы читаются кусками, повторные переходы отбрасываются,
+    # поэтому журналы можно дописывать и обрабатывать повторно
+    #
+    # Params:
+    # filenames: list - пути к файлам журналов
+    # needed: int - победное значение ячейки
+    # verbose: bool - если True, то выводится статистика
+    #
+    # Returns -> TrajectoryBuilder:
+    # Построитель модели со статистикой обработки
+    def build_from_logs(self, filenames, needed, verbose=True):
+        if isinstance(self.states, AfterstateStore):
+            raise AttributeError('Модель послеходовых состояний строится методом build')
+
+        sizes = set()
+        for filename in filenames:
+            header, _ = read_trajectory(filename)
+            sizes.add((header['rows'], header['cols']))
+        if len(sizes) != 1:
+            raise AttributeError('Журналы записаны для полей разного размера')
+
+        self.init_symmetry(*sizes.pop())
+        builder = TrajectoryBuilder(self.states, needed, self.symmetry)
+        for filename in filenames:
+            builder.ingest(filename)
+        if self.start_state is None:
+            self.start_state = builder.start_state
+
+        if verbose:
+            print("Записей: " + str(builder.records) +
+                  ", переходов: " + str(builder.transitions) +
+                  ", записей в секунду: " + str(int(builder.records_per_sec)))
+        return builder
+
+    # Создание стратегии: вычисление ценностей посещённых
+    # состояний без рекурсии и сборка стратегии в плотные массивы
+    # (см. compile_policy). После дообучения пересчитываются
+    # только новые и изменившиеся состояния и их предки
     #
     # Params:
     # environment - среда
     #
-    # Returns -> void
+    # Returns -> int:
+    # Количество пересчитанных состояний
+    @instrumentation.timed('agent.create_policy')
     def create_policy(self, environment):
-        if len(self.states.keys()) == 0:
+        if len(self.states) == 0:
             raise AttributeError('Агент не обучен')
-        self.__find_state_value(environment.start_state)
+        count = ValueSolver().solve_store(self.states)
+        self.compile_policy()
+        return count
+
+    # Сборка стратегии в плотные массивы (см. CompiledPolicy).
+    # Стратегия пересобирается, только если модель изменилась
+    # после прошлой сборки. Модель в файлах (SpillStore)
+    # не собирается, чтобы не занимать память
+    #
+    # Returns -> CompiledPolicy:
+    # Собранная стратегия или None
+    def compile_policy(self):
+        if isinstance(self.states, SpillStore) or len(self.states) == 0:
+            self.policy = None
+        elif self.policy is None or self.policy.is_stale(self.states):
+            self.policy = CompiledPolicy(self.states)
+        return self.policy
 
     # Получение ценности состояния
     #
@@ -221,53 +393,229 @@ class Agent:
     # Returns -> float:
     # Ценность состояния
     def get_state_value(self, state):
-        return self.states[state]['V']
+        return self.states.get_value(self.__canonical(state)[0])
+
+    # Проверка, есть ли состояние в модели агента
+    #
+    # Params:
+    # state: int - состояние среды
+    #
+    # Returns -> bool
+    def is_known_state(self, state):
+        return self.__canonical(state)[0] in self.states
+
+    # Подключение онлайн-планировщика для состояний,
+    # отсутствующих в модели
+    #
+    # Params:
+    # environment - среда
+    # needed: int - победное значение ячейки
+    # **kwargs - параметры ExpectimaxPlanner
+    #
+    # Returns -> ExpectimaxPlanner
+    def use_planner(self, environment, needed=config.NEEDED, **kwargs):
+        self.planner = ExpectimaxPlanner(environment.rows, environment.cols,
+                                         needed, self, **kwargs)
+        return self.planner
 
     # Вычисление следующего действия из состояния state
-    # согласно стратегии
+    # согласно стратегии. Если состояния нет в модели и подключён
+    # планировщик, то действие выбирается поиском expectimax
     #
     # Params:
     # state: int - состояние среды
+    # legal: int - маска доступных действий среды (см.
+    # legal_actions). Если задана, то действие выбирается
+    # только из доступных
     #
     # Returns -> int:
     # Следующее действие 
-    def forward(self, state):
-        action_values = []
-
-        for action in range(4):
-            value = 0
-            prs = self.states[state]['actions'][action]['Prs']
-            for elem in prs:
-                pr = elem[0]
-                next_state = elem[1]
-                vs_plus = self.states[next_state]['V']
-                value += pr * vs_plus
-            action_values.append(value)
+    def forward(self, state, legal=None):
+        if self.planner is not None and not self.is_known_state(state):
+            return self.planner.search(state)
+
+        state, transform = self.__canonical(state)
+        if legal is not None and transform is not None:
+            legal = self.symmetry.to_canonical_mask(transform, legal)
+        policy = self.compile_policy()
+        if policy is not None:
+            state_id = policy.id_of(state)
+            if state_id < 0:
+                raise KeyError(state)
+            if legal is None or legal == 0xF:
+                action = int(policy.best_action[state_id])
+            else:
+                action = self.__best_legal(policy.Q[state_id], legal)
+        elif legal is None:
+            action = int(np.argmax(self.states.action_values(state)))
+        else:
+            action = self.__best_legal(self.states.action_values(state), legal)
 
-        return np.argmax(action_values)
+        if transform is not None:
+            action = self.symmetry.from_canonical_action(transform, action)
+        return action
 
-    # Сохранение стратегии игрока
+    # Лучшее из доступных действий. Если доступных действий нет,
+    # то выбирается лучшее из всех
+    #
+    # Params:
+    # values: np.ndarray - ценности 4 действий или строки
+    # ценностей для набора состояний
+    # legal: int или np.ndarray - маска или маски доступных действий
+    #
+    # Returns -> int или np.ndarray
+    def __best_legal(self, values, legal):
+        mask = np.asarray(legal)[..., None] >> np.arange(4) & 1 != 0
+        mask |= ~mask.any(axis=-1, keepdims=True)
+        actions = np.argmax(np.where(mask, values, -np.inf), axis=-1)
+        return actions if actions.ndim else int(actions)
+
+    # Поиск действий и ценностей для набора состояний в собранной
+    # стратегии без обращения к планировщику
+    #
+    # Params:
+    # states: iterable - состояния среды
+    # legal: np.ndarray - маски доступных действий состояний (см.
+    # forward), может быть None
+    #
+    # Returns -> (np.ndarray, np.ndarray):
+    # Действия и ценности состояний, для состояний, которых
+    # нет в модели, - -1 и nan
+    def lookup_many(self, states, legal=None):
+        states = list(states)
+        if legal is not None:
+            legal = np.asarray(legal, dtype=np.int64)
+        actions = np.full(len(states), -1, dtype=np.int64)
+        values = np.full(len(states), np.nan)
+        policy = self.compile_policy()
+        if policy is None:
+            for i, state in enumerate(states):
+                if self.is_known_state(state):
+                    actions[i] = self.forward(state, None if legal is None else int(legal[i]))
+                    values[i] = self.get_state_value(state)
+            return actions, values
+
+        pairs = [self.__canonical(state) for state in states]
+        ids = policy.ids_of([state for state, _ in pairs])
+        known = np.nonzero(ids >= 0)[0]
+        actions[known] = policy.best_action[ids[known]]
+        values[known] = policy.V[ids[known]]
+        if legal is not None:
+            masks = legal[known]
+            if self.symmetry is not None:
+                masks = np.array([self.symmetry.to_canonical_mask(pairs[i][1], mask)
+                                  for i, mask in zip(known.tolist(), masks.tolist())],
+                                 dtype=np.int64)
+            partial = masks != 0xF
+            rows = known[partial]
+            actions[rows] = self.__best_legal(policy.Q[ids[rows]], masks[partial])
+        if self.symmetry is not None:
+            for i in known.tolist():
+                actions[i] = self.symmetry.from_canonical_action(pairs[i][1], actions[i])
+        return actions, values
+
+    # Вычисление следующих действий для набора состояний одним
+    # поиском в собранной стратегии. Состояния, которых нет
+    # в модели, передаются планировщику, если он подключён
+    #
+    # Params:
+    # states: iterable - состояния среды
+    # legal: np.ndarray - маски доступных действий состояний (см.
+    # forward), может быть None
+    #
+    # Returns -> np.ndarray:
+    # Следующие действия
+    def forward_many(self, states, legal=None):
+        states = list(states)
+        actions, _ = self.lookup_many(states, legal)
+        for i in np.nonzero(actions < 0)[0].tolist():
+            if self.planner is None:
+                raise KeyError(states[i])
+            actions[i] = self.planner.search(states[i])
+        return actions
+
+    # Имя файла стратегии для среды environment
     #
     # Params:
     # environment - среда
+    # extension: string - расширение файла
     #
-    # Returns -> void
-    def save(self, environment):
+    # Returns -> string
+    def __policy_filename(self, environment, extension):
         filename = 'policy'
-        filename += str(environment.rows) + 'x' + str(environment.rows)
-        filename += 'st' + str(len(self.states.keys()))
+        filename += str(environment.rows) + 'x' + str(environment.cols)
+        filename += 'st' + str(len(self.states))
         filename += 'm' + str(config.NEEDED)
-        filename += '.json'
+        filename += extension
+        return filename
 
+    # Сохранение стратегии игрока в бинарный файл
+    # (см. policy_file.write_policy)
+    #
+    # Params:
+    # environment - среда
+    #
+    # Returns -> string:
+    # Название файла со стратегией
+    def save(self, environment):
+        filename = self.__policy_filename(environment, '.bin')
+        os.makedirs(config.POLICIES_PATH, exist_ok=True)
+        write_policy(config.POLICIES_PATH + filename, self.states,
+                     environment.rows, environment.cols,
+                     config.NEEDED, config.Y, self.canonical, self.start_state)
+        return filename
+
+    # Сохранение контрольной точки изучения среды: модели
+    # с флагами решённости и состояния S0. Файл перезаписывается
+    # атомарно. Обучение продолжается загрузкой файла (Agent.load)
+    # и вызовом train с большим bound_of_states
+    #
+    # Params:
+    # environment - среда
+    # filename: string - название файла, по умолчанию
+    # checkpoint{rows}x{cols}m{NEEDED}.ckpt
+    #
+    # Returns -> string:
+    # Название файла контрольной точки
+    def checkpoint(self, environment, filename=None):
+        if filename is None:
+            filename = 'checkpoint' + str(environment.rows) + 'x' + str(environment.cols)
+            filename += 'm' + str(config.NEEDED) + '.ckpt'
+        os.makedirs(config.POLICIES_PATH, exist_ok=True)
+        path = config.POLICIES_PATH + filename
+        write_policy(path + '.tmp', self.states,
+                     environment.rows, environment.cols,
+                     config.NEEDED, config.Y, self.canonical, self.start_state)
+        os.replace(path + '.tmp', path)
+        return filename
+
+    # Экспорт стратегии игрока в JSON в формате вложенных словарей
+    #
+    # Params:
+    # environment - среда
+    #
+    # Returns -> string:
+    # Название файла со стратегией
+    def export_json(self, environment):
+        filename = self.__policy_filename(environment, '.json')
+        os.makedirs(config.POLICIES_PATH, exist_ok=True)
         with open(config.POLICIES_PATH + filename, 'w') as f:
-            json.dump(self.states, f)
+            json.dump(self.states.to_dict(), f)
+        return filename
 
-    # Загрузка стратегии игрока из файла filename
+    # Загрузка стратегии игрока из бинарного файла filename.
+    # Файл отображается в память, а не читается целиком
     #
     # Params:
     # filename: string - название файла со стратегией
     #
-    # Returns -> void
+    # Returns -> dict:
+    # Заголовок файла: размер поля, победное значение ячейки,
+    # коэффициент дисконтирования и количество состояний
     def load(self, filename):
-        with open(config.POLICIES_PATH + filename, 'r') as f:
-            self.states = json.load(self.states, f)
+        self.states, header = read_policy(config.POLICIES_PATH + filename)
+        self.canonical = header['canonical']
+        self.start_state = header['start_state']
+        self.symmetry = None
+        self.init_symmetry(header['rows'], header['cols'])
+        return header
@@ -1,5 +1,64 @@
 import pygame as pg
 import config
+import instrumentation
+
+
+# Загруженные шрифты: размер -> шрифт
+_fonts = {}
+
+# Готовые поверхности ячеек: (число, ширина, высота) -> поверхность
+_tiles = {}
+
+
+# Шрифт config.FONT заданного размера. Файл шрифта
+# читается с диска один раз на размер
+#
+# Params:
+# size: int - размер шрифта
+#
+# Returns -> pg.font.Font
+def get_font(size):
+    font = _fonts.get(size)
+    if font is None:
+        font = pg.font.Font(config.FONT, size)
+        _fonts[size] = font
+    return font
+
+
+# Поверхность ячейки с числом number. Поверхность рисуется
+# один раз и затем берётся из кэша
+#
+# Params:
+# number: int - число в ячейке
+# width: int - ширина ячейки
+# height: int - высота ячейки
+#
+# Returns -> pg.Surface
+def get_tile_surface(number, width, height):
+    key = (number, width, height)
+    surface = _tiles.get(key)
+    if surface is not None:
+        return surface
+
+    surface = pg.Surface((width, height))
+    surface.fill((242, 237, 173) if number != 0 else (223, 222, 210))
+    if number != 0:
+        if number < 64:
+            color = (249, 178, 108)
+        elif number < 128:
+            color = (237, 137, 31)
+        else:
+            color = (255, 0, 0)
+        text_surface = get_font(24).render(f"{number}", True, color)
+        surface.blit(
+            text_surface,
+            (
+                width/2-text_surface.get_width()/2,
+                height/2-text_surface.get_height()/2
+            )
+        )
+    _tiles[key] = surface
+    return surface
 
 
 class Tile(pg.sprite.Sprite):
@@ -9,28 +68,23 @@ class Tile(pg.sprite.Sprite):
         self.width = width
         self.bg = pg.Rect(0, 0, width-10, height-10)
         self.bg.center = (center_x, center_y)
-        self.GAME_FONT = pg.font.Font(config.FONT, 24)
-
-    def draw(self, screen):
-        pg.draw.rect(screen, (242, 237, 173), self.bg) if self.number != 0 else pg.draw.rect(
-            screen, (223, 222, 210), self.bg)
-        if self.number < 64:
-            text_surface = self.GAME_FONT.render(
-                f"{self.number}", True, (249, 178, 108))
-        elif self.number < 128:
-            text_surface = self.GAME_FONT.render(
-                f"{self.number}", True, (237, 137, 31))
-        else:
-            text_surface = self.GAME_FONT.render(
-                f"{self.number}", True, (255, 0, 0))
-        if self.number != 0:
-            screen.blit(
-                text_surface,
-                (
-                    self.bg.centerx-text_surface.get_width()/2,
-                    self.bg.centery-text_surface.get_height()/2
-                )
-            )
+        self.drawn_number = None
+
+    # Отрисовка ячейки, если её число изменилось
+    # с прошлой отрисовки
+    #
+    # Params:
+    # screen: pg.Surface - экран
+    # force: bool - если True, то ячейка рисуется в любом случае
+    #
+    # Returns -> pg.Rect:
+    # Перерисованная область или None
+    def draw(self, screen, force=False):
+        if not force and self.number == self.drawn_number:
+            return None
+        screen.blit(get_tile_surface(self.number, self.bg.width, self.bg.height), self.bg)
+        self.drawn_number = self.number
+        return self.bg
 
 
 class App2048(pg.sprite.Sprite):
@@ -66,11 +120,25 @@ class App2048(pg.sprite.Sprite):
             self.tiles.append(row)
         self.game_over = False
 
-    def draw(self, screen):
-        pg.draw.rect(screen, (171, 180, 172), self.bg)
+    # Отрисовка игрового поля
+    #
+    # Params:
+    # screen: pg.Surface - экран
+    # force: bool - если True, то поле рисуется целиком,
+    # иначе только изменившиеся ячейки
+    #
+    # Returns -> list:
+    # Перерисованные области
+    def draw(self, screen, force=False):
+        if force:
+            pg.draw.rect(screen, (171, 180, 172), self.bg)
+        dirty = [self.bg] if force else []
         for row in self.tiles:
             for tile in row:
-                tile.draw(screen)
+                rect = tile.draw(screen, force)
+                if rect is not None and not force:
+                    dirty.append(rect)
+        return dirty
 
     def update(self, game_state):
         for row in range(self.tiles_count):
@@ -82,7 +150,7 @@ class App:
     def __init__(self, environment):
         pg.init()
         pg.font.init()
-        self.font = pg.font.Font(config.FONT, 16)
+        self.font = get_font(16)
         self.screen = pg.display.set_mode((config.WIDTH, config.HEIGHT))
         pg.display.set_caption("2048")
 
@@ -92,34 +160,59 @@ class App:
         self.game = App2048(environment.rows)
         self.game.init()
 
+        # Строки состояния: позиция -> (текст, поверхность, область)
+        self.status = {}
+        self.redraw = True
+
     def update(self, environment):
         for event in pg.event.get():
             if event.type == pg.QUIT:
                 self.run = False
+            elif event.type in (pg.VIDEOEXPOSE, pg.WINDOWEXPOSED):
+                self.redraw = True
 
         self.game.update(environment.game)
 
+    # Отрисовка строки состояния, если её текст изменился
+    #
+    # Params:
+    # position: tuple - левый верхний угол строки
+    # text: string - текст строки
+    #
+    # Returns -> list:
+    # Перерисованные области
+    def __draw_status(self, position, text):
+        cached = self.status.get(position)
+        if cached is not None and cached[0] == text and not self.redraw:
+            return []
+
+        dirty = []
+        if cached is not None:
+            self.screen.fill((255, 255, 255), cached[2])
+            dirty.append(cached[2])
+
+        if cached is not None and cached[0] == text:
+            surface = cached[1]
+        else:
+            surface = self.font.render(text, True, (0, 0, 0))
+        rect = self.screen.blit(surface, position)
+        self.status[position] = (text, surface, rect)
+        dirty.append(rect)
+        return dirty
+
+    @instrumentation.timed('app.draw')
     def draw(self, value, action):
         self.clock.tick(config.FPS)
-        self.screen.fill((255, 255, 255))
-        value_surface = self.font.render(
-                f"Ценность состояния: {value}", True, (0, 0, 0))
-        action_surface = self.font.render(
-                "Действие: " + action, True, (0, 0, 0))
-        
-        self.screen.blit(
-            value_surface,
-            (
-                self.game.width + 20,
-                60
-            )
-        )
-        self.screen.blit(
-            action_surface,
-            (
-                self.game.width + 20,
-                80
-            )
-        )
-        self.game.draw(self.screen)
-        pg.display.flip()
\ No newline at end of file
+        redraw = self.redraw
+        if redraw:
+            self.screen.fill((255, 255, 255))
+
+        dirty = self.__draw_status((self.game.width + 20, 60), f"Ценность состояния: {value}")
+        dirty += self.__draw_status((self.game.width + 20, 80), "Действие: " + action)
+        dirty += self.game.draw(self.screen, redraw)
+
+        if redraw:
+            pg.display.flip()
+            self.redraw = False
+        elif dirty:
+            pg.display.update(dirty)
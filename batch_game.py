@@ -0,0 +1,271 @@
+import numpy as np
+import codec
+import config
+from bitboard import get_tables
+
+
+class BatchGame2048:
+
+    # Набор из count независимых игр 2048, которые
+    # совершают ходы одновременно. Поля хранятся в одном массиве
+    # формы (count, rows, cols) в виде степеней двойки
+    # (0 - пустая ячейка). Правила совпадают с BitGame2048:
+    # новая ячейка выбирается одним случайным числом на игру
+    # (см. RandomStream.spawn), игра окончена, когда после
+    # появления новой ячейки нет доступных действий. Одна игра
+    # с тем же зерном повторяет BitGame2048 в точности
+    #
+    # Params:
+    # count: int - количество игр
+    # rows: int - количество строк на игровом поле
+    # cols: int - количество столбцов на игровом поле.
+    # Необязательный параметр, если не задан, то
+    # cols = rows
+    # seed: int - зерно генератора случайных чисел. Если не задано,
+    # то берётся из глобального генератора NumPy, как в RandomStream
+    def __init__(self, count, rows, cols=None, seed=None):
+        self.count = count
+        self.rows = rows
+        self.cols = rows if cols is None else cols
+        if seed is None:
+            seed = int(np.random.randint(0, 2 ** 63 - 1, dtype=np.int64))
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+        self.boards = np.zeros((count, self.rows, self.cols), dtype=np.uint8)
+        self.max_tile_value = np.full(count, 2, dtype=np.int64)
+        self.legal = np.zeros(count, dtype=np.uint8)
+        self.game_over = np.zeros(count, dtype=bool)
+        self.start_state = None
+
+        row_tables = get_tables(self.cols)
+        col_tables = get_tables(self.rows)
+        self.__row_left = row_tables.as_array('left')
+        self.__row_right = row_tables.as_array('right')
+        self.__col_left = col_tables.as_array('left')
+        self.__col_right = col_tables.as_array('right')
+        self.__row_score_left = row_tables.as_array('score_left')
+        self.__row_score_right = row_tables.as_array('score_right')
+        self.__col_score_left = col_tables.as_array('score_left')
+        self.__col_score_right = col_tables.as_array('score_right')
+        self.__row_legal = row_tables.as_array('legal')
+        self.__col_legal = col_tables.as_array('legal')
+        self.__row_weights = np.uint64(16) ** np.arange(self.cols, dtype=np.uint64)
+        self.__col_weights = np.uint64(16) ** np.arange(self.rows, dtype=np.uint64)
+
+    # Игровые поля в виде чисел в ячейках
+    #
+    # Returns -> np.ndarray:
+    # Массив формы (count, rows, cols)
+    @property
+    def game(self):
+        return np.where(self.boards > 0, np.left_shift(1, self.boards, dtype=np.int64), 0)
+
+    # Упаковка линий в индексы таблиц переходов
+    #
+    # Params:
+    # lines: np.ndarray - массив формы (..., length) степеней двойки
+    # weights: np.ndarray - степени 16 для каждой ячейки линии
+    #
+    # Returns -> np.ndarray
+    def __pack(self, lines, weights):
+        return lines.astype(np.uint64) @ weights
+
+    # Распаковка индексов таблиц переходов в линии
+    #
+    # Params:
+    # packed: np.ndarray - упакованные линии
+    # length: int - количество ячеек в линии
+    #
+    # Returns -> np.ndarray:
+    # Массив формы (..., length) степеней двойки
+    def __unpack(self, packed, length):
+        shifts = np.arange(0, 4 * length, 4, dtype=np.uint64)
+        return ((packed[..., None] >> shifts) & np.uint64(0xF)).astype(np.uint8)
+
+    # Применение хода к части полей
+    #
+    # Params:
+    # boards: np.ndarray - поля формы (n, rows, cols)
+    # action: int - игровое действие
+    #
+    # Returns -> np.ndarray:
+    # Поля после хода
+    def __move(self, boards, action):
+        if action == 0 or action == 2:
+            table = self.__row_left if action == 0 else self.__row_right
+            packed = self.__pack(boards, self.__row_weights)
+            return self.__unpack(table[packed], self.cols)
+
+        table = self.__col_left if action == 1 else self.__col_right
+        packed = self.__pack(boards.transpose(0, 2, 1), self.__col_weights)
+        return self.__unpack(table[packed], self.rows).transpose(0, 2, 1)
+
+    # Очки за слияния при ходе action на каждом поле
+    #
+    # Params:
+    # boards: np.ndarray - поля формы (n, rows, cols)
+    # action: int - игровое действие
+    #
+    # Returns -> np.ndarray:
+    # Очки формы (n,)
+    def __score(self, boards, action):
+        if action == 0 or action == 2:
+            table = self.__row_score_left if action == 0 else self.__row_score_right
+            packed = self.__pack(boards, self.__row_weights)
+        else:
+            table = self.__col_score_left if action == 1 else self.__col_score_right
+            packed = self.__pack(boards.transpose(0, 2, 1), self.__col_weights)
+        return table[packed].sum(axis=1).astype(np.int64)
+
+    # Маски доступных действий для каждого поля по таблицам
+    # линий (см. BitEngine.legal_lines)
+    #
+    # Params:
+    # boards: np.ndarray - поля формы (n, rows, cols)
+    #
+    # Returns -> np.ndarray:
+    # Массив uint8 формы (n,)
+    def __legal(self, boards):
+        rows = self.__pack(boards, self.__row_weights)
+        cols = self.__pack(boards.transpose(0, 2, 1), self.__col_weights)
+        horizontal = np.bitwise_or.reduce(self.__row_legal[rows], axis=1)
+        vertical = np.bitwise_or.reduce(self.__col_legal[cols], axis=1)
+        return ((horizontal & 1) | (horizontal & 2) << 1 |
+                (vertical & 1) << 1 | (vertical & 2) << 2)
+
+    # Пересчёт максимального значения ячейки, масок доступных
+    # действий и окончания игр
+    #
+    # Params:
+    # index: np.ndarray - номера игр
+    #
+    # Returns -> void
+    def __update_status(self, index):
+        self.max_tile_value[index] = self.get_max_tile()[index]
+        self.legal[index] = self.__legal(self.boards[index])
+        self.game_over[index] = self.legal[index] == 0
+
+    # Добавление новой ячейки на поля, где есть место. На каждое
+    # такое поле тратится одно случайное число: целая часть
+    # u * free - номер свободной ячейки в порядке строк, дробная
+    # часть решает, будет ли в ней 4 (см. RandomStream.spawn)
+    #
+    # Params:
+    # boards: np.ndarray - поля формы (n, rows, cols)
+    #
+    # Returns -> void
+    def __add_elem(self, boards):
+        flat = boards.reshape(len(boards), -1)
+        free = flat == 0
+        counts = free.sum(axis=1)
+        index = np.nonzero(counts)[0]
+
+        scaled = self.rng.random(len(index)) * counts[index]
+        cells = np.floor(scaled)
+        values = np.where(scaled - cells < config.PROB_OF_4, 2, 1)
+        cells = (np.cumsum(free[index], axis=1) > cells[:, None]).argmax(axis=1)
+        flat[index, cells] = values
+
+    # Перевод игр в начальное состояние
+    #
+    # Params:
+    # start_state: bool - если True, то переводит игры
+    # в состояние S0
+    # mask: np.ndarray - массив bool формы (count,), если задан,
+    # то переводятся только отмеченные игры
+    #
+    # Returns -> void
+    def init(self, start_state=False, mask=None):
+        index = np.arange(self.count) if mask is None else np.nonzero(mask)[0]
+
+        if start_state:
+            self.boards[index] = self.start_state[index]
+        else:
+            self.boards[index] = 0
+            cells = (self.rng.random(len(index)) * (self.rows * self.cols)).astype(np.int64)
+            flat = self.boards.reshape(self.count, -1)
+            flat[index, cells] = 1
+            if self.start_state is None:
+                self.start_state = self.boards.copy()
+            else:
+                self.start_state[index] = self.boards[index]
+
+        self.__update_status(index)
+
+    # Вычисление максимального значения ячейки на каждом поле
+    #
+    # Returns -> np.ndarray
+    def get_max_tile(self):
+        max_exp = self.boards.max(axis=(1, 2)).astype(np.int64)
+        return np.where(max_exp > 0, np.left_shift(1, max_exp), 0)
+
+    # Получение состояний игр в формате codec.encode
+    #
+    # Returns -> np.ndarray:
+    # Массив uint64 формы (count,)
+    def get_state(self):
+        return codec.encode_batch(self.boards, exponents=True)
+
+    # Вычисление числовых значений игр
+    #
+    # Returns -> np.ndarray:
+    # Суммы всех чисел в ячейках каждого поля
+    def get_value(self):
+        return self.game.sum(axis=(1, 2))
+
+    # Получение количества свободных ячеек на каждом поле
+    #
+    # Returns -> np.ndarray
+    def get_free_tiles(self):
+        return (self.boards == 0).sum(axis=(1, 2))
+
+    # Маски доступных действий: бит action установлен, если
+    # ход action меняет поле
+    #
+    # Returns -> np.ndarray:
+    # Массив uint8 формы (count,)
+    def legal_actions(self):
+        return self.legal
+
+    # Совершение игровых действий во всех играх
+    #
+    # Params:
+    # actions: np.ndarray - массив действий формы (count,):
+    #   0 - Влево
+    #   1 - Вверх
+    #   2 - Вправо
+    #   3 - Вниз
+    #
+    # Returns -> void
+    def forward(self, actions):
+        actions = np.asarray(actions)
+        for action in range(4):
+            index = np.nonzero(actions == action)[0]
+            if len(index):
+                self.boards[index] = self.__move(self.boards[index], action)
+
+        self.__add_elem(self.boards)
+        self.__update_status(np.arange(self.count))
+
+    # Поля после каждого из 4 ходов без появления новой ячейки
+    # (послеходовые состояния) и очки за слияния
+    #
+    # Returns -> (np.ndarray, np.ndarray):
+    # Поля формы (4, count, rows, cols) и очки формы (4, count)
+    def afterstates(self):
+        afters = np.stack([self.__move(self.boards, action) for action in range(4)])
+        scores = np.stack([self.__score(self.boards, action) for action in range(4)])
+        return afters, scores
+
+    # Переход всех игр в заданные послеходовые состояния
+    # и появление новой ячейки
+    #
+    # Params:
+    # afters: np.ndarray - поля после хода формы (count, rows, cols)
+    #
+    # Returns -> void
+    def step(self, afters):
+        self.boards[:] = afters
+        self.__add_elem(self.boards)
+        self.__update_status(np.arange(self.count))
@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+from time import perf_counter
+import numpy as np
+import codec
+import config
+from agent import Agent
+from bitboard import BitGame2048
+from game import Game2048
+
+
+# Направление улучшения метрик: 1 - чем больше, тем лучше,
+# -1 - чем меньше, тем лучше
+METRICS = {
+    'game_moves_per_sec': 1,
+    'bitgame_moves_per_sec': 1,
+    'codec_roundtrips_per_sec': 1,
+    'codec_batch_roundtrips_per_sec': 1,
+    'train_states_per_sec': 1,
+    'solve_sec_per_state': -1,
+    'states_peak_memory_bytes': -1,
+    'save_states_per_sec': 1,
+    'load_states_per_sec': 1,
+    'render_fps': 1,
+}
+
+# Количество состояний для обучения на каждом размере поля
+TRAIN_STATES = {2: 300, 3: 20000, 4: 20000}
+# Количество частей, на которые делится обучение для замера
+# пиковой памяти модели
+MEMORY_SAMPLES = 20
+
+
+class Benchmark:
+
+    # Набор замеров производительности горячих участков:
+    # ходы среды, обучение, решение, сохранение и загрузка
+    # стратегии и отрисовка без окна. Все замеры используют
+    # фиксированное зерно config.SEED
+    #
+    # Params:
+    # sizes: list - размеры полей
+    # duration: float - длительность замера скорости ходов в секундах
+    # render: bool - если True, то замеряется отрисовка
+    def __init__(self, sizes=(2, 3, 4), duration=1.0, render=True):
+        self.sizes = sizes
+        self.duration = duration
+        self.render = render
+
+    # Замер количества ходов в секунду
+    #
+    # Params:
+    # environment_class - класс среды
+    # size: int - размер поля
+    #
+    # Returns -> float
+    def moves_per_sec(self, environment_class, size):
+        np.random.seed(config.SEED)
+        environment = environment_class(size)
+        environment.init()
+        actions = np.random.randint(0, 4, 4096).tolist()
+
+        moves = 0
+        start_time = perf_counter()
+        while perf_counter() - start_time < self.duration:
+            for action in actions:
+                environment.forward(action)
+                if environment.game_over:
+                    environment.init()
+            moves += len(actions)
+        return moves / (perf_counter() - start_time)
+
+    # Замер упаковки и распаковки состояний: по одному полю
+    # и пакетами по 4096 полей
+    #
+    # Params:
+    # size: int - размер поля
+    #
+    # Returns -> dict
+    def codec_metrics(self, size):
+        rng = np.random.default_rng(config.SEED)
+        exps = rng.integers(0, 12, (4096, size, size))
+        boards = np.where(exps > 0, np.left_shift(1, exps), 0)
+        games = boards.tolist()
+
+        roundtrips = 0
+        start_time = perf_counter()
+        while perf_counter() - start_time < self.duration:
+            for game in games:
+                codec.decode(codec.encode(game), size, size)
+            roundtrips += len(games)
+        scalar = roundtrips / (perf_counter() - start_time)
+
+        results = {'codec_roundtrips_per_sec': scalar}
+        if size * size * codec.CELL_BITS <= 64:
+            roundtrips = 0
+            start_time = perf_counter()
+            while perf_counter() - start_time < self.duration:
+                codec.decode_batch(codec.encode_batch(boards), size, size)
+                roundtrips += len(boards)
+            results['codec_batch_roundtrips_per_sec'] = roundtrips / (perf_counter() - start_time)
+        return results
+
+    # Замер обучения, решения, сохранения и загрузки.
+    # Память модели - наибольший StateStore.memory_usage за время
+    # обучения и решения: обучение идёт частями, и память
+    # замеряется после каждой части вне замера времени
+    #
+    # Params:
+    # size: int - размер поля
+    #
+    # Returns -> dict
+    def model_metrics(self, size):
+        np.random.seed(config.SEED)
+        environment = BitGame2048(size)
+        agent = Agent()
+
+        train_time = 0
+        peak_memory = 0
+        for part in range(1, MEMORY_SAMPLES + 1):
+            start_time = perf_counter()
+            agent.train(environment, TRAIN_STATES[size] * part // MEMORY_SAMPLES,
+                        config.NEEDED, verbose=False)
+            train_time += perf_counter() - start_time
+            peak_memory = max(peak_memory, agent.states.memory_usage()['total'])
+        states = len(agent.states)
+
+        start_time = perf_counter()
+        agent.create_policy(environment)
+        solve_time = perf_counter() - start_time
+        peak_memory = max(peak_memory, agent.states.memory_usage()['total'])
+
+        results = {
+            'states': states,
+            'train_states_per_sec': states / train_time,
+            'solve_sec_per_state': solve_time / states,
+            'states_peak_memory_bytes': peak_memory,
+        }
+
+        policies_path = config.POLICIES_PATH
+        with tempfile.TemporaryDirectory() as directory:
+            config.POLICIES_PATH = directory + '/'
+            try:
+                start_time = perf_counter()
+                filename = agent.save(environment)
+                results['save_states_per_sec'] = states / (perf_counter() - start_time)
+
+                start_time = perf_counter()
+                loaded = Agent()
+                loaded.load(filename)
+                loaded.forward(environment.start_state)
+                results['load_states_per_sec'] = states / (perf_counter() - start_time)
+                del loaded
+            finally:
+                config.POLICIES_PATH = policies_path
+
+        return results
+
+    # Замер кадров в секунду при отрисовке без окна
+    #
+    # Params:
+    # size: int - размер поля
+    #
+    # Returns -> float:
+    # Кадры в секунду или None, если pygame недоступен
+    def render_fps(self, size):
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        try:
+            from app import App
+        except ImportError:
+            return None
+
+        np.random.seed(config.SEED)
+        environment = BitGame2048(size)
+        environment.init()
+        fps = config.FPS
+        config.FPS = 0
+        try:
+            app = App(environment)
+            frames = 0
+            start_time = perf_counter()
+            while perf_counter() - start_time < self.duration:
+                environment.forward(frames % 4)
+                if environment.game_over:
+                    environment.init()
+                app.update(environment)
+                app.draw(value=frames, action=config.ACTION_ARROWS[frames % 4])
+                frames += 1
+            return frames / (perf_counter() - start_time)
+        finally:
+            config.FPS = fps
+
+    # Запуск всех замеров
+    #
+    # Returns -> dict:
+    # Описание окружения и результаты по размерам полей
+    def run(self):
+        results = {}
+        for size in self.sizes:
+            name = str(size) + 'x' + str(size)
+            print('Замер ' + name)
+            metrics = {
+                'game_moves_per_sec': self.moves_per_sec(Game2048, size),
+                'bitgame_moves_per_sec': self.moves_per_sec(BitGame2048, size),
+            }
+            metrics.update(self.codec_metrics(size))
+            metrics.update(self.model_metrics(size))
+            if self.render:
+                metrics['render_fps'] = self.render_fps(size)
+            results[name] = metrics
+
+        return {
+            'meta': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'seed': config.SEED,
+                'needed': config.NEEDED,
+            },
+            'results': results,
+        }
+
+
+# Сравнение результатов с базовыми
+#
+# Params:
+# report: dict - текущие результаты
+# baseline: dict - базовые результаты
+# threshold: float - допустимое относительное ухудшение
+#
+# Returns -> list:
+# Описания регрессий
+def compare(report, baseline, threshold):
+    regressions = []
+    for name, metrics in report['results'].items():
+        base_metrics = baseline['results'].get(name, {})
+        for metric, direction in METRICS.items():
+            value = metrics.get(metric)
+            base = base_metrics.get(metric)
+            if value is None or not base:
+                continue
+            change = direction * (value - base) / base
+            if change < -threshold:
+                regressions.append(name + ' ' + metric + ': ' + format(base, '.4g') +
+                                   ' -> ' + format(value, '.4g') +
+                                   ' (' + format(change * 100, '+.1f') + '%)')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Замеры производительности 2048_MDP')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2, 3, 4])
+    parser.add_argument('--duration', type=float, default=1.0)
+    parser.add_argument('--no-render', action='store_true')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    report = Benchmark(args.sizes, args.duration, not args.no_render).run()
+    print(json.dumps(report['results'], indent=2))
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for regression in regressions:
+            print('Регрессия: ' + regression)
+        if regressions:
+            raise SystemExit(1)
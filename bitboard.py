@@ -0,0 +1,611 @@
+from array import array
+import numpy as np
+import codec
+import instrumentation
+from random_stream import RandomStream
+from exception import AttributeError
+
+
+# Кэш таблиц переходов, ключ - длина линии
+_TABLES = {}
+
+
+# Ход влево для одной линии поля, записанной в виде
+# степеней двойки. Повторяет алгоритм Game2048.__switch_left
+#
+# Params:
+# line: list - степени двойки в ячейках линии (0 - пустая ячейка)
+#
+# Returns -> (list, int):
+# Линия после хода и прирост счёта от слияний
+def _slide_line(line):
+    line = list(line)
+    score = 0
+    j = 0
+    while j < len(line):
+        if j != 0:
+            if line[j] != 0 and line[j-1] == line[j]:
+                line[j-1] = min(line[j-1] + 1, 15)
+                line[j] = 0
+                score += 1 << line[j-1]
+                continue
+            if line[j] != 0 and line[j-1] == 0:
+                line[j-1] = line[j]
+                line[j] = 0
+                j -= 1
+                continue
+        j += 1
+    return line, score
+
+
+# Упаковка линии в целое число по 4 бита на ячейку
+#
+# Params:
+# line: list - степени двойки в ячейках линии
+#
+# Returns -> int:
+# Упакованная линия, ячейка с индексом 0 в младших битах
+def _pack_line(line):
+    packed = 0
+    for k, exp in enumerate(line):
+        packed |= exp << (4 * k)
+    return packed
+
+
+class LineTables:
+
+    # Предвычисленные таблицы переходов для линии длины length.
+    # Индекс таблицы - упакованная линия (4 бита на ячейку).
+    # Таблица legal: бит 0 - ход влево сдвигает линию,
+    # бит 1 - ход вправо сдвигает линию
+    #
+    # Params:
+    # length: int - количество ячеек в линии
+    def __init__(self, length):
+        self.length = length
+        size = 1 << (4 * length)
+        self.left = array('Q', bytes(8 * size))
+        self.right = array('Q', bytes(8 * size))
+        self.score_left = array('Q', bytes(8 * size))
+        self.score_right = array('Q', bytes(8 * size))
+        self.max_exp = array('B', bytes(size))
+        self.free = array('B', bytes(size))
+        self.value = array('Q', bytes(8 * size))
+        self.legal = array('B', bytes(size))
+
+        for packed in range(size):
+            line = [(packed >> (4 * k)) & 0xF for k in range(length)]
+
+            moved, score = _slide_line(line)
+            self.left[packed] = _pack_line(moved)
+            self.score_left[packed] = score
+
+            moved, score = _slide_line(line[::-1])
+            self.right[packed] = _pack_line(moved[::-1])
+            self.score_right[packed] = score
+
+            self.max_exp[packed] = max(line)
+            self.free[packed] = line.count(0)
+            self.value[packed] = sum(1 << exp for exp in line if exp > 0)
+            self.legal[packed] = ((self.left[packed] != packed) |
+                                  (self.right[packed] != packed) << 1)
+
+    # Представление таблицы в виде массива NumPy без копирования
+    #
+    # Params:
+    # name: string - название таблицы
+    #
+    # Returns -> np.ndarray
+    def as_array(self, name):
+        table = getattr(self, name)
+        dtype = np.uint8 if table.typecode == 'B' else np.uint64
+        return np.frombuffer(table, dtype=dtype)
+
+
+# Получение таблиц переходов для линии длины length.
+# Таблицы строятся один раз и кэшируются
+#
+# Params:
+# length: int - количество ячеек в линии
+#
+# Returns -> LineTables
+def get_tables(length):
+    if length not in _TABLES:
+        _TABLES[length] = LineTables(length)
+    return _TABLES[length]
+
+
+# Таблица переноса линии в другие позиции поля: k-я ячейка
+# линии попадает в ячейку с номером offset + k * step
+#
+# Params:
+# length: int - количество ячеек в линии
+# offset: int - номер ячейки поля для первой ячейки линии
+# step: int - шаг между ячейками поля
+#
+# Returns -> array
+def _spread_table(length, offset, step):
+    packed = np.arange(1 << (4 * length), dtype=np.uint64)
+    spread = np.zeros_like(packed)
+    for k in range(length):
+        nibble = (packed >> np.uint64(4 * k)) & np.uint64(0xF)
+        spread |= nibble << np.uint64(4 * (offset + k * step))
+    return array('Q', spread.tobytes())
+
+
+class BitEngine:
+
+    # Движок ходов по упакованному полю: каждая ячейка хранит
+    # степень двойки в 4 битах, ячейка (i, j) находится
+    # в битах начиная с 4 * (i * cols + j)
+    #
+    # Params:
+    # rows: int - количество строк на игровом поле
+    # cols: int - количество столбцов на игровом поле
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.row_tables = get_tables(cols)
+        self.col_tables = get_tables(rows)
+        self.row_mask = (1 << (4 * cols)) - 1
+        self.col_mask = (1 << (4 * rows)) - 1
+        self.row_shifts = [4 * cols * i for i in range(rows)]
+        self.col_shifts = [4 * rows * j for j in range(cols)]
+        self.cell_shifts = [[4 * (i * cols + j) for j in range(cols)]
+                            for i in range(rows)]
+        # Транспонирование: строка i поля становится i-й ячейкой
+        # каждого столбца, столбец j - j-й ячейкой каждой строки
+        self.__to_cols = [_spread_table(cols, i, rows) for i in range(rows)]
+        self.__from_cols = [_spread_table(rows, j, cols) for j in range(cols)]
+
+    # Извлечение строк поля
+    #
+    # Params:
+    # board: int - упакованное поле
+    #
+    # Returns -> list:
+    # Упакованные строки сверху вниз
+    def get_rows(self, board):
+        mask = self.row_mask
+        return [(board >> shift) & mask for shift in self.row_shifts]
+
+    # Извлечение столбцов поля
+    #
+    # Params:
+    # board: int - упакованное поле
+    #
+    # Returns -> list:
+    # Упакованные столбцы слева направо, верхняя ячейка в младших битах
+    def get_cols(self, board):
+        return self.transpose(self.get_rows(board))
+
+    # Столбцы поля по его строкам
+    #
+    # Params:
+    # rows: list - упакованные строки сверху вниз
+    #
+    # Returns -> list:
+    # Упакованные столбцы слева направо, верхняя ячейка в младших битах
+    def transpose(self, rows):
+        transposed = 0
+        for table, row in zip(self.__to_cols, rows):
+            transposed |= table[row]
+        mask = self.col_mask
+        return [(transposed >> shift) & mask for shift in self.col_shifts]
+
+    # Совершение игрового действия над строками и столбцами
+    # поля. Строки результата возвращаются вместе с полем,
+    # поэтому игре не нужно снова разбирать поле на линии перед
+    # следующим ходом. Столбцы возвращаются, только если они
+    # получились при ходе (вверх или вниз), иначе - None
+    #
+    # Params:
+    # rows: list - упакованные строки поля
+    # cols: list - упакованные столбцы поля, может быть None
+    # action: int - игровое действие (0 - влево, 1 - вверх,
+    # 2 - вправо, 3 - вниз)
+    #
+    # Returns -> (int, list, list, int):
+    # Поле после хода, его строки и столбцы и прирост счёта
+    def move_lines(self, rows, cols, action):
+        board = 0
+        if action == 0 or action == 2:
+            tables = self.row_tables
+            table = tables.left if action == 0 else tables.right
+            scores = tables.score_left if action == 0 else tables.score_right
+            moved = list(map(table.__getitem__, rows))
+            for row, shift in zip(moved, self.row_shifts):
+                board |= row << shift
+            return board, moved, None, sum(map(scores.__getitem__, rows))
+
+        if cols is None:
+            cols = self.transpose(rows)
+        tables = self.col_tables
+        table = tables.left if action == 1 else tables.right
+        scores = tables.score_left if action == 1 else tables.score_right
+        moved = list(map(table.__getitem__, cols))
+        for col, spread in zip(moved, self.__from_cols):
+            board |= spread[col]
+        return board, self.get_rows(board), moved, sum(map(scores.__getitem__, cols))
+
+    # Совершение игрового действия над полем
+    #
+    # Params:
+    # board: int - упакованное поле
+    # action: int - игровое действие (0 - влево, 1 - вверх,
+    # 2 - вправо, 3 - вниз)
+    #
+    # Returns -> (int, int):
+    # Поле после хода и прирост счёта от слияний
+    def move(self, board, action):
+        result = 0
+        score = 0
+        if action == 0 or action == 2:
+            tables = self.row_tables
+            table = tables.left if action == 0 else tables.right
+            scores = tables.score_left if action == 0 else tables.score_right
+            for row, shift in zip(self.get_rows(board), self.row_shifts):
+                result |= table[row] << shift
+                score += scores[row]
+            return result, score
+
+        tables = self.col_tables
+        table = tables.left if action == 1 else tables.right
+        scores = tables.score_left if action == 1 else tables.score_right
+        for col, spread in zip(self.get_cols(board), self.__from_cols):
+            result |= spread[table[col]]
+            score += scores[col]
+        return result, score
+
+    # Максимальная степень двойки на поле
+    #
+    # Params:
+    # board: int - упакованное поле
+    #
+    # Returns -> int
+    def max_exp(self, board):
+        max_exp = self.row_tables.max_exp
+        return max(max_exp[row] for row in self.get_rows(board))
+
+    # Количество свободных ячеек на поле
+    #
+    # Params:
+    # board: int - упакованное поле
+    #
+    # Returns -> int
+    def free_cells(self, board):
+        free = self.row_tables.free
+        return sum(free[row] for row in self.get_rows(board))
+
+    # Максимальная степень двойки и количество свободных
+    # ячеек за один проход по строкам поля
+    #
+    # Params:
+    # board: int - упакованное поле
+    #
+    # Returns -> (int, int)
+    def stats(self, board):
+        tables = self.row_tables
+        rows = self.get_rows(board)
+        return max(tables.max_exp[row] for row in rows), sum(tables.free[row] for row in rows)
+
+    # Сумма всех чисел на поле
+    #
+    # Params:
+    # board: int - упакованное поле
+    #
+    # Returns -> int
+    def value(self, board):
+        value = self.row_tables.value
+        return sum(value[row] for row in self.get_rows(board))
+
+    # Маска доступных действий: бит action установлен, если
+    # ход action сдвигает поле. Строится по таблицам legal строк
+    # и столбцов
+    #
+    # Params:
+    # board: int - упакованное поле
+    #
+    # Returns -> int
+    def legal_actions(self, board):
+        rows = self.get_rows(board)
+        return self.legal_lines(rows, self.transpose(rows))
+
+    # Маска доступных действий по строкам и столбцам поля
+    # (см. legal_actions)
+    #
+    # Params:
+    # rows: list - упакованные строки поля
+    # cols: list - упакованные столбцы поля
+    #
+    # Returns -> int
+    def legal_lines(self, rows, cols):
+        legal = self.row_tables.legal
+        horizontal = 0
+        for row in rows:
+            horizontal |= legal[row]
+        legal = self.col_tables.legal
+        vertical = 0
+        for col in cols:
+            vertical |= legal[col]
+        return ((horizontal & 1) | (horizontal & 2) << 1 |
+                (vertical & 1) << 1 | (vertical & 2) << 2)
+
+    # Проверка на окончание игры: нет свободных ячеек
+    # и ни одна строка или столбец не может сдвинуться
+    #
+    # Params:
+    # board: int - упакованное поле
+    #
+    # Returns -> bool:
+    # True - если игра окончена
+    def is_game_over(self, board):
+        rows = self.get_rows(board)
+        free = self.row_tables.free
+        if any(free[row] for row in rows):
+            return False
+        left = self.row_tables.left
+        if any(left[row] != row for row in rows):
+            return False
+        left = self.col_tables.left
+        return all(left[col] == col for col in self.get_cols(board))
+
+    # Упаковка поля из списка списков чисел
+    #
+    # Params:
+    # game: list - игровое поле
+    #
+    # Returns -> int:
+    # Упакованное поле
+    def encode(self, game):
+        return codec.encode(game)
+
+    # Распаковка поля в список списков чисел
+    #
+    # Params:
+    # board: int - упакованное поле
+    #
+    # Returns -> list:
+    # Игровое поле
+    def decode(self, board):
+        return codec.decode(board, self.rows, self.cols)
+
+
+class BitGame2048:
+
+    # Игра 2048 на упакованном поле. Повторяет интерфейс и
+    # правила Game2048, состояние игры - само упакованное поле.
+    # За ход пересчитываются только строки поля и количество
+    # свободных ячеек. Столбцы, максимальное значение ячейки
+    # и маска доступных действий считаются при первом обращении
+    # после хода. Поле, на котором есть и ячейка, и свободное
+    # место, всегда можно сдвинуть, поэтому для game_over маска
+    # нужна только на заполненном поле
+    #
+    # Params:
+    # rows: int - количество строк на игровом поле
+    # cols: int - количество столбцов на игровом поле.
+    # Необязательный параметр, если не задан, то
+    # cols = rows
+    # seed: int - зерно потока случайных чисел игры
+    # (см. RandomStream)
+    def __init__(self, rows, cols=None, seed=None):
+        self.rows = rows
+        self.cols = rows if cols is None else cols
+        self.engine = BitEngine(self.rows, self.cols)
+        self.random = RandomStream(seed)
+        self.board = 0
+        self.__rows = []
+        self.__cols = None
+        self.__max_tile = 2
+        self.__legal = 0
+        self.score = 0
+        self.free_tiles = 0
+        self.start_state = None
+        self.log = None
+
+    # Игровое поле в виде списка списков чисел
+    #
+    # Returns -> list
+    @property
+    def game(self):
+        return self.engine.decode(self.board)
+
+    # Максимальное значение ячейки на поле
+    #
+    # Returns -> int
+    @property
+    def max_tile_value(self):
+        if self.__max_tile is None:
+            max_exp = max(map(self.engine.row_tables.max_exp.__getitem__, self.__rows))
+            self.__max_tile = 1 << max_exp if max_exp > 0 else 0
+        return self.__max_tile
+
+    # Маска доступных действий (см. legal_actions)
+    #
+    # Returns -> int
+    @property
+    def legal(self):
+        if self.__legal is None:
+            if self.__cols is None:
+                self.__cols = self.engine.transpose(self.__rows)
+            self.__legal = self.engine.legal_lines(self.__rows, self.__cols)
+        return self.__legal
+
+    # Окончена ли игра: маска доступных действий пуста
+    #
+    # Returns -> bool
+    @property
+    def game_over(self):
+        if self.free_tiles and self.board:
+            return False
+        return self.legal == 0
+
+    # Добавление новой ячейки на игровое поле одним случайным
+    # числом: номер свободной ячейки в порядке строк находится
+    # по количеству свободных ячеек в каждой строке (таблица free),
+    # затем внутри найденной строки. Строки и столбцы поля
+    # обновляются вместе с полем
+    #
+    # Params:
+    # rows: list - упакованные строки поля
+    # cols: list - упакованные столбцы поля, может быть None
+    # free: int - количество свободных ячеек
+    #
+    # Returns -> int:
+    # Степень двойки новой ячейки
+    @instrumentation.timed('bitgame.add_elem')
+    def __add_elem(self, rows, cols, free):
+        index, four = self.random.spawn(free)
+        exp = 2 if four else 1
+        counts = self.engine.row_tables.free
+        i = 0
+        row = rows[0]
+        while index >= counts[row]:
+            index -= counts[row]
+            i += 1
+            row = rows[i]
+        j = 0
+        while (row >> (4 * j)) & 0xF or index:
+            if not (row >> (4 * j)) & 0xF:
+                index -= 1
+            j += 1
+
+        rows[i] = row | exp << (4 * j)
+        if cols is not None:
+            cols[j] |= exp << (4 * i)
+        self.board |= exp << (4 * (i * self.cols + j))
+        return exp
+
+    # Пересчёт строк поля и количества свободных ячеек.
+    # Столбцы, максимальное значение ячейки и маска доступных
+    # действий будут посчитаны при обращении
+    #
+    # Returns -> void
+    def __update_status(self):
+        self.__rows = self.engine.get_rows(self.board)
+        self.__cols = None
+        self.__max_tile = None
+        self.__legal = None
+        self.free_tiles = sum(map(self.engine.row_tables.free.__getitem__, self.__rows))
+
+    # Перевод игры в начальное состояние
+    #
+    # Params:
+    # start_state: bool - если True, то переводит игру
+    # в состояние S0
+    #
+    # Returns -> void
+    def init(self, start_state=False):
+        if start_state and self.start_state is None:
+            raise AttributeError('Атрибут self_state не определён')
+
+        self.score = 0
+        if start_state:
+            self.board = self.start_state
+        else:
+            index, _ = self.random.spawn(self.rows * self.cols)
+            self.board = 1 << (4 * index)
+            self.start_state = self.get_state()
+
+        self.__update_status()
+
+    # Перезапуск потока случайных чисел игры
+    #
+    # Params:
+    # seed: int - зерно
+    #
+    # Returns -> void
+    def seed(self, seed):
+        self.random = RandomStream(seed)
+
+    # Повтор игры: новая игра с зерном seed и действия actions.
+    # Игра с тем же зерном и действиями приходит в то же состояние
+    #
+    # Params:
+    # seed: int - зерно
+    # actions: iterable - действия
+    #
+    # Returns -> int:
+    # Состояние после последнего действия
+    def replay(self, seed, actions):
+        self.seed(seed)
+        self.init()
+        for action in actions:
+            self.forward(action)
+        return self.get_state()
+
+    # Получение состояния игры. Без таймера: вызов обёртки стоил
+    # бы дороже самого чтения поля, время входит в agent.train
+    #
+    # Returns -> int
+    # Упакованное поле
+    def get_state(self):
+        return self.board
+
+    # Перевод игры в состояние state
+    #
+    # Params:
+    # state: int - упакованное поле
+    #
+    # Returns -> void
+    def set_state(self, state):
+        self.board = state
+        self.__update_status()
+
+    # Вычисление и возврат числового значения игры
+    #
+    # Returns -> int:
+    # Числовое значение игры, равное сумме всех чисел в ячейках
+    def get_value(self):
+        return self.engine.value(self.board)
+
+    # Получение количества свободных ячеек на игровом поле
+    #
+    # Returns -> int:
+    # Количество свободных ячеек на игровом поле
+    def get_free_tiles(self):
+        return self.free_tiles
+
+    # Маска доступных действий: бит action установлен, если
+    # ход action сдвигает поле. Маска считается при первом
+    # обращении после хода, игра окончена, когда маска пуста
+    #
+    # Returns -> int
+    def legal_actions(self):
+        return self.legal
+
+    # Совершение игрового действия
+    #
+    # Params:
+    # action: int - игровое действие:
+    #   0 - Влево
+    #   1 - Вверх
+    #   2 - Вправо
+    #   3 - Вниз
+    #
+    # Если к игре подключён журнал траекторий (атрибут log,
+    # см. TrajectoryWriter), то шаг записывается в журнал
+    #
+    # Returns -> void
+    @instrumentation.timed('bitgame.forward')
+    def forward(self, action):
+        state = self.board
+        engine = self.engine
+        self.board, rows, cols, score = engine.move_lines(self.__rows, self.__cols, action)
+        self.score += score
+
+        free = sum(map(engine.row_tables.free.__getitem__, rows))
+        if free:
+            self.__add_elem(rows, cols, free)
+            free -= 1
+
+        self.__rows = rows
+        self.__cols = cols
+        self.__max_tile = None
+        self.__legal = None
+        self.free_tiles = free
+
+        if self.log is not None:
+            self.log.write(state, action, self.board,
+                           self.engine.value(self.board) - self.engine.value(state), self.game_over)
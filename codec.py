@@ -0,0 +1,124 @@
+import numpy as np
+from exception import AttributeError
+
+
+# Ширина ячейки в битах: показатель степени двойки 0..15,
+# 0 - свободная ячейка
+CELL_BITS = 4
+CELL_MASK = (1 << CELL_BITS) - 1
+
+# Число в ячейке -> показатель степени
+EXPONENTS = {0: 0}
+EXPONENTS.update({1 << exp: exp for exp in range(1, CELL_MASK + 1)})
+
+
+# Упаковка поля в ключ состояния. Ячейка (i, j) занимает
+# CELL_BITS бит начиная с бита CELL_BITS * (i * cols + j)
+# и хранит показатель степени числа в ячейке. Ключ однозначно
+# декодируется для чисел до 32768 включительно
+#
+# Params:
+# game: list - игровое поле, список списков чисел
+#
+# Returns -> int:
+# Ключ состояния
+#
+# Example:
+# Игровое поле - [0, 0]
+#                [16,4]
+# Ключ = 0x2400 = 9216
+def encode(game):
+    state = 0
+    shift = 0
+    for row in game:
+        for number in row:
+            if number:
+                state |= EXPONENTS[number] << shift
+            shift += CELL_BITS
+    return state
+
+
+# Распаковка ключа состояния в игровое поле
+#
+# Params:
+# state: int - ключ состояния
+# rows: int - количество строк на игровом поле
+# cols: int - количество столбцов на игровом поле
+#
+# Returns -> list:
+# Игровое поле, список списков чисел
+def decode(state, rows, cols):
+    game = []
+    for _ in range(rows):
+        row = []
+        for _ in range(cols):
+            exp = state & CELL_MASK
+            row.append(1 << exp if exp else 0)
+            state >>= CELL_BITS
+        game.append(row)
+    return game
+
+
+# Сдвиги ячеек для пакетной упаковки в uint64
+#
+# Params:
+# cells: int - количество ячеек на поле
+#
+# Returns -> np.ndarray
+def _batch_shifts(cells):
+    if cells * CELL_BITS > 64:
+        raise AttributeError('Пакетная упаковка поддерживает поля до 16 ячеек')
+    return np.arange(cells, dtype=np.uint64) * np.uint64(CELL_BITS)
+
+
+# Пакетная упаковка полей
+#
+# Params:
+# boards: np.ndarray - поля формы (N, rows, cols)
+# exponents: bool - если True, то поля содержат показатели
+# степени, иначе числа в ячейках
+#
+# Returns -> np.ndarray:
+# Ключи состояний uint64 формы (N,)
+def encode_batch(boards, exponents=False):
+    boards = np.asarray(boards)
+    flat = boards.reshape(len(boards), -1)
+    if not exponents:
+        flat = np.where(flat > 0, np.frexp(flat.astype(np.float64))[1] - 1, 0)
+    shifts = _batch_shifts(flat.shape[1])
+    return np.bitwise_or.reduce(flat.astype(np.uint64) << shifts, axis=1)
+
+
+# Пакетная распаковка ключей состояний
+#
+# Params:
+# states: np.ndarray - ключи состояний формы (N,)
+# rows: int - количество строк на игровом поле
+# cols: int - количество столбцов на игровом поле
+# exponents: bool - если True, то возвращаются показатели
+# степени, иначе числа в ячейках
+#
+# Returns -> np.ndarray:
+# Поля формы (N, rows, cols)
+def decode_batch(states, rows, cols, exponents=False):
+    states = np.asarray(states, dtype=np.uint64)
+    shifts = _batch_shifts(rows * cols)
+    exps = ((states[:, None] >> shifts) & np.uint64(CELL_MASK)).astype(np.int64)
+    if exponents:
+        return exps.astype(np.uint8).reshape(len(states), rows, cols)
+    return np.where(exps > 0, np.left_shift(1, exps), 0).reshape(len(states), rows, cols)
+
+
+# Пакетное вычисление суммы чисел в ячейках. Сумма не зависит
+# от размера поля, поэтому ключи распаковываются как поле
+# из 16 ячеек
+#
+# Params:
+# states: np.ndarray - ключи состояний формы (N,)
+#
+# Returns -> np.ndarray:
+# Суммы int64 формы (N,)
+def tile_sums(states):
+    states = np.asarray(states, dtype=np.uint64)
+    exps = ((states[:, None] >> _batch_shifts(16)) & np.uint64(CELL_MASK)).astype(np.int64)
+    return np.where(exps > 0, np.left_shift(1, exps), 0).sum(axis=1)
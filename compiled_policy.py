@@ -0,0 +1,81 @@
+import numpy as np
+from key_index import capacity_for, lookup, lookup_one, place
+
+
+class CompiledPolicy:
+
+    # Стратегия, собранная из решённой модели в плотные массивы:
+    # для каждого состояния - строка из 4 ценностей действий Q
+    # (см. StateStore.q_values), лучшее действие (см.
+    # StateStore.best_actions) и ценность V.
+    # Состояние ищется по ключу в хеш-таблице (см. key_index),
+    # поэтому выбор действия для пакета состояний - несколько
+    # векторных операций. Номера состояний совпадают с номерами
+    # в хранилище. Стратегия помнит версию хранилища, из которой
+    # собрана (см. is_stale)
+    #
+    # Params:
+    # store: StateStore - решённая модель агента
+    def __init__(self, store):
+        count = len(store)
+        self.store = store
+        self.version = store.version
+        self.keys = np.ascontiguousarray(store.keys[:count], dtype=np.uint64)
+        self.V = np.ascontiguousarray(store.V[:count], dtype=np.float64)
+        self.Q = np.ascontiguousarray(store.q_values(), dtype=np.float64)
+        self.best_action = np.ascontiguousarray(store.best_actions(), dtype=np.int8)
+
+        self.slots = np.full(capacity_for(count), -1, dtype=np.int32)
+        place(self.slots, self.keys, np.arange(count))
+
+    def __len__(self):
+        return len(self.keys)
+
+    # Устарела ли стратегия: хранилище заменено или изменено
+    # после сборки
+    #
+    # Params:
+    # store: StateStore - текущая модель агента
+    #
+    # Returns -> bool
+    def is_stale(self, store):
+        return store is not self.store or store.version != self.version
+
+    # Номера состояний для набора ключей
+    #
+    # Params:
+    # states: np.ndarray - состояния среды
+    #
+    # Returns -> np.ndarray:
+    # Номера состояний, -1 - если состояния нет в стратегии
+    def ids_of(self, states):
+        return lookup(self.slots, self.keys, states)
+
+    # Номер одного состояния (см. key_index.lookup_one)
+    #
+    # Params:
+    # state: int - состояние среды
+    #
+    # Returns -> int:
+    # Номер состояния, -1 - если состояния нет в стратегии
+    def id_of(self, state):
+        return lookup_one(self.slots, self.keys, state)
+
+    # Лучшие действия для набора состояний
+    #
+    # Params:
+    # states: np.ndarray - состояния среды
+    #
+    # Returns -> np.ndarray:
+    # Действия, -1 - если состояния нет в стратегии
+    def actions(self, states):
+        ids = self.ids_of(states)
+        return np.where(ids >= 0, self.best_action[ids], -1)
+
+    # Объём памяти массивов стратегии
+    #
+    # Returns -> int:
+    # Количество байт
+    def memory_usage(self):
+        return (self.keys.nbytes + self.V.nbytes + self.Q.nbytes +
+                self.best_action.nbytes + self.slots.nbytes)
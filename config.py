@@ -5,6 +5,20 @@ WIN_REWARD = 10
 Y = 0.9
 NEEDED = 32
 POLICIES_PATH = './models/'
+SPILL_CACHE_BYTES = 256 * 1024 * 1024
+TRAJECTORY_BUFFER = 65536
+TRAJECTORY_LOG = None
+PARTIAL_RESOLVE_LIMIT = 0.2
+
+#Planner
+PLANNER_DEPTH = 3
+PLANNER_TIME_MS = 50
+PLANNER_TABLE_SIZE = 200000
+
+#Server
+SERVER_PORT = 5048
+SERVER_MAX_BATCH = 1024
+SERVER_MAX_DELAY_MS = 0
 
 #App
 WIDTH = 800
@@ -15,4 +29,5 @@ ACTION_ARROWS = ['Вверх', 'Влево', 'Вниз', 'Вправо']
 
 #Random
 SEED = 8512
+RANDOM_BLOCK = 4096
 
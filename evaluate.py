@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+from multiprocessing import Pool
+from time import perf_counter
+import numpy as np
+import config
+from agent import Agent
+from bitboard import BitGame2048
+
+
+# Агент и среда процесса, загружаются один раз при старте процесса
+_agent = None
+_environment = None
+_needed = None
+
+
+# Загрузка стратегии в процессе пула
+#
+# Params:
+# filename: string - название файла со стратегией
+# planner: bool - если True, то для неизвестных состояний
+# действие выбирает планировщик, иначе - случайное доступное
+# действие из np.random. Поток случайных чисел игры тратится
+# только на новые ячейки, поэтому игру можно повторить по зерну
+# и действиям (replay)
+#
+# Returns -> void
+def _init_worker(filename, planner):
+    global _agent, _environment, _needed
+    _agent = Agent()
+    header = _agent.load(filename)
+    _needed = header['needed']
+    _environment = BitGame2048(header['rows'], header['cols'])
+    if planner:
+        _agent.use_planner(_environment, _needed)
+
+
+# Одна игра по стратегии с собственным зерном
+#
+# Params:
+# task: tuple - зерно игры и максимальное количество ходов
+#
+# Returns -> dict:
+# Итог игры: победа, максимальное значение ячейки, количество
+# ходов и ходов из состояний, которых нет в модели
+def _play(task):
+    seed, max_moves = task
+    np.random.seed(seed)
+    environment = _environment
+    environment.seed(seed)
+    environment.init()
+
+    moves = 0
+    unknown_moves = 0
+    while (not environment.game_over and environment.max_tile_value < _needed
+           and moves < max_moves):
+        state = environment.get_state()
+        if _agent.is_known_state(state):
+            action = _agent.forward(state, environment.legal_actions())
+        else:
+            unknown_moves += 1
+            if _agent.planner is not None:
+                action = _agent.forward(state, environment.legal_actions())
+            else:
+                legal = environment.legal_actions()
+                actions = [action for action in range(4) if legal >> action & 1]
+                action = actions[np.random.randint(len(actions))]
+        environment.forward(action)
+        moves += 1
+
+    return {
+        'seed': seed,
+        'won': bool(environment.max_tile_value >= _needed),
+        'max_tile': int(environment.max_tile_value),
+        'moves': moves,
+        'unknown_moves': unknown_moves,
+    }
+
+
+# Сводка по сыгранным играм
+#
+# Params:
+# results: list - итоги игр (см. _play)
+# elapsed: float - время игры в секундах
+#
+# Returns -> dict
+def summarize(results, elapsed):
+    max_tiles = np.array([result['max_tile'] for result in results])
+    moves = np.array([result['moves'] for result in results])
+    unknown_moves = sum(result['unknown_moves'] for result in results)
+    p50, p90, p99 = np.percentile(max_tiles, [50, 90, 99])
+    return {
+        'games': len(results),
+        'win_rate': sum(result['won'] for result in results) / len(results),
+        'max_tile_mean': float(max_tiles.mean()),
+        'max_tile_p50': float(p50),
+        'max_tile_p90': float(p90),
+        'max_tile_p99': float(p99),
+        'moves_per_game': float(moves.mean()),
+        'unknown_fraction': unknown_moves / max(int(moves.sum()), 1),
+        'games_per_sec': len(results) / elapsed if elapsed > 0 else 0,
+    }
+
+
+class Evaluation:
+
+    # Оценка стратегии без отрисовки: games игр в пуле
+    # процессов. Зерно каждой игры зависит только от seed
+    # и номера игры, поэтому результат не зависит от количества
+    # процессов и порядка их завершения
+    #
+    # Params:
+    # filename: string - название файла со стратегией
+    # games: int - количество игр
+    # workers: int - количество процессов, по умолчанию
+    # равно количеству ядер
+    # seed: int - зерно оценки
+    # planner: bool - если True, то для неизвестных состояний
+    # действие выбирает планировщик
+    # max_moves: int - максимальное количество ходов в игре
+    def __init__(self, filename, games, workers=None, seed=config.SEED,
+                 planner=False, max_moves=100000):
+        self.filename = filename
+        self.games = games
+        self.workers = workers or os.cpu_count()
+        self.seed = seed
+        self.planner = planner
+        self.max_moves = max_moves
+        self.results = []
+        self.elapsed = 0
+
+    # Зерно игры с номером game
+    #
+    # Params:
+    # game: int - номер игры
+    #
+    # Returns -> int
+    def __seed(self, game):
+        sequence = np.random.SeedSequence([self.seed, game])
+        return int(sequence.generate_state(1)[0])
+
+    # Запуск оценки. Сводка выдаётся каждые every игр,
+    # поэтому долгую оценку можно наблюдать и прервать
+    #
+    # Params:
+    # every: int - период выдачи сводки в играх
+    #
+    # Returns -> generator:
+    # Сводки по сыгранным к этому моменту играм
+    def run(self, every=100):
+        start_time = perf_counter()
+        self.results = []
+        tasks = ((self.__seed(game), self.max_moves) for game in range(self.games))
+
+        with Pool(self.workers, _init_worker, (self.filename, self.planner)) as pool:
+            for result in pool.imap(_play, tasks, chunksize=8):
+                self.results.append(result)
+                self.elapsed = perf_counter() - start_time
+                if len(self.results) % every == 0 or len(self.results) == self.games:
+                    yield summarize(self.results, self.elapsed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Оценка стратегии 2048_MDP без отрисовки')
+    parser.add_argument('filename', help='файл стратегии в config.POLICIES_PATH')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=config.SEED)
+    parser.add_argument('--planner', action='store_true')
+    parser.add_argument('--max-moves', type=int, default=100000)
+    parser.add_argument('--every', type=int, default=100)
+    parser.add_argument('--output', default=None, help='файл JSON Lines для сводок')
+    args = parser.parse_args()
+
+    evaluation = Evaluation(args.filename, args.games, args.workers,
+                            args.seed, args.planner, args.max_moves)
+    output = open(args.output, 'a') if args.output else None
+    try:
+        for summary in evaluation.run(args.every):
+            print(json.dumps(summary), flush=True)
+            if output:
+                output.write(json.dumps(summary) + '\n')
+                output.flush()
+    except KeyboardInterrupt:
+        if evaluation.results:
+            print(json.dumps(summarize(evaluation.results, evaluation.elapsed)))
+    finally:
+        if output:
+            output.close()
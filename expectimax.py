@@ -0,0 +1,194 @@
+from collections import OrderedDict
+from time import perf_counter
+import numpy as np
+import config
+from bitboard import BitEngine
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class ExpectimaxPlanner:
+
+    # Онлайн-планировщик: поиск expectimax ограниченной глубины
+    # от текущего поля. Узлы выбора - ходы игрока, узлы случая -
+    # появление 2 или 4 в каждой свободной ячейке. Ценность листа
+    # берётся из модели агента, если состояние в ней есть.
+    # Победа и эвристика для неизвестных листьев приводятся
+    # к масштабу ценностей модели (атрибут scale), поэтому
+    # известный лист не выигрывает у неизвестного из-за масштаба.
+    # Поиск идёт с итеративным углублением, пока не истечёт
+    # время на ход. Результаты кэшируются в таблице
+    # транспозиций ограниченного размера с вытеснением LRU.
+    # Состояния - упакованные поля в формате BitGame2048.get_state
+    #
+    # Params:
+    # rows: int - количество строк на игровом поле
+    # cols: int - количество столбцов на игровом поле
+    # needed: int - победное значение ячейки
+    # agent: Agent - агент, ценности которого используются в листьях
+    # depth: int - максимальная глубина поиска в ходах игрока
+    # time_limit_ms: float - время на ход в миллисекундах
+    # table_size: int - максимальный размер таблицы транспозиций
+    def __init__(self, rows, cols, needed=config.NEEDED, agent=None,
+                 depth=config.PLANNER_DEPTH,
+                 time_limit_ms=config.PLANNER_TIME_MS,
+                 table_size=config.PLANNER_TABLE_SIZE):
+        self.engine = BitEngine(rows, cols)
+        self.needed_exp = int(needed).bit_length() - 1
+        self.agent = agent
+        self.depth = depth
+        self.time_limit_ms = time_limit_ms
+        self.table_size = table_size
+        self.table = OrderedDict()
+        self.cells = rows * cols
+        self.shifts = [shift for row in self.engine.cell_shifts for shift in row]
+        self.scale = config.WIN_REWARD
+        self.__scale_key = None
+
+        self.nodes = 0
+        self.hits = 0
+        self.reached_depth = 0
+        self.last_latency_ms = 0
+        self.__deadline = 0
+
+    # Очистка таблицы транспозиций, например после
+    # пересчёта ценностей агента
+    #
+    # Returns -> void
+    def clear(self):
+        self.table.clear()
+
+    # Пересчёт масштаба ценностей: наибольшая ценность в модели
+    # агента, но не меньше config.WIN_REWARD. Масштаб
+    # пересчитывается только после изменения модели, таблица
+    # транспозиций при смене масштаба очищается
+    #
+    # Returns -> void
+    def __update_scale(self):
+        scale = config.WIN_REWARD
+        if self.agent is not None:
+            store = self.agent.states
+            key = (id(store), store.version)
+            if key == self.__scale_key:
+                return
+            self.__scale_key = key
+            if len(store):
+                scale = max(scale, float(np.max(store.V[:len(store)])))
+        if scale != self.scale:
+            self.scale = scale
+            self.table.clear()
+
+    # Ценность листа: ценность из модели агента или эвристика -
+    # доля свободных ячеек в масштабе ценностей модели
+    #
+    # Params:
+    # state: int - состояние среды
+    #
+    # Returns -> float
+    def __evaluate(self, state):
+        if self.agent is not None and self.agent.is_known_state(state):
+            return self.agent.get_state_value(state)
+        return self.engine.free_cells(state) / self.cells * self.scale
+
+    # Ценность узла выбора с depth ходами в запасе
+    #
+    # Params:
+    # state: int - состояние среды
+    # depth: int - оставшаяся глубина
+    #
+    # Returns -> float
+    def __max_node(self, state, depth):
+        if self.engine.max_exp(state) >= self.needed_exp:
+            return self.scale
+        if self.engine.is_game_over(state):
+            return 0
+        if depth == 0:
+            return self.__evaluate(state)
+
+        key = (state, depth)
+        value = self.table.get(key)
+        if value is not None:
+            self.hits += 1
+            self.table.move_to_end(key)
+            return value
+
+        value = max(self.__action_values(state, depth))
+
+        self.table[key] = value
+        if len(self.table) > self.table_size:
+            self.table.popitem(last=False)
+        return value
+
+    # Ценности действий из состояния state
+    #
+    # Params:
+    # state: int - состояние среды
+    # depth: int - оставшаяся глубина
+    #
+    # Returns -> list:
+    # Ценность каждого из 4 действий, -1 - если действие
+    # недоступно (не сдвигает поле, см. BitEngine.legal_actions)
+    def __action_values(self, state, depth):
+        legal = self.engine.legal_actions(state)
+        values = []
+        for action in range(4):
+            if not legal >> action & 1:
+                values.append(-1)
+                continue
+            after, _ = self.engine.move(state, action)
+            values.append(self.__chance_node(after, depth))
+        return values
+
+    # Ценность узла случая: среднее по свободным ячейкам
+    # и значениям новой ячейки
+    #
+    # Params:
+    # after: int - поле после хода
+    # depth: int - оставшаяся глубина
+    #
+    # Returns -> float
+    def __chance_node(self, after, depth):
+        self.nodes += 1
+        if self.nodes & 0x3 == 0 and perf_counter() > self.__deadline:
+            raise SearchTimeout()
+
+        free = [shift for shift in self.shifts if not (after >> shift) & 0xF]
+        if not free:
+            return -1
+
+        total = 0
+        for shift in free:
+            total += config.PROB_OF_2 * self.__max_node(after | (1 << shift), depth - 1)
+            total += config.PROB_OF_4 * self.__max_node(after | (2 << shift), depth - 1)
+        return config.Y * total / len(free)
+
+    # Выбор действия из состояния state
+    #
+    # Params:
+    # state: int - состояние среды
+    #
+    # Returns -> int:
+    # Лучшее найденное действие
+    def search(self, state):
+        start_time = perf_counter()
+        deadline = start_time + self.time_limit_ms / 1000
+        self.nodes = 0
+        self.reached_depth = 0
+        self.__update_scale()
+
+        best_action = 0
+        for depth in range(1, self.depth + 1):
+            # Первая итерация всегда доводится до конца,
+            # чтобы у хода был хотя бы жадный ответ
+            self.__deadline = deadline if depth > 1 else float('inf')
+            try:
+                values = self.__action_values(state, depth)
+            except SearchTimeout:
+                break
+            best_action = max(range(4), key=values.__getitem__)
+            self.reached_depth = depth
+
+        self.last_latency_ms = (perf_counter() - start_time) * 1000
+        return best_action
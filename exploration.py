@@ -0,0 +1,253 @@
+from collections import deque
+import numpy as np
+from state_store import _grow
+
+
+class RandomExploration:
+
+    # Стратегия изучения среды: эпизоды из состояния S0
+    # со случайными действиями из доступных (маска
+    # legal_actions среды). Стратегия считает шаги среды
+    # и найденные состояния
+    def __init__(self):
+        self.store = None
+        self.steps = 0
+        self.new_states = 0
+
+    # Количество новых состояний на шаг среды
+    #
+    # Returns -> float
+    @property
+    def new_states_per_step(self):
+        return self.new_states / self.steps if self.steps else 0
+
+    # Подключение модели агента, по номерам состояний которой
+    # стратегия хранит свою статистику
+    #
+    # Params:
+    # store: StateStore - посещённые состояния агента
+    #
+    # Returns -> void
+    def bind(self, store):
+        self.store = store
+
+    # Начало эпизода: перевод среды в начальное состояние
+    #
+    # Params:
+    # environment - среда
+    # first: bool - True, если модель агента ещё пуста
+    #
+    # Returns -> void
+    def reset(self, environment, first):
+        if first:
+            environment.init()
+        else:
+            environment.init(start_state=True)
+
+    # Действия из маски доступных действий
+    #
+    # Params:
+    # legal: int - маска доступных действий
+    #
+    # Returns -> list
+    def _legal(self, legal):
+        return [action for action in range(4) if legal >> action & 1]
+
+    # Выбор действия
+    #
+    # Params:
+    # state: int - состояние среды
+    # legal: int - маска доступных действий
+    #
+    # Returns -> int:
+    # Действие - целое число из диапазона [0, 3]
+    def select(self, state, legal=0xF):
+        actions = self._legal(legal)
+        return actions[np.random.randint(0, len(actions))] if actions else 0
+
+    # Учёт результата шага среды
+    #
+    # Params:
+    # state: int - состояние среды
+    # action: int - действие
+    # next_state: int - состояние среды после действия action
+    # is_new: bool - True, если next_state не было в модели
+    #
+    # Returns -> void
+    def observe(self, state, action, next_state, is_new):
+        self.steps += 1
+        if is_new:
+            self.new_states += 1
+
+    # Нужно ли прервать эпизод в состоянии state
+    #
+    # Params:
+    # state: int - состояние среды
+    #
+    # Returns -> bool
+    def should_restart(self, state):
+        return False
+
+
+class NoveltyExploration(RandomExploration):
+
+    # Стратегия изучения среды: эпизоды из состояния S0,
+    # действие выбирается с весом 1 / (1 + n), где n - сколько раз
+    # действие уже выбиралось из этого состояния. Поэтому редко
+    # пробованные действия выбираются чаще. Счётчики хранятся
+    # в массиве tries формы (ёмкость, 4) по номерам состояний модели
+    def __init__(self):
+        super().__init__()
+        self.tries = np.zeros((0, 4), dtype=np.uint32)
+
+    def bind(self, store):
+        if store is not self.store:
+            self.tries = np.zeros((0, 4), dtype=np.uint32)
+        super().bind(store)
+
+    # Счётчики действий состояния state
+    #
+    # Params:
+    # state: int - состояние среды
+    #
+    # Returns -> list:
+    # 4 счётчика или None, если состояние ещё не встречалось
+    def _tries(self, state):
+        state_id = -1 if self.store is None else self.store.id_of(state)
+        if state_id < 0 or state_id >= len(self.tries):
+            return None
+        return self.tries[state_id].tolist()
+
+    def select(self, state, legal=0xF):
+        actions = self._legal(legal)
+        if not actions:
+            return 0
+        tries = self._tries(state)
+        if tries is None:
+            return actions[np.random.randint(0, len(actions))]
+
+        weights = [1 / (1 + tries[action]) for action in actions]
+        threshold = np.random.rand() * sum(weights)
+        for action, weight in zip(actions, weights):
+            threshold -= weight
+            if threshold < 0:
+                return action
+        return actions[-1]
+
+    def observe(self, state, action, next_state, is_new):
+        super().observe(state, action, next_state, is_new)
+        state_id = self.store.id_of(state)
+        if state_id >= len(self.tries):
+            capacity = max(1024, 2 * len(self.tries))
+            while capacity <= state_id:
+                capacity *= 2
+            self.tries = _grow(self.tries.reshape(-1), 4 * capacity).reshape(-1, 4)
+        self.tries[state_id, action] += 1
+
+
+class FrontierExploration(NoveltyExploration):
+
+    # Стратегия изучения среды от границы модели: очередь
+    # состояний, из которых ещё есть непробованные действия.
+    # Эпизод начинается с восстановления поля из ключа состояния
+    # из очереди (environment.set_state) и прерывается, когда
+    # в текущем состоянии все действия уже пробованы. Маски
+    # доступных действий нужны для состояний из очереди, поэтому
+    # хранятся в массиве legal по номерам состояний (0 - маска
+    # ещё неизвестна)
+    #
+    # Params:
+    # tries: int - сколько раз пробуется каждое действие
+    # из состояния, прежде чем оно считается изученным
+    def __init__(self, tries=1):
+        super().__init__()
+        self.max_tries = tries
+        self.legal = np.zeros(0, dtype=np.uint8)
+        self.queue = deque()
+        self.queued = set()
+
+    def bind(self, store):
+        if store is not self.store:
+            self.legal = np.zeros(0, dtype=np.uint8)
+        super().bind(store)
+
+    # Запоминание маски доступных действий состояния state
+    #
+    # Params:
+    # state: int - состояние среды
+    # legal: int - маска доступных действий
+    #
+    # Returns -> void
+    def __remember(self, state, legal):
+        state_id = self.store.id_of(state)
+        if state_id >= len(self.legal):
+            capacity = max(1024, 2 * len(self.legal))
+            while capacity <= state_id:
+                capacity *= 2
+            self.legal = _grow(self.legal, capacity)
+        self.legal[state_id] = legal
+
+    # Есть ли из состояния state непробованные действия
+    #
+    # Params:
+    # state: int - состояние среды
+    #
+    # Returns -> bool
+    def __has_untried(self, state):
+        tries = self._tries(state)
+        if tries is None:
+            return True
+        state_id = self.store.id_of(state)
+        legal = int(self.legal[state_id]) if state_id < len(self.legal) else 0
+        return any(tries[action] < self.max_tries for action in self._legal(legal or 0xF))
+
+    # Постановка состояния в очередь, если из него есть
+    # непробованные действия
+    #
+    # Params:
+    # state: int - состояние среды
+    #
+    # Returns -> void
+    def __push(self, state):
+        if state not in self.queued and self.__has_untried(state):
+            self.queue.append(state)
+            self.queued.add(state)
+
+    # Постановка в очередь состояний, с которых нужно продолжить
+    # изучение, например границы уже собранной модели
+    #
+    # Params:
+    # states: iterable - состояния среды
+    #
+    # Returns -> void
+    def extend(self, states):
+        for state in states:
+            self.__push(state)
+
+    def reset(self, environment, first):
+        while self.queue:
+            state = self.queue.popleft()
+            self.queued.discard(state)
+            if self.__has_untried(state):
+                environment.set_state(state)
+                return
+        super().reset(environment, first)
+
+    def select(self, state, legal=0xF):
+        self.__remember(state, legal)
+        tries = self._tries(state)
+        if tries is None:
+            return super().select(state, legal)
+        untried = [action for action in self._legal(legal) if tries[action] < self.max_tries]
+        if not untried:
+            return super().select(state, legal)
+        return untried[np.random.randint(0, len(untried))]
+
+    def observe(self, state, action, next_state, is_new):
+        super().observe(state, action, next_state, is_new)
+        self.__push(state)
+        if is_new:
+            self.__push(next_state)
+
+    def should_restart(self, state):
+        return len(self.queue) > 0 and not self.__has_untried(state)
@@ -1,4 +1,7 @@
 import numpy as np
+import codec
+import instrumentation
+from random_stream import RandomStream
 from exception import AttributeError
 
 
@@ -11,37 +14,32 @@ class Game2048:
     # cols: int - количество столбцов на игровом поле.
     # Необязательный параметр, если не задан, то
     # cols = rows
-    def __init__(self, rows, cols=None):
+    # seed: int - зерно потока случайных чисел игры
+    # (см. RandomStream)
+    def __init__(self, rows, cols=None, seed=None):
         self.rows = rows
         self.cols = rows if cols is None else cols
+        self.random = RandomStream(seed)
         self.max_tile_value = 2
+        self.free_tiles = 0
+        self.legal = 0
         self.game = []
         self.start_state = None
         self.game_over = False
+        self.log = None
 
-    # Заполнение поля начальными данными
+    # Заполнение поля по состоянию
     #
     # Params:
-    # startState: bool - если True, то заполняет игровое поле 
-    # данными из состояния S0
+    # state: int - состояние игры (см. codec.encode). Если
+    # не задано, то поле заполняется нулями
     #
     # Returns -> void
-    def __fill_tiles(self, start_state):
-        if start_state and self.start_state is None:
-            raise AttributeError('Атрибут self_state не определён')
-
-        list_state = None
-        if start_state:
-            list_state = [int(num) for num in str(self.start_state)]
-        
-        for i in range(self.rows):
-            row = []
-            for j in range(self.rows):
-                if start_state:
-                    row.append(0 if list_state[j+i*self.rows] == 9 else list_state[j+i*self.rows])
-                else:
-                    row.append(0)
-            self.game.append(row)
+    def __fill_tiles(self, state):
+        if state is None:
+            self.game = [[0] * self.cols for _ in range(self.rows)]
+        else:
+            self.game = codec.decode(state, self.rows, self.cols)
 
     # Игровой ход влево
     #
@@ -119,72 +117,57 @@ class Game2048:
                         continue
                 i += 1
 
-    # Добавление новой ячейки на игровое поле
+    # Добавление новой ячейки на игровое поле, если есть
+    # свободные ячейки
     #
     # Returns -> void
+    @instrumentation.timed('game.add_elem')
     def __add_elem(self):
-        row = np.random.randint(0, self.rows)
-        col = np.random.randint(0, self.cols)
-
-        while self.game[row][col] != 0:
-            row = np.random.randint(0, self.rows)
-            col = np.random.randint(0, self.cols)
-
-        if np.random.rand() <= 0.1:
-            self.game[row][col] = 4
-        else:
-            self.game[row][col] = 2
-
-    # Проверка на наличие свободных ячеек на игровом поле
-    #
-    # Returns -> bool:
-    # True - если есть свободные ячейки
-    def __is_enough_place(self):
-        for i in range(self.rows):
-            if 0 in self.game[i]:
-                return True
-        return False
+        free = [(i, j) for i in range(self.rows) for j in range(self.cols)
+                if self.game[i][j] == 0]
+        if not free:
+            return
+        index, four = self.random.spawn(len(free))
+        row, col = free[index]
+        self.game[row][col] = 4 if four else 2
 
-    # Проверка на окончание игры
+    # Пересчёт за один проход по полю максимального значения
+    # ячейки, количества свободных ячеек, маски доступных действий
+    # и окончания игры. Ход сдвигает линию, если в ней есть
+    # пара соседних ячеек, где ячейка в направлении хода пуста
+    # или равна непустой соседней
     #
-    # Returns -> bool:
-    # True - если игра окончена
-    def __is_game_over(self):
-        if self.__is_enough_place():
-            return False
-
-        for i in range(self.rows-1):
-            for j in range(self.cols):
-                if self.game[i][j] == self.game[i+1][j]:
-                    return False
-
-        for i in range(self.rows):
-            for j in range(self.cols-1):
-                if self.game[i][j] == self.game[i][j+1]:
-                    return False
+    # Returns -> void
+    def __update_status(self):
+        legal = 0
+        free = 0
+        max_tile = 0
+        for row in self.game:
+            free += row.count(0)
+            max_tile = max(max_tile, max(row))
+            for a, b in zip(row, row[1:]):
+                if b and (a == 0 or a == b):
+                    legal |= 1
+                if a and (b == 0 or a == b):
+                    legal |= 4
+        for col in zip(*self.game):
+            for a, b in zip(col, col[1:]):
+                if b and (a == 0 or a == b):
+                    legal |= 2
+                if a and (b == 0 or a == b):
+                    legal |= 8
 
-        return True
-
-    # Вычисление и возврат максимального значения
-    # в ячейках на игровом поле
-    #
-    # Returns -> int:
-    # Максимальное значение ячейки на игровом поле
-    def __get_max_tile(self):
-        return np.max([num for row in self.game for num in row])
+        self.max_tile_value = max_tile
+        self.free_tiles = free
+        self.legal = legal
+        self.game_over = legal == 0
 
     # Вычисление хеша игры
     #
     # Returns -> int:
-    # Хеш игры - последовательность чисел в ячейках от левой верхней
-    # до правой нижней. Если ячейка свободная, то записывается число 9.
-    #
-    # Example:
-    # Игровое поле - [0, 0]
-    #                [16,4]
-    # Hash = 99164
+    # Хеш игры - ключ состояния (см. codec.encode)
     def __hash__(self) -> int:
-        return int(''.join([str(x if x > 0 else 9) for row in self.game for x in row]))
+        return codec.encode(self.game)
 
     # Перевод игры в начальное состояние
     #
@@ -194,25 +177,61 @@ class Game2048:
     #
     # Returns -> void
     def init(self, start_state=False):
-        self.game = []
+        if start_state and self.start_state is None:
+            raise AttributeError('Атрибут self_state не определён')
 
-        self.__fill_tiles(start_state)
+        self.__fill_tiles(self.start_state if start_state else None)
 
         if not start_state:
-            row = np.random.randint(0, self.rows)
-            col = np.random.randint(0, self.cols)
-            self.game[row][col] = 2
+            index, _ = self.random.spawn(self.rows * self.cols)
+            self.game[index // self.cols][index % self.cols] = 2
             self.start_state = self.get_state()
-        
-        self.max_tile_value = self.__get_max_tile()
-        self.game_over = self.__is_game_over()
+
+        self.__update_status()
+
+    # Перезапуск потока случайных чисел игры
+    #
+    # Params:
+    # seed: int - зерно
+    #
+    # Returns -> void
+    def seed(self, seed):
+        self.random = RandomStream(seed)
+
+    # Повтор игры: новая игра с зерном seed и действия actions.
+    # Игра с тем же зерном и действиями приходит в то же состояние
+    #
+    # Params:
+    # seed: int - зерно
+    # actions: iterable - действия
+    #
+    # Returns -> int:
+    # Состояние после последнего действия
+    def replay(self, seed, actions):
+        self.seed(seed)
+        self.init()
+        for action in actions:
+            self.forward(action)
+        return self.get_state()
 
     # Получение состояния игры
     #
     # Returns -> int
-    # Состояние игры, то есть её хеша
+    # Состояние игры - ключ из показателей степени чисел
+    # в ячейках (см. codec.encode)
+    @instrumentation.timed('game.get_state')
     def get_state(self):
-        return hash(self)
+        return codec.encode(self.game)
+
+    # Перевод игры в состояние state
+    #
+    # Params:
+    # state: int - состояние игры (см. codec.encode)
+    #
+    # Returns -> void
+    def set_state(self, state):
+        self.__fill_tiles(state)
+        self.__update_status()
 
     # Вычисление и возврат числового значения игры
     #
@@ -226,7 +245,15 @@ class Game2048:
     # Returns -> int:
     # Количество свободных ячеек на игровом поле
     def get_free_tiles(self):
-        return [x for row in self.game for x in row].count(0)
+        return self.free_tiles
+
+    # Маска доступных действий: бит action установлен, если
+    # ход action сдвигает поле. Маска пересчитывается после
+    # каждого хода, игра окончена, когда маска пуста
+    #
+    # Returns -> int
+    def legal_actions(self):
+        return self.legal
 
     # Совершение игрового действия
     #
@@ -237,8 +264,16 @@ class Game2048:
     #   2 - Вправо
     #   3 - Вниз
     #
+    # Если к игре подключён журнал траекторий (атрибут log,
+    # см. TrajectoryWriter), то шаг записывается в журнал
+    #
     # Returns -> void
+    @instrumentation.timed('game.forward')
     def forward(self, action):
+        if self.log is not None:
+            state = self.get_state()
+            value = self.get_value()
+
         if action == 0:
             self.__switch_left()
         elif action == 1:
@@ -248,11 +283,10 @@ class Game2048:
         else:
             self.__switch_down()
 
-        self.max_tile_value = self.__get_max_tile()
-
-        if self.__is_game_over():
-            self.game_over = True
+        self.__add_elem()
+        self.__update_status()
 
-        if self.__is_enough_place():
-            self.__add_elem()
+        if self.log is not None:
+            self.log.write(state, action, self.get_state(),
+                           int(self.get_value() - value), self.game_over)
             
\ No newline at end of file
@@ -0,0 +1,141 @@
+import math
+import socket
+import struct
+import config
+
+
+# Запрос: ключ состояния и маска доступных действий (0xF -
+# без ограничений, см. Agent.forward)
+REQUEST = struct.Struct('<QB')
+# Маска запроса без ограничения на действия
+ALL_ACTIONS = 0xF
+# Ответ: действие (-1, если состояния нет в модели и планировщик
+# не подключён) и ценность состояния (nan, если состояния нет в модели)
+RESPONSE = struct.Struct('<bd')
+# Количество запросов, отправляемых за раз при пакетном запросе
+CLIENT_CHUNK = 4096
+
+
+class PolicyClient:
+
+    # Клиент сервера стратегии (см. inference_server.py).
+    # Повторяет методы Agent для выбора действия: запросы
+    # отправляются пакетом без ожидания ответа на каждый,
+    # ответы приходят в порядке запросов
+    #
+    # Params:
+    # host: string - адрес сервера TCP
+    # port: int - порт сервера TCP
+    # path: string - путь к сокету Unix, если задан, то host
+    # и port не используются
+    # timeout: float - таймаут операций с сокетом в секундах
+    def __init__(self, host='127.0.0.1', port=config.SERVER_PORT, path=None, timeout=None):
+        if path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(path)
+        else:
+            self.socket = socket.create_connection((host, port), timeout)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    # Чтение ровно size байт из сокета
+    #
+    # Params:
+    # size: int - количество байт
+    #
+    # Returns -> bytes
+    def __receive(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('Сервер стратегии закрыл соединение')
+            data += chunk
+        return bytes(data)
+
+    # Запрос действий и ценностей для набора состояний
+    #
+    # Params:
+    # states: list - состояния среды
+    # legal: list - маски доступных действий состояний (см.
+    # legal_actions среды), может быть None
+    #
+    # Returns -> list:
+    # Пары (действие, ценность)
+    def lookup_many(self, states, legal=None):
+        if legal is None:
+            legal = [ALL_ACTIONS] * len(states)
+        results = []
+        for start in range(0, len(states), CLIENT_CHUNK):
+            chunk = zip(states[start:start + CLIENT_CHUNK], legal[start:start + CLIENT_CHUNK])
+            data = b''.join(REQUEST.pack(state, mask) for state, mask in chunk)
+            self.socket.sendall(data)
+            data = self.__receive(RESPONSE.size * (len(data) // REQUEST.size))
+            results.extend(RESPONSE.iter_unpack(data))
+        return results
+
+    # Вычисление следующего действия из состояния state.
+    # Сервер выбирает лучшее по ценности из доступных действий
+    # так же, как Agent.forward
+    #
+    # Params:
+    # state: int - состояние среды
+    # legal: int - маска доступных действий (см. legal_actions
+    # среды), может быть None
+    #
+    # Returns -> int:
+    # Следующее действие, KeyError - если состояния нет в модели
+    # и на сервере не подключён планировщик
+    def forward(self, state, legal=None):
+        action, _ = self.lookup_many([state], None if legal is None else [legal])[0]
+        if action < 0:
+            raise KeyError(state)
+        return action
+
+    # Вычисление следующих действий для набора состояний
+    #
+    # Params:
+    # states: iterable - состояния среды
+    # legal: list - маски доступных действий состояний, может
+    # быть None
+    #
+    # Returns -> list:
+    # Следующие действия
+    def forward_many(self, states, legal=None):
+        states = list(states)
+        if legal is not None:
+            legal = list(legal)
+        actions = []
+        for state, (action, _) in zip(states, self.lookup_many(states, legal)):
+            if action < 0:
+                raise KeyError(state)
+            actions.append(action)
+        return actions
+
+    # Получение ценности состояния
+    #
+    # Params:
+    # state: int - состояние среды
+    #
+    # Returns -> float:
+    # Ценность состояния, KeyError - если состояния нет в модели
+    def get_state_value(self, state):
+        _, value = self.lookup_many([state])[0]
+        if math.isnan(value):
+            raise KeyError(state)
+        return value
+
+    # Проверка, есть ли состояние в модели
+    #
+    # Params:
+    # state: int - состояние среды
+    #
+    # Returns -> bool
+    def is_known_state(self, state):
+        return not math.isnan(self.lookup_many([state])[0][1])
+
+    # Закрытие соединения
+    #
+    # Returns -> void
+    def close(self):
+        self.socket.close()
@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+import numpy as np
+import config
+from agent import Agent
+from bitboard import BitGame2048
+from inference_client import REQUEST, RESPONSE
+
+
+class InferenceServer:
+
+    # Сервер стратегии на asyncio. Стратегия загружается один раз,
+    # клиенты присылают ключи состояний с масками доступных
+    # действий и получают лучшее из доступных действий
+    # и ценность состояния (формат - REQUEST и RESPONSE
+    # в inference_client.py). Запросы всех соединений собираются
+    # в пакеты до max_batch штук и обрабатываются одним поиском
+    # (Agent.lookup_many). Состояния, которых нет в модели,
+    # передаются планировщику агента в отдельном потоке, чтобы
+    # поиск не задерживал остальные запросы
+    #
+    # Params:
+    # agent: Agent - агент с загруженной стратегией
+    # max_batch: int - максимальный размер пакета
+    # max_delay_ms: float - сколько ждать новых запросов перед
+    # обработкой неполного пакета, 0 - не ждать
+    # window: int - количество последних запросов для
+    # перцентилей задержки
+    def __init__(self, agent, max_batch=config.SERVER_MAX_BATCH,
+                 max_delay_ms=config.SERVER_MAX_DELAY_MS, window=100000):
+        self.agent = agent
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.latencies = deque(maxlen=window)
+        self.pending = []
+        self.requests = 0
+        self.batches = 0
+        self.unknown = 0
+        self.failed = 0
+        self.start_time = None
+        self.server = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.__ready = None
+        self.__batcher = None
+
+    # Запуск сервера на сокете TCP или Unix
+    #
+    # Params:
+    # host: string - адрес для TCP
+    # port: int - порт для TCP
+    # path: string - путь к сокету Unix, если задан, то host
+    # и port не используются
+    #
+    # Returns -> asyncio.Server
+    async def start(self, host='127.0.0.1', port=config.SERVER_PORT, path=None):
+        self.agent.compile_policy()
+        self.__ready = asyncio.Event()
+        self.__batcher = asyncio.ensure_future(self.__run_batches())
+        self.start_time = perf_counter()
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.__handle, path=path)
+        else:
+            self.server = await asyncio.start_server(self.__handle, host, port)
+        return self.server
+
+    # Остановка сервера
+    #
+    # Returns -> void
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.__batcher.cancel()
+        self.executor.shutdown(wait=False)
+
+    # Обслуживание соединения: все полные запросы из прочитанных
+    # данных отправляются в очередь, ответы пишутся в порядке
+    # запросов
+    #
+    # Params:
+    # reader: asyncio.StreamReader
+    # writer: asyncio.StreamWriter
+    #
+    # Returns -> void
+    async def __handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        buffer = b''
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                buffer += data
+                count = len(buffer) // REQUEST.size
+                if count == 0:
+                    continue
+
+                start_time = perf_counter()
+                futures = []
+                for state, legal in REQUEST.iter_unpack(buffer[:count * REQUEST.size]):
+                    future = loop.create_future()
+                    self.pending.append((state, legal, future, start_time))
+                    futures.append(future)
+                buffer = buffer[count * REQUEST.size:]
+                self.__ready.set()
+
+                results = await asyncio.gather(*futures)
+                writer.write(b''.join(RESPONSE.pack(action, value) for action, value in results))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # Цикл обработки пакетов запросов
+    #
+    # Returns -> void
+    async def __run_batches(self):
+        while True:
+            await self.__ready.wait()
+            if self.max_delay > 0 and len(self.pending) < self.max_batch:
+                await asyncio.sleep(self.max_delay)
+            batch = self.pending[:self.max_batch]
+            del self.pending[:self.max_batch]
+            if not self.pending:
+                self.__ready.clear()
+            self.__answer(batch)
+            # Даём соединениям прочитать новые запросы
+            await asyncio.sleep(0)
+
+    # Ответ на пакет запросов. Если поиск в стратегии завершился
+    # ошибкой, то все запросы пакета получают ответ (-1, nan),
+    # как и при ошибке планировщика (см. __searched)
+    #
+    # Params:
+    # batch: list - четвёрки (состояние, маска доступных действий,
+    # future, время получения)
+    #
+    # Returns -> void
+    def __answer(self, batch):
+        self.batches += 1
+        self.requests += len(batch)
+        try:
+            actions, values = self.agent.lookup_many([state for state, _, _, _ in batch],
+                                                     [legal for _, legal, _, _ in batch])
+        except Exception:
+            self.failed += len(batch)
+            finish_time = perf_counter()
+            for _, _, future, start_time in batch:
+                self.latencies.append(finish_time - start_time)
+                if not future.done():
+                    future.set_result((-1, float('nan')))
+            return
+
+        finish_time = perf_counter()
+        for (state, _, future, start_time), action, value in zip(batch, actions.tolist(), values.tolist()):
+            if action >= 0 or self.agent.planner is None:
+                self.latencies.append(finish_time - start_time)
+                future.set_result((action, value))
+            else:
+                self.unknown += 1
+                search = asyncio.get_running_loop().run_in_executor(
+                    self.executor, self.agent.planner.search, state)
+                search.add_done_callback(self.__searched(future, start_time))
+
+    # Обработчик завершения поиска планировщика. Если поиск
+    # завершился ошибкой, то запрос получает ответ (-1, nan),
+    # как для неизвестного состояния, чтобы клиент не ждал
+    # ответа вечно
+    #
+    # Params:
+    # future: asyncio.Future - ответ на запрос
+    # start_time: float - время получения запроса
+    #
+    # Returns -> function
+    def __searched(self, future, start_time):
+        def done(search):
+            self.latencies.append(perf_counter() - start_time)
+            if future.done():
+                return
+            if search.cancelled() or search.exception() is not None:
+                self.failed += 1
+                future.set_result((-1, float('nan')))
+            else:
+                future.set_result((search.result(), float('nan')))
+        return done
+
+    # Статистика сервера: количество запросов и пакетов, средний
+    # размер пакета, доля состояний, которых нет в модели,
+    # количество запросов, не обработанных из-за ошибок поиска,
+    # перцентили задержки и запросы в секунду
+    #
+    # Returns -> dict
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        elapsed = perf_counter() - self.start_time if self.start_time else 0
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'mean_batch': self.requests / self.batches if self.batches else 0,
+            'unknown_fraction': self.unknown / self.requests if self.requests else 0,
+            'errors': self.failed,
+            'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0,
+            'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0,
+            'requests_per_sec': self.requests / elapsed if elapsed > 0 else 0,
+        }
+
+
+# Запуск сервера с периодическим выводом статистики
+#
+# Params:
+# args: argparse.Namespace - параметры командной строки
+#
+# Returns -> void
+async def serve(args):
+    agent = Agent()
+    header = agent.load(args.filename)
+    if args.planner:
+        agent.use_planner(BitGame2048(header['rows'], header['cols']), header['needed'])
+
+    server = InferenceServer(agent, args.max_batch, args.max_delay_ms)
+    await server.start(args.host, args.port, args.unix)
+    try:
+        while True:
+            await asyncio.sleep(args.every)
+            print(json.dumps(server.stats()), flush=True)
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сервер стратегии 2048_MDP')
+    parser.add_argument('filename', help='файл стратегии в config.POLICIES_PATH')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=config.SERVER_PORT)
+    parser.add_argument('--unix', default=None, help='путь к сокету Unix вместо TCP')
+    parser.add_argument('--planner', action='store_true')
+    parser.add_argument('--max-batch', type=int, default=config.SERVER_MAX_BATCH)
+    parser.add_argument('--max-delay-ms', type=float, default=config.SERVER_MAX_DELAY_MS)
+    parser.add_argument('--every', type=float, default=10, help='период вывода статистики, с')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,193 @@
+import cProfile
+import functools
+import json
+import pstats
+from time import perf_counter, time
+
+
+# Включён ли сбор метрик. Места замеров проверяют этот флаг
+# перед любой работой, поэтому выключенные замеры стоят
+# одной проверки атрибута модуля
+enabled = False
+
+# Счётчики: название -> значение
+counters = {}
+
+# Таймеры: название -> [количество вызовов, суммарное время]
+timers = {}
+
+# Подключённые приёмники метрик
+sinks = []
+
+
+# Увеличение счётчика. Вызывается под проверкой
+# instrumentation.enabled
+#
+# Params:
+# name: string - название счётчика
+# value: int - прирост
+#
+# Returns -> void
+def count(name, value=1):
+    counters[name] = counters.get(name, 0) + value
+
+
+# Учёт одного замера времени
+#
+# Params:
+# name: string - название таймера
+# elapsed: float - время в секундах
+#
+# Returns -> void
+def record(name, elapsed):
+    timer = timers.get(name)
+    if timer is None:
+        timers[name] = [1, elapsed]
+    else:
+        timer[0] += 1
+        timer[1] += elapsed
+
+
+# Декоратор замера времени вызовов функции. Пока сбор
+# метрик выключен, функция вызывается напрямую
+#
+# Params:
+# name: string - название таймера
+#
+# Returns -> function
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start_time = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, perf_counter() - start_time)
+        return wrapper
+    return decorator
+
+
+# Текущие значения метрик
+#
+# Returns -> dict:
+# Счётчики и таймеры с количеством вызовов, суммарным
+# и средним временем
+def snapshot():
+    return {
+        'time': time(),
+        'counters': dict(counters),
+        'timers': {
+            name: {'count': calls, 'total': total, 'mean': total / calls}
+            for name, (calls, total) in timers.items()
+        },
+    }
+
+
+# Включение сбора метрик
+#
+# Params:
+# *new_sinks - приёмники метрик
+#
+# Returns -> void
+def enable(*new_sinks):
+    global enabled
+    for sink in new_sinks:
+        sink.start()
+        sinks.append(sink)
+    enabled = True
+
+
+# Отправка текущих метрик во все приёмники
+#
+# Returns -> void
+def report():
+    data = snapshot()
+    for sink in sinks:
+        sink.emit(data)
+
+
+# Выключение сбора метрик: итоговый отчёт, остановка
+# приёмников и сброс значений
+#
+# Returns -> void
+def disable():
+    global enabled
+    if enabled:
+        report()
+    enabled = False
+    for sink in sinks:
+        sink.stop()
+    sinks.clear()
+    counters.clear()
+    timers.clear()
+
+
+class StdoutSink:
+
+    # Вывод сводки метрик в консоль
+
+    def start(self):
+        pass
+
+    def emit(self, data):
+        for name, value in sorted(data['counters'].items()):
+            print(name + ': ' + str(value))
+        for name, timer in sorted(data['timers'].items()):
+            print(name + ': ' + str(timer['count']) + ' вызовов, ' +
+                  format(timer['total'], '.3f') + ' с, ' +
+                  format(timer['mean'] * 1e6, '.2f') + ' мкс/вызов')
+
+    def stop(self):
+        pass
+
+
+class JsonLinesSink:
+
+    # Запись метрик в файл JSON Lines: одна строка на отчёт
+    #
+    # Params:
+    # path: string - путь к файлу
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def start(self):
+        self.file = open(self.path, 'a')
+
+    def emit(self, data):
+        self.file.write(json.dumps(data) + '\n')
+        self.file.flush()
+
+    def stop(self):
+        self.file.close()
+
+
+class ProfileSink:
+
+    # Профилирование cProfile на всё время сбора метрик.
+    # При каждом отчёте выводятся самые затратные функции,
+    # при остановке статистика сохраняется в файл
+    #
+    # Params:
+    # path: string - путь к файлу статистики (None - не сохранять)
+    # top: int - количество функций в отчёте
+    def __init__(self, path=None, top=20):
+        self.path = path
+        self.top = top
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def emit(self, data):
+        self.profile.disable()
+        pstats.Stats(self.profile).sort_stats('cumulative').print_stats(self.top)
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        if self.path is not None:
+            self.profile.dump_stats(self.path)
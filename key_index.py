@@ -0,0 +1,110 @@
+import numpy as np
+
+# Хеш-таблица ключей состояний с открытой адресацией
+# и линейным пробированием. Ячейка таблицы slots хранит номер
+# состояния или -1, сам ключ берётся из массива ключей по номеру.
+# Количество ячеек - степень двойки
+
+# Множитель хеш-функции ключей (Фибоначчиево хеширование)
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+# Количество ячеек таблицы для count ключей: заполненность
+# не больше половины
+#
+# Params:
+# count: int - количество ключей
+#
+# Returns -> int
+def capacity_for(count):
+    capacity = 1024
+    while capacity < 2 * count:
+        capacity *= 2
+    return capacity
+
+
+# Номера начальных ячеек для ключей
+#
+# Params:
+# keys: np.ndarray - ключи состояний
+# capacity: int - количество ячеек таблицы
+#
+# Returns -> np.ndarray
+def hash_keys(keys, capacity):
+    bits = np.uint64(capacity.bit_length() - 1)
+    return ((np.asarray(keys, dtype=np.uint64) * HASH_MULTIPLIER) >>
+            (np.uint64(64) - bits)).astype(np.int64)
+
+
+# Вставка номеров состояний, ключей которых ещё нет в таблице.
+# Пробирование выполняется векторно: за раунд каждая свободная
+# ячейка достаётся первому претенденту, остальные переходят
+# к следующей ячейке
+#
+# Params:
+# slots: np.ndarray - ячейки таблицы
+# keys: np.ndarray - ключи состояний по номерам
+# state_ids: np.ndarray - номера вставляемых состояний
+#
+# Returns -> void
+def place(slots, keys, state_ids):
+    state_ids = np.asarray(state_ids, dtype=np.int32)
+    mask = len(slots) - 1
+    position = hash_keys(keys[state_ids], len(slots))
+    while len(state_ids):
+        free = slots[position] < 0
+        _, first = np.unique(position[free], return_index=True)
+        placed = np.nonzero(free)[0][first]
+        slots[position[placed]] = state_ids[placed]
+        left = np.ones(len(state_ids), dtype=bool)
+        left[placed] = False
+        state_ids = state_ids[left]
+        position = (position[left] + ~free[left]) & mask
+
+
+# Поиск номеров состояний для набора ключей
+#
+# Params:
+# slots: np.ndarray - ячейки таблицы
+# keys: np.ndarray - ключи состояний по номерам
+# queries: np.ndarray - искомые ключи
+#
+# Returns -> np.ndarray:
+# Номера состояний, -1 - если ключа нет в таблице
+def lookup(slots, keys, queries):
+    queries = np.asarray(queries, dtype=np.uint64)
+    mask = len(slots) - 1
+    result = np.full(len(queries), -1, dtype=np.int64)
+    pending = np.arange(len(queries))
+    position = hash_keys(queries, len(slots))
+    while len(pending):
+        ids = np.asarray(slots[position])
+        empty = ids < 0
+        found = ~empty & (keys[np.maximum(ids, 0)] == queries[pending])
+        result[pending[found]] = ids[found]
+        left = ~(empty | found)
+        pending = pending[left]
+        position = (position[left] + 1) & mask
+    return result
+
+
+# Поиск номера состояния для одного ключа. Хеш считается
+# в целых числах Python так же, как в hash_keys, поэтому
+# поиск одного ключа не создаёт массивов
+#
+# Params:
+# slots: np.ndarray - ячейки таблицы
+# keys: np.ndarray - ключи состояний по номерам
+# query: int - искомый ключ
+#
+# Returns -> int:
+# Номер состояния, -1 - если ключа нет в таблице
+def lookup_one(slots, keys, query):
+    mask = len(slots) - 1
+    shift = 65 - len(slots).bit_length()
+    position = (query * int(HASH_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> shift
+    while True:
+        state_id = int(slots[position])
+        if state_id < 0 or keys[state_id] == query:
+            return state_id
+        position = (position + 1) & mask
@@ -1,23 +1,24 @@
-import sys
 import numpy as np
 import config
-from game import Game2048
-from agent import Agent
-from app import App
+from bitboard import BitGame2048
+from policy_cache import load_policy
+from trajectory_log import TrajectoryWriter
 
 if __name__ == '__main__':
-    sys.setrecursionlimit(10000)
     np.random.seed(config.SEED)
 
-    environment = Game2048(2)
-    agent = Agent()
-
-    agent.train(environment=environment,
-                 bound_of_states=400,
-                 needed=config.NEEDED)
-    agent.create_policy(environment)
+    environment = BitGame2048(2)
+    agent, cached = load_policy(environment)
+    if cached:
+        print('Стратегия загружена из кэша')
 
     environment.init(start_state=True)
+    if config.TRAJECTORY_LOG:
+        environment.log = TrajectoryWriter(config.TRAJECTORY_LOG,
+                                           environment.rows, environment.cols)
+
+    # pygame загружается только для окна, после готовности стратегии
+    from app import App
     app = App(environment)
 
     while app.run:
@@ -26,12 +27,12 @@ if __name__ == '__main__':
         actStr = 'x'
         if environment.max_tile_value != config.NEEDED and not environment.game_over:
             state = environment.get_state()
-            action = agent.forward(state)
+            action = agent.forward(state, environment.legal_actions())
             environment.forward(action)
             value = round(agent.get_state_value(state), 2)
             actStr = config.ACTION_ARROWS[action]
 
         app.draw(value=value, action=actStr)
-        
 
-    
+    if environment.log is not None:
+        environment.log.close()
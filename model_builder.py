@@ -0,0 +1,209 @@
+from collections import deque
+from time import perf_counter
+import config
+from bitboard import BitEngine
+
+
+class ModelBuilder:
+
+    # Построитель точной модели переходов среды обходом в ширину
+    # из начального состояния. Для каждого состояния и действия
+    # перебираются все свободные ячейки и оба значения новой ячейки.
+    # Состояния - упакованные поля в формате BitGame2048.get_state
+    #
+    # Params:
+    # environment - среда, задаёт размер поля и состояние S0
+    # needed: int - победное значение ячейки
+    # symmetry: Symmetry - если задана, то состояния заменяются
+    # каноническими, а вероятности переходов в одно каноническое
+    # состояние суммируются
+    def __init__(self, environment, needed, symmetry=None):
+        self.engine = BitEngine(environment.rows, environment.cols)
+        self.symmetry = symmetry
+        self.start_state = self.__canonical(environment.start_state)
+        self.needed_exp = int(needed).bit_length() - 1
+        self.expanded = 0
+        self.states_count = 0
+        self.elapsed = 0
+
+    # Количество обработанных состояний в секунду
+    #
+    # Returns -> float
+    @property
+    def states_per_sec(self):
+        return self.states_count / self.elapsed if self.elapsed > 0 else 0
+
+    # Каноническое представление состояния, если задана симметрия
+    #
+    # Params:
+    # state: int - состояние среды
+    #
+    # Returns -> int
+    def __canonical(self, state):
+        if self.symmetry is None:
+            return state
+        return self.symmetry.canonical(state)[0]
+
+    # Распределение появления новой ячейки на поле after:
+    # 2 или 4 в каждой свободной ячейке
+    #
+    # Params:
+    # after: int - поле после хода
+    #
+    # Returns -> list:
+    # Список пар [вероятность, следующее состояние]
+    def spawn(self, after):
+        free_shifts = [shift for row in self.engine.cell_shifts for shift in row
+                       if not (after >> shift) & 0xF]
+        if not free_shifts:
+            return []
+
+        pr_2 = config.PROB_OF_2 / len(free_shifts)
+        pr_4 = config.PROB_OF_4 / len(free_shifts)
+        prs = {}
+        for shift in free_shifts:
+            for pr, next_state in ((pr_2, after | (1 << shift)), (pr_4, after | (2 << shift))):
+                next_state = self.__canonical(next_state)
+                prs[next_state] = prs.get(next_state, 0) + pr
+        return [[pr, next_state] for next_state, pr in prs.items()]
+
+    # Полное распределение переходов из состояния state
+    # после действия action: ход, затем появление 2 или 4
+    # в каждой свободной ячейке
+    #
+    # Params:
+    # state: int - состояние среды
+    # action: int - действие
+    #
+    # Returns -> list:
+    # Список пар [вероятность, следующее состояние]
+    def expand(self, state, action):
+        return self.spawn(self.engine.move(state, action)[0])
+
+    # Проверка, является ли состояние терминальным
+    #
+    # Params:
+    # state: int - состояние среды
+    #
+    # Returns -> (bool, bool):
+    # Терминальное ли состояние и победное ли оно
+    def __check_terminate_state(self, state):
+        if self.engine.max_exp(state) >= self.needed_exp:
+            return True, True
+        return self.engine.is_game_over(state), False
+
+    # Обход состояний в ширину из S0. Раскрывается не более
+    # bound_of_states состояний, оставшиеся в очереди состояния
+    # возвращаются как листья без переходов
+    #
+    # Params:
+    # bound_of_states: int - максимальное количество раскрытых
+    # состояний. Если не задано, обход идёт до конца
+    #
+    # Returns -> generator:
+    # Тройки (состояние, награда, переходы по действиям 0..3)
+    def build(self, bound_of_states=None):
+        start_time = perf_counter()
+        self.expanded = 0
+        self.states_count = 1
+
+        queue = deque([self.start_state])
+        seen = {self.start_state}
+        empty = [[], [], [], []]
+
+        while queue:
+            if bound_of_states is not None and self.expanded >= bound_of_states:
+                break
+
+            state = queue.popleft()
+            self.expanded += 1
+            is_terminate_state, is_win = self.__check_terminate_state(state)
+            if is_terminate_state:
+                yield state, config.WIN_REWARD if is_win else 0, empty
+                continue
+
+            actions = []
+            for action in range(4):
+                prs = self.expand(state, action)
+                for _, next_state in prs:
+                    if next_state not in seen:
+                        seen.add(next_state)
+                        queue.append(next_state)
+                actions.append(prs)
+
+            self.states_count = len(seen)
+            self.elapsed = perf_counter() - start_time
+            yield state, 0, actions
+
+        for state in queue:
+            _, is_win = self.__check_terminate_state(state)
+            yield state, config.WIN_REWARD if is_win else 0, empty
+
+        self.states_count = len(seen)
+        self.elapsed = perf_counter() - start_time
+
+    # Обход состояний в ширину из S0 с разложением переходов
+    # через послеходовые состояния: распределение появления
+    # новой ячейки строится один раз на послеходовое состояние.
+    # Послеходовое состояние без свободных ячеек означает
+    # недоступное действие
+    #
+    # Params:
+    # bound_of_states: int - максимальное количество раскрытых
+    # состояний. Если не задано, обход идёт до конца
+    #
+    # Returns -> generator:
+    # Четвёрки (состояние, награда, послеходовые состояния по
+    # действиям 0..3 или None, распределения новых послеходовых
+    # состояний в виде пар (послеходовое состояние, переходы))
+    def build_afterstates(self, bound_of_states=None):
+        start_time = perf_counter()
+        self.expanded = 0
+        self.states_count = 1
+
+        queue = deque([self.start_state])
+        seen = {self.start_state}
+        seen_afters = set()
+        empty = [None, None, None, None]
+
+        while queue:
+            if bound_of_states is not None and self.expanded >= bound_of_states:
+                break
+
+            state = queue.popleft()
+            self.expanded += 1
+            is_terminate_state, is_win = self.__check_terminate_state(state)
+            if is_terminate_state:
+                yield state, config.WIN_REWARD if is_win else 0, empty, []
+                continue
+
+            afters = []
+            spawns = []
+            for action in range(4):
+                after = self.engine.move(state, action)[0]
+                if not self.engine.free_cells(after):
+                    afters.append(None)
+                    continue
+                after_key = self.__canonical(after)
+                afters.append(after_key)
+                if after_key in seen_afters:
+                    continue
+
+                seen_afters.add(after_key)
+                prs = self.spawn(after)
+                for _, next_state in prs:
+                    if next_state not in seen:
+                        seen.add(next_state)
+                        queue.append(next_state)
+                spawns.append((after_key, prs))
+
+            self.states_count = len(seen)
+            self.elapsed = perf_counter() - start_time
+            yield state, 0, afters, spawns
+
+        for state in queue:
+            _, is_win = self.__check_terminate_state(state)
+            yield state, config.WIN_REWARD if is_win else 0, empty, []
+
+        self.states_count = len(seen)
+        self.elapsed = perf_counter() - start_time
@@ -0,0 +1,328 @@
+import os
+from time import perf_counter
+import numpy as np
+import codec
+import config
+from batch_game import BatchGame2048
+from bitboard import BitEngine
+from exception import AttributeError
+
+
+# Кортежи по умолчанию: первые две строки (не длиннее 4 ячеек)
+# и квадраты 2x2 в углу, у края и в центре поля
+#
+# Params:
+# rows: int - количество строк на игровом поле
+# cols: int - количество столбцов на игровом поле
+#
+# Returns -> list:
+# Кортежи - списки ячеек (строка, столбец)
+def default_tuples(rows, cols):
+    length = min(cols, 4)
+    tuples = [[(i, j) for j in range(length)] for i in range(min(rows, 2))]
+    for i, j in ((0, 0), (0, 1), (1, 1)):
+        if i + 1 < rows and j + 1 < cols:
+            tuples.append([(i, j), (i, j + 1), (i + 1, j), (i + 1, j + 1)])
+    return tuples
+
+
+# Образы кортежа при симметриях поля. Квадратное поле
+# имеет 8 симметрий, прямоугольное - 4
+#
+# Params:
+# cells: list - ячейки кортежа (строка, столбец)
+# rows: int - количество строк на игровом поле
+# cols: int - количество столбцов на игровом поле
+#
+# Returns -> list:
+# Различные образы кортежа в виде списков номеров ячеек
+def symmetric_images(cells, rows, cols):
+    images = []
+    for transpose in ((False, True) if rows == cols else (False,)):
+        for flip_rows in (False, True):
+            for flip_cols in (False, True):
+                image = []
+                for i, j in cells:
+                    if transpose:
+                        i, j = j, i
+                    if flip_rows:
+                        i = rows - 1 - i
+                    if flip_cols:
+                        j = cols - 1 - j
+                    image.append(i * cols + j)
+                if image not in images:
+                    images.append(image)
+    return images
+
+
+class NTupleAgent:
+
+    # Агент с приближённой функцией ценности для полей, на
+    # которых точная модель не помещается в память. Ценность
+    # поля - сумма весов n-кортежной сети: для каждого кортежа
+    # ячеек показатели степени в ячейках образуют индекс в таблице
+    # весов. Образы кортежа при симметриях поля разделяют одну
+    # таблицу. Размер таблиц фиксирован и не зависит от количества
+    # посещённых состояний. Обучение - TD(0) по послеходовым
+    # состояниям на пакете одновременных игр, награда - очки
+    # за слияния. Интерфейс совпадает с Agent
+    #
+    # Params:
+    # tuples: list - кортежи ячеек (строка, столбец), по умолчанию
+    # default_tuples для размера поля среды
+    # alpha: float - шаг обучения на одно поле
+    # batch: int - количество одновременных игр при обучении
+    def __init__(self, tuples=None, alpha=0.1, batch=256):
+        self.tuples = tuples
+        self.alpha = alpha
+        self.batch = batch
+        self.rows = None
+        self.cols = None
+        self.tables = []
+        self.features = []
+        self.engine = None
+
+        self.games = 0
+        self.scores = []
+        self.max_tiles = []
+        self.elapsed = 0
+
+    # Подготовка таблиц весов для поля rows x cols
+    #
+    # Params:
+    # rows: int - количество строк на игровом поле
+    # cols: int - количество столбцов на игровом поле
+    #
+    # Returns -> void
+    def __init_tables(self, rows, cols):
+        if (self.rows, self.cols) == (rows, cols) and self.tables:
+            return
+        if self.tuples is None:
+            self.tuples = default_tuples(rows, cols)
+
+        self.rows = rows
+        self.cols = cols
+        self.engine = BitEngine(rows, cols)
+        self.tables = [np.zeros(16 ** len(cells), dtype=np.float32) for cells in self.tuples]
+        self.__init_features()
+
+    # Подготовка индексов ячеек образов кортежей
+    #
+    # Returns -> void
+    def __init_features(self):
+        self.features = []
+        for cells in self.tuples:
+            images = np.array(symmetric_images(cells, self.rows, self.cols), dtype=np.int64)
+            weights = 16 ** np.arange(len(cells) - 1, -1, -1, dtype=np.int64)
+            self.features.append((images, weights))
+
+    # Индексы весов полей во всех таблицах
+    #
+    # Params:
+    # boards: np.ndarray - показатели степени формы (n, rows * cols)
+    #
+    # Returns -> list:
+    # Для каждой таблицы массив индексов формы (n, образы)
+    def __indexes(self, boards):
+        boards = boards.astype(np.int64)
+        return [boards[:, images] @ weights for images, weights in self.features]
+
+    # Ценности полей по индексам весов
+    #
+    # Params:
+    # indexes: list - индексы весов (см. __indexes)
+    #
+    # Returns -> np.ndarray
+    def __values(self, indexes):
+        total = 0
+        for table, index in zip(self.tables, indexes):
+            total = total + table[index].sum(axis=1, dtype=np.float64)
+        return total
+
+    # Количество весов, меняемых одним обновлением
+    #
+    # Returns -> int
+    def __feature_count(self):
+        return sum(len(images) for images, _ in self.features)
+
+    # Обновление весов пакетом. Если один вес встречается в пакете
+    # несколько раз, то он сдвигается на среднее обновление,
+    # иначе одновременные игры с похожими полями многократно
+    # усиливали бы шаг обучения
+    #
+    # Params:
+    # indexes: list - индексы весов (см. __indexes)
+    # updates: np.ndarray - обновления для каждого поля
+    #
+    # Returns -> void
+    def __update(self, indexes, updates):
+        for table, index in zip(self.tables, indexes):
+            weights, inverse, counts = np.unique(index, return_inverse=True, return_counts=True)
+            total = np.bincount(inverse.ravel(), weights=np.repeat(updates, index.shape[1]),
+                                minlength=len(weights))
+            table[weights] += (total / counts).astype(np.float32)
+
+    # Обучение на episodes играх. Игры идут пакетом по self.batch
+    # одновременных игр, из каждого поля выбирается ход
+    # с максимумом суммы очков и ценности послеходового состояния.
+    # Порядок параметров совпадает с Agent.train, но второй
+    # параметр - количество игр, а не состояний: размер таблиц
+    # весов не зависит от количества посещённых состояний
+    #
+    # Params:
+    # environment - среда, задаёт размер поля
+    # episodes: int - количество игр
+    # needed: int - победное значение ячейки (для статистики)
+    # verbose: bool - если True, то выводится прогресс обучения
+    #
+    # Returns -> void
+    def train(self, environment, episodes, needed=config.NEEDED, verbose=True):
+        self.__init_tables(environment.rows, environment.cols)
+        start_time = perf_counter()
+        cells = self.rows * self.cols
+        step_size = self.alpha / self.__feature_count()
+
+        games = BatchGame2048(min(self.batch, episodes), self.rows, self.cols,
+                              seed=config.SEED + self.games)
+        games.init()
+        scores = np.zeros(games.count, dtype=np.int64)
+        previous = None
+        has_previous = np.zeros(games.count, dtype=bool)
+        finished = 0
+        wins = 0
+
+        while finished < episodes:
+            boards = games.boards.reshape(games.count, cells)
+            afters, rewards = games.afterstates()
+            afters = afters.reshape(4, games.count, cells)
+            legal = (afters != boards).any(axis=2)
+
+            values = self.__values(self.__indexes(afters.reshape(-1, cells))).reshape(4, -1)
+            values = np.where(legal, rewards + values, -np.inf)
+            actions = values.argmax(axis=0)
+            done = ~legal.any(axis=0)
+            games_index = np.arange(games.count)
+
+            # TD(0): ценность прошлого послеходового состояния
+            # сдвигается к награде и ценности следующего
+            if previous is not None and has_previous.any():
+                target = np.where(done, 0, values[actions, games_index])
+                error = (target - self.__values(previous))[has_previous]
+                self.__update([index[has_previous] for index in previous], step_size * error)
+
+            chosen = afters[actions, games_index]
+            previous = self.__indexes(chosen)
+            has_previous = ~done
+            scores += np.where(done, 0, rewards[actions, games_index])
+
+            if done.any():
+                index = np.nonzero(done)[0][:episodes - finished]
+                max_tiles = games.get_max_tile()[index]
+                self.scores.extend(scores[index].tolist())
+                self.max_tiles.extend(max_tiles.tolist())
+                wins += int((max_tiles >= needed).sum())
+                finished += len(index)
+                if verbose and finished // 1000 != (finished - len(index)) // 1000:
+                    print("Игр: " + str(finished) + ", средний счёт: " +
+                          str(int(np.mean(self.scores[-1000:]))) +
+                          ", побед: " + format(wins / finished, '.3f'))
+                scores[done] = 0
+
+            games.step(chosen.reshape(games.count, self.rows, self.cols))
+            if done.any():
+                games.init(mask=done)
+
+        self.games += episodes
+        self.elapsed += perf_counter() - start_time
+
+    # Количество сыгранных при обучении игр в секунду
+    #
+    # Returns -> float
+    @property
+    def games_per_sec(self):
+        return self.games / self.elapsed if self.elapsed > 0 else 0
+
+    # Получение ценности состояния
+    #
+    # Params:
+    # state: int - состояние среды (см. codec.encode)
+    #
+    # Returns -> float
+    def get_state_value(self, state):
+        boards = codec.decode_batch([state], self.rows, self.cols, exponents=True)
+        return float(self.__values(self.__indexes(boards.reshape(1, -1)))[0])
+
+    # Вычисление следующего действия из состояния state:
+    # ход с максимумом суммы очков и ценности послеходового
+    # состояния среди доступных действий
+    #
+    # Params:
+    # state: int - состояние среды (см. codec.encode)
+    # legal: int - маска доступных действий (см. legal_actions
+    # среды). Если не задана, то недоступными считаются ходы,
+    # которые не меняют поле
+    #
+    # Returns -> int:
+    # Следующее действие
+    def forward(self, state, legal=None):
+        afters = []
+        rewards = []
+        for action in range(4):
+            after, score = self.engine.move(state, action)
+            afters.append(after)
+            rewards.append(score)
+
+        boards = codec.decode_batch(afters, self.rows, self.cols, exponents=True)
+        values = self.__values(self.__indexes(boards.reshape(4, -1))) + rewards
+        if legal is None:
+            values[[after == state for after in afters]] = -np.inf
+        else:
+            values[[not legal >> action & 1 for action in range(4)]] = -np.inf
+        return int(np.argmax(values))
+
+    # Объём памяти таблиц весов
+    #
+    # Returns -> int:
+    # Количество байт
+    def memory_usage(self):
+        return sum(table.nbytes for table in self.tables)
+
+    # Сохранение таблиц весов
+    #
+    # Params:
+    # environment - среда
+    #
+    # Returns -> string:
+    # Название файла с весами
+    def save(self, environment):
+        filename = 'ntuple' + str(environment.rows) + 'x' + str(environment.cols)
+        filename += 'g' + str(self.games) + '.npz'
+        os.makedirs(config.POLICIES_PATH, exist_ok=True)
+        arrays = {'table' + str(k): table for k, table in enumerate(self.tables)}
+        lengths = [len(cells) for cells in self.tuples]
+        np.savez(config.POLICIES_PATH + filename,
+                 shape=np.array([self.rows, self.cols, self.games]),
+                 cells=np.array([cell for cells in self.tuples for cell in cells]),
+                 lengths=np.array(lengths), **arrays)
+        return filename
+
+    # Загрузка таблиц весов из файла filename
+    #
+    # Params:
+    # filename: string - название файла с весами
+    #
+    # Returns -> dict:
+    # Размер поля и количество игр обучения
+    def load(self, filename):
+        with np.load(config.POLICIES_PATH + filename) as data:
+            if 'lengths' not in data:
+                raise AttributeError('Файл ' + filename + ' не содержит n-кортежную сеть')
+            self.rows, self.cols, self.games = data['shape'].tolist()
+            cells = [tuple(cell) for cell in data['cells'].tolist()]
+            bounds = np.cumsum([0] + data['lengths'].tolist())
+            self.tuples = [cells[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+            self.tables = [data['table' + str(k)] for k in range(len(self.tuples))]
+
+        self.engine = BitEngine(self.rows, self.cols)
+        self.__init_features()
+        return {'rows': self.rows, 'cols': self.cols, 'games': self.games}
@@ -0,0 +1,196 @@
+import os
+from multiprocessing import Pool
+from time import perf_counter
+import numpy as np
+import config
+import instrumentation
+from agent import Agent
+from exploration import FrontierExploration
+
+
+# Ключ состояния S0 в модели: каноническое поле, если модель
+# хранит канонические состояния (agent.symmetry задана)
+#
+# Params:
+# agent: Agent - агент с подготовленной канонизацией
+# (см. Agent.init_symmetry)
+# start_state: int - состояние S0
+#
+# Returns -> int
+def _start_key(agent, start_state):
+    return start_state if agent.symmetry is None else agent.symmetry.canonical(start_state)[0]
+
+
+# Изучение среды одним процессом с собственным зерном: эпизоды
+# начинаются с состояний границы общей модели (FrontierExploration),
+# а когда граница исчерпана - из состояния S0. Процесс работает,
+# пока не найдёт shard_states новых состояний
+#
+# Params:
+# task: tuple - класс среды, строки, столбцы, состояние S0,
+# победное значение ячейки, зерно, размер шарда, состояния
+# границы и флаг канонических состояний (см. Agent)
+#
+# Returns -> dict:
+# Шард: ключи и награды состояний, переходы в виде
+# массивов (состояние, действие, следующее состояние, вероятность)
+def _explore(task):
+    environment_class, rows, cols, start_state, needed, seed, shard_states, starts, canonical = task
+    np.random.seed(seed)
+
+    environment = environment_class(rows, cols)
+    environment.start_state = start_state
+    agent = Agent(canonical=canonical)
+    agent.init_symmetry(rows, cols)
+    agent.states.add(_start_key(agent, start_state))
+    agent.states.add_many(starts.tolist())
+    exploration = FrontierExploration()
+    exploration.extend(starts.tolist())
+    agent.train(environment, len(agent.states) + shard_states, needed, verbose=False,
+                exploration=exploration)
+
+    store = agent.states
+    offsets, next_id, prob = store.transitions()
+    count = len(store)
+    sa = np.repeat(np.arange(4 * count), np.diff(offsets))
+    return {
+        'keys': store.keys[:count].copy(),
+        'R': store.R[:count].copy(),
+        'src': sa // 4,
+        'action': sa % 4,
+        'next': next_id.astype(np.int64),
+        'prob': prob.copy(),
+    }
+
+
+class ParallelTrainer:
+
+    # Параллельное изучение среды несколькими процессами.
+    # Каждый раунд процессы собирают локальные шарды с зёрнами,
+    # зависящими только от config.SEED, номера раунда и номера
+    # процесса, после чего шарды сливаются в модель агента
+    # в порядке номеров процессов. Поэтому результат не зависит
+    # от того, какой процесс закончил раньше. Граница модели -
+    # состояния без переходов, из которых ещё можно сходить, -
+    # делится между
+    # процессами, поэтому процессы не ищут заново уже известную
+    # часть модели
+    #
+    # Params:
+    # environment - среда
+    # needed: int - победное значение ячейки
+    # workers: int - количество процессов, по умолчанию
+    # равно количеству ядер
+    # shard_states: int - количество состояний в одном шарде
+    def __init__(self, environment, needed, workers=None, shard_states=10000):
+        if environment.start_state is None:
+            environment.init()
+
+        self.environment = environment
+        self.needed = needed
+        self.workers = workers or os.cpu_count()
+        self.shard_states = shard_states
+        self.probe = type(environment)(environment.rows, environment.cols)
+        self.rounds = 0
+        self.states_count = 0
+        self.elapsed = 0
+
+    # Количество найденных состояний в секунду
+    #
+    # Returns -> float
+    @property
+    def states_per_sec(self):
+        return self.states_count / self.elapsed if self.elapsed > 0 else 0
+
+    # Зерно процесса worker в раунде round
+    #
+    # Params:
+    # round: int - номер раунда
+    # worker: int - номер процесса
+    #
+    # Returns -> int
+    def __seed(self, round, worker):
+        sequence = np.random.SeedSequence([config.SEED, round, worker])
+        return int(sequence.generate_state(1)[0])
+
+    # Слияние шарда в модель агента с удалением повторов
+    #
+    # Params:
+    # store: StateStore - посещённые состояния агента
+    # shard: dict - шард, собранный процессом
+    #
+    # Returns -> void
+    def __merge(self, store, shard):
+        keys = shard['keys']
+        ids = store.add_many(keys.tolist())
+        for i in np.nonzero(shard['R'] > store.R[ids])[0].tolist():
+            store.set_reward(int(keys[i]), float(shard['R'][i]))
+        store.add_transitions(ids[shard['src']], shard['action'],
+                              ids[shard['next']], shard['prob'])
+
+    # Граница модели: состояния без переходов, которые
+    # не являются победными и в которых игра не окончена
+    # (маска доступных действий не пуста)
+    #
+    # Params:
+    # store: StateStore - посещённые состояния агента
+    #
+    # Returns -> np.ndarray:
+    # Ключи состояний границы
+    def __frontier(self, store):
+        offsets, _, _ = store.transitions()
+        count = len(store)
+        expanded = offsets[4:4 * count + 1:4] > offsets[:4 * count:4]
+        frontier = np.nonzero(~expanded & (store.R[:count] != config.WIN_REWARD))[0]
+        keys = store.keys[:count][frontier]
+        playable = np.zeros(len(keys), dtype=bool)
+        for i, key in enumerate(keys.tolist()):
+            self.probe.set_state(key)
+            playable[i] = self.probe.legal_actions() != 0
+        return keys[playable]
+
+    # Изучение среды до момента, пока в модели агента не будет
+    # bound_of_states состояний
+    #
+    # Params:
+    # agent: Agent - агент. Процессы хранят состояния так же,
+    # как агент (agent.canonical)
+    # bound_of_states: int - нужное количество состояний
+    # verbose: bool - если True, то выводится прогресс по раундам
+    #
+    # Returns -> void
+    @instrumentation.timed('parallel.train')
+    def train(self, agent, bound_of_states, verbose=True):
+        start_time = perf_counter()
+        environment = self.environment
+        agent.init_symmetry(environment.rows, environment.cols)
+        store = agent.states
+        store.add(_start_key(agent, environment.start_state))
+        agent.start_state = environment.start_state
+        known = len(store)
+
+        with Pool(self.workers) as pool:
+            while len(store) < bound_of_states:
+                # Последний раунд ищет только недостающие состояния
+                remaining = bound_of_states - len(store)
+                shards = [min(self.shard_states, remaining // self.workers +
+                              (worker < remaining % self.workers))
+                          for worker in range(self.workers)]
+                frontier = self.__frontier(store)
+                tasks = [(type(environment), environment.rows, environment.cols,
+                          environment.start_state, self.needed,
+                          self.__seed(self.rounds, worker), shards[worker],
+                          frontier[worker::self.workers][:shards[worker]], agent.canonical)
+                         for worker in range(self.workers) if shards[worker] > 0]
+
+                before = len(store)
+                for shard in pool.imap(_explore, tasks):
+                    self.__merge(store, shard)
+                self.rounds += 1
+                if verbose:
+                    print("Раунд " + str(self.rounds) + ", состояний: " + str(len(store)))
+                if len(store) == before:
+                    break
+
+        self.states_count = len(store) - known
+        self.elapsed = perf_counter() - start_time
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import config
+from agent import Agent
+
+# Модули, от которых зависит решённая стратегия. Их содержимое
+# входит в ключ кэша, поэтому после изменения кода стратегия
+# строится заново
+CODE_FILES = ['agent.py', 'model_builder.py', 'solver.py', 'state_store.py',
+              'afterstate_store.py', 'bitboard.py', 'codec.py', 'symmetry.py',
+              'policy_file.py', 'random_stream.py']
+
+
+# Версия кода: хеш содержимого модулей CODE_FILES
+#
+# Returns -> string
+def code_version():
+    digest = hashlib.sha256()
+    root = os.path.dirname(os.path.abspath(__file__))
+    for name in CODE_FILES:
+        with open(os.path.join(root, name), 'rb') as f:
+            digest.update(name.encode() + b'\0' + f.read())
+    return digest.hexdigest()
+
+
+# Ключ кэша стратегии: хеш размера поля, параметров
+# игры и модели, зерна, ограничения количества состояний
+# и версии кода
+#
+# Params:
+# rows: int - количество строк на игровом поле
+# cols: int - количество столбцов на игровом поле
+# bound_of_states: int - максимальное количество раскрытых состояний
+#
+# Returns -> string
+def cache_key(rows, cols, bound_of_states=None):
+    params = {
+        'rows': rows,
+        'cols': cols,
+        'needed': config.NEEDED,
+        'gamma': config.Y,
+        'win_reward': config.WIN_REWARD,
+        'prob_of_2': config.PROB_OF_2,
+        'prob_of_4': config.PROB_OF_4,
+        'seed': config.SEED,
+        'bound_of_states': bound_of_states,
+        'code': code_version(),
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+# Имя файла стратегии в кэше
+#
+# Params:
+# rows: int - количество строк на игровом поле
+# cols: int - количество столбцов на игровом поле
+# bound_of_states: int - максимальное количество раскрытых состояний
+#
+# Returns -> string
+def cache_filename(rows, cols, bound_of_states=None):
+    return 'policy' + str(rows) + 'x' + str(cols) + 'c' + cache_key(rows, cols, bound_of_states) + '.bin'
+
+
+# Получение решённой стратегии для среды environment: стратегия
+# загружается из config.POLICIES_PATH по ключу кэша, если она
+# там есть, иначе строится точная модель (Agent.build), решается
+# и сохраняется в кэш. Среда переводится в начальное состояние,
+# если оно ещё не задано, поэтому поток случайных чисел среды
+# одинаков при загрузке и при построении
+#
+# Params:
+# environment: BitGame2048 - среда
+# bound_of_states: int - максимальное количество раскрытых состояний
+# verbose: bool - если True, то выводится статистика построения модели
+#
+# Returns -> (Agent, bool):
+# Агент с решённой стратегией и True, если стратегия взята из кэша
+def load_policy(environment, bound_of_states=None, verbose=True):
+    if environment.start_state is None:
+        environment.init()
+
+    agent = Agent()
+    filename = cache_filename(environment.rows, environment.cols, bound_of_states)
+    if os.path.exists(config.POLICIES_PATH + filename):
+        agent.load(filename)
+        environment.start_state = agent.start_state
+        return agent, True
+
+    agent.build(environment=environment,
+                bound_of_states=bound_of_states,
+                needed=config.NEEDED,
+                verbose=verbose)
+    agent.create_policy(environment)
+    agent.checkpoint(environment, filename)
+    return agent, False
@@ -0,0 +1,225 @@
+import struct
+import numpy as np
+from exception import AttributeError
+from afterstate_store import AfterstateStore
+from state_store import StateStore, segments
+
+
+MAGIC = b'MDP2048\0'
+VERSION = 1
+
+# Флаги заголовка
+FLAG_CANONICAL = 1
+FLAG_AFTERSTATES = 2
+
+# Заголовок: сигнатура, версия, строки, столбцы, победное
+# значение ячейки, коэффициент дисконтирования, количество
+# состояний и переходов, флаги, состояние S0
+HEADER = struct.Struct('<8sIIIIdQQIQ')
+
+# Порядок и типы массивов в файле после заголовка. Флаги
+# решённости сохраняются, чтобы контрольную точку недорешённой
+# модели можно было дорешать частично
+ARRAYS = [
+    ('keys', np.uint64),
+    ('V', np.float64),
+    ('R', np.float64),
+    ('best_action', np.int8),
+    ('offsets', np.int64),
+    ('next_id', np.int32),
+    ('prob', np.float64),
+    ('solved', np.bool_),
+]
+
+# Модель послеходовых состояний (флаг FLAG_AFTERSTATES)
+# дописывается после массивов ARRAYS: количество послеходовых
+# состояний и их переходов, затем массивы AFTER_ARRAYS
+AFTER_HEADER = struct.Struct('<QQ')
+
+AFTER_ARRAYS = [
+    ('action_after', np.int32),
+    ('after_keys', np.uint64),
+    ('W', np.float64),
+    ('after_offsets', np.int64),
+    ('after_next', np.int32),
+    ('after_prob', np.float64),
+]
+
+
+# Длина массива с заданным именем
+#
+# Params:
+# name: string - название массива
+# states: int - количество состояний
+# transitions: int - количество переходов
+# after_states: int - количество послеходовых состояний
+# after_edges: int - количество переходов послеходовых состояний
+#
+# Returns -> int
+def _array_length(name, states, transitions, after_states=0, after_edges=0):
+    if name in ('offsets', 'action_after'):
+        return 4 * states + (name == 'offsets')
+    if name in ('next_id', 'prob'):
+        return transitions
+    if name in ('after_keys', 'W'):
+        return after_states
+    if name == 'after_offsets':
+        return after_states + 1
+    if name in ('after_next', 'after_prob'):
+        return after_edges
+    return states
+
+
+# Запись массивов в файл, каждый с выравниванием на 8 байт
+#
+# Params:
+# f: file - файл, открытый на запись
+# arrays: dict - массивы по названиям
+# layout: list - порядок и типы массивов
+#
+# Returns -> void
+def _write_arrays(f, arrays, layout):
+    for name, dtype in layout:
+        f.write(b'\0' * (_align(f.tell()) - f.tell()))
+        f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+
+
+# Отображение массивов из файла, каждый с выравниванием на 8 байт
+#
+# Params:
+# data: np.memmap - содержимое файла
+# offset: int - смещение первого массива
+# layout: list - порядок и типы массивов
+# counts: tuple - количества для _array_length
+#
+# Returns -> (dict, int):
+# Массивы по названиям и смещение после последнего массива
+def _read_arrays(data, offset, layout, counts):
+    arrays = {}
+    for name, dtype in layout:
+        offset = _align(offset)
+        size = _array_length(name, *counts) * np.dtype(dtype).itemsize
+        arrays[name] = data[offset:offset + size].view(dtype)
+        offset += size
+    return arrays, offset
+
+
+# Смещение, выровненное на 8 байт
+#
+# Params:
+# offset: int - смещение в байтах
+#
+# Returns -> int
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+# Запись стратегии в бинарный файл. Состояния упорядочиваются
+# по ключу, чтобы при загрузке искать их двоичным поиском.
+# Для модели послеходовых состояний (AfterstateStore)
+# дописываются её массивы
+#
+# Params:
+# path: string - путь к файлу
+# store: StateStore - посещённые состояния агента
+# rows: int - количество строк на игровом поле
+# cols: int - количество столбцов на игровом поле
+# needed: int - победное значение ячейки
+# gamma: float - коэффициент дисконтирования
+# canonical: bool - хранятся ли канонические состояния
+# start_state: int - состояние S0, с которого идёт изучение среды
+#
+# Returns -> void
+def write_policy(path, store, rows, cols, needed, gamma, canonical=False,
+                 start_state=None):
+    offsets, next_id, prob = store.transitions()
+    count = len(store)
+    keys = store.keys[:count]
+
+    order = np.argsort(keys, kind='stable')
+    new_id = np.empty(count, dtype=np.int32)
+    new_id[order] = np.arange(count, dtype=np.int32)
+
+    sa_order = (order[:, None] * 4 + np.arange(4)).ravel()
+    edges, _ = segments(offsets[sa_order], offsets[sa_order + 1])
+    new_offsets = np.zeros(4 * count + 1, dtype=np.int64)
+    np.cumsum(np.diff(offsets)[sa_order], out=new_offsets[1:])
+
+    arrays = {
+        'keys': keys[order],
+        'V': store.V[:count][order],
+        'R': store.R[:count][order],
+        'best_action': store.best_actions()[order],
+        'offsets': new_offsets,
+        'next_id': new_id[next_id[edges]],
+        'prob': prob[edges],
+        'solved': store.solved[:count][order],
+    }
+
+    after_arrays = None
+    if isinstance(store, AfterstateStore):
+        afters, after_offsets, after_next, after_prob = store.afterstates()
+        after_arrays = {
+            'action_after': afters[order].ravel(),
+            'after_keys': store.after_keys[:store.after_count],
+            'W': store.W[:store.after_count],
+            'after_offsets': after_offsets,
+            'after_next': new_id[after_next],
+            'after_prob': after_prob,
+        }
+
+    with open(path, 'wb') as f:
+        flags = FLAG_CANONICAL if canonical else 0
+        if after_arrays is not None:
+            flags |= FLAG_AFTERSTATES
+        f.write(HEADER.pack(MAGIC, VERSION, rows, cols, needed, gamma,
+                            count, len(edges), flags,
+                            0 if start_state is None else start_state))
+        _write_arrays(f, arrays, ARRAYS)
+        if after_arrays is not None:
+            f.write(b'\0' * (_align(f.tell()) - f.tell()))
+            f.write(AFTER_HEADER.pack(store.after_count, len(after_next)))
+            _write_arrays(f, after_arrays, AFTER_ARRAYS)
+
+
+# Загрузка стратегии из бинарного файла. Массивы отображаются
+# в память без копирования, поэтому загрузка почти мгновенна,
+# а несколько процессов разделяют одни и те же страницы
+#
+# Params:
+# path: string - путь к файлу
+#
+# Returns -> (StateStore, dict):
+# Хранилище только для чтения и поля заголовка
+def read_policy(path):
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    magic, version, rows, cols, needed, gamma, states, transitions, flags, start_state = \
+        HEADER.unpack(data[:HEADER.size].tobytes())
+
+    if magic != MAGIC:
+        raise AttributeError('Файл ' + path + ' не является файлом стратегии')
+    if version != VERSION:
+        raise AttributeError('Неподдерживаемая версия файла стратегии: ' + str(version))
+
+    arrays, offset = _read_arrays(data, HEADER.size, ARRAYS, (states, transitions))
+
+    header = {
+        'version': version,
+        'rows': rows,
+        'cols': cols,
+        'needed': needed,
+        'gamma': gamma,
+        'states': states,
+        'transitions': transitions,
+        'canonical': bool(flags & FLAG_CANONICAL),
+        'start_state': start_state or None,
+    }
+    if not flags & FLAG_AFTERSTATES:
+        return StateStore.from_arrays(**arrays), header
+
+    offset = _align(offset)
+    after_states, after_edges = AFTER_HEADER.unpack(data[offset:offset + AFTER_HEADER.size].tobytes())
+    after_arrays, _ = _read_arrays(data, offset + AFTER_HEADER.size, AFTER_ARRAYS,
+                                   (states, transitions, after_states, after_edges))
+    header['afterstates'] = after_states
+    return AfterstateStore.from_arrays(**after_arrays, **arrays), header
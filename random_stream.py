@@ -0,0 +1,50 @@
+import numpy as np
+import config
+
+
+class RandomStream:
+
+    # Собственный поток случайных чисел игры. Числа берутся
+    # из np.random.Generator блоками по block штук, поэтому
+    # одно число стоит одного обращения к списку, а не вызова
+    # NumPy. Игра с тем же зерном и теми же действиями повторяется
+    # в точности
+    #
+    # Params:
+    # seed: int - зерно. Если не задано, то берётся из глобального
+    # генератора NumPy, чтобы np.random.seed по-прежнему делал
+    # запуск воспроизводимым
+    # block: int - количество чисел, вытягиваемых за раз
+    def __init__(self, seed=None, block=config.RANDOM_BLOCK):
+        if seed is None:
+            seed = int(np.random.randint(0, 2 ** 63 - 1, dtype=np.int64))
+        self.seed = seed
+        self.generator = np.random.default_rng(seed)
+        self.block = block
+        self.__values = []
+        self.__position = 0
+
+    # Случайное число из [0, 1)
+    #
+    # Returns -> float
+    def random(self):
+        if self.__position == len(self.__values):
+            self.__values = self.generator.random(self.block).tolist()
+            self.__position = 0
+        value = self.__values[self.__position]
+        self.__position += 1
+        return value
+
+    # Выбор новой ячейки одним случайным числом: целая часть
+    # u * free - номер свободной ячейки, дробная часть решает,
+    # будет ли в ней 4 (с вероятностью config.PROB_OF_4)
+    #
+    # Params:
+    # free: int - количество свободных ячеек
+    #
+    # Returns -> (int, bool):
+    # Номер свободной ячейки и True, если новая ячейка - 4
+    def spawn(self, free):
+        scaled = self.random() * free
+        index = int(scaled)
+        return index, scaled - index < config.PROB_OF_4
@@ -0,0 +1,405 @@
+from time import perf_counter
+import numpy as np
+import config
+from afterstate_store import AfterstateStore
+from codec import tile_sums
+from spill_store import SpillStore
+from state_store import segments
+from exception import AttributeError
+
+
+class ValueSolver:
+
+    # Нерекурсивное вычисление ценностей состояний.
+    # Сумма ячеек строго растёт с каждым ходом, поэтому граф
+    # состояний ацикличен: состояния решаются слоями, начиная
+    # с тех, у которых все следующие состояния уже решены.
+    # Ценности слоя считаются одной векторной операцией
+    #
+    # Params:
+    # gamma: float - коэффициент дисконтирования
+    # partial_limit: float - максимальная доля модели, которая
+    # пересчитывается частично, иначе модель решается с нуля.
+    # Частичный пересчёт пятой части модели занимает примерно
+    # столько же, сколько решение с нуля
+    def __init__(self, gamma=config.Y, partial_limit=config.PARTIAL_RESOLVE_LIMIT):
+        self.gamma = gamma
+        self.partial_limit = partial_limit
+        self.layers = 0
+        self.elapsed = 0
+
+    # Вычисление ценностей по модели в виде массивов.
+    # Ценность победного состояния равна config.WIN_REWARD,
+    # остальных - R + gamma * сумма pr * V по всем действиям
+    #
+    # Params:
+    # R: np.ndarray - награды состояний формы (n,)
+    # offsets: np.ndarray - начала переходов для пары
+    # (состояние, действие) с номером state * 4 + action, форма (4n + 1,)
+    # next_id: np.ndarray - номера следующих состояний, -1 если
+    # следующее состояние отсутствует в модели
+    # prob: np.ndarray - вероятности переходов
+    # graph: tuple - обратные рёбра (см. graph), если уже построены
+    #
+    # Returns -> np.ndarray:
+    # Ценности состояний формы (n,)
+    def solve(self, R, offsets, next_id, prob, graph=None):
+        start_time = perf_counter()
+        n = len(R)
+        R = np.asarray(R, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+
+        # Обратные рёбра: для каждого состояния - переходы в него
+        edge_src, order, rev_offsets = self.graph(offsets, next_id) if graph is None else graph
+        known = next_id >= 0
+        fixed = R == config.WIN_REWARD
+
+        # Число нерешённых переходов каждого состояния
+        pending = np.bincount(edge_src[known & ~fixed[edge_src]], minlength=n)
+
+        V = np.zeros(n, dtype=np.float64)
+        solved = np.zeros(n, dtype=bool)
+        layer = np.nonzero(pending == 0)[0]
+        self.layers = 0
+
+        while len(layer):
+            V[layer] = self.__backup(layer, R, offsets, next_id, prob, V)
+            solved[layer] = True
+            self.layers += 1
+
+            back, _ = segments(rev_offsets[layer], rev_offsets[layer + 1])
+            preds = edge_src[order[back]]
+            preds = preds[~fixed[preds]]
+            preds, counts = np.unique(preds, return_counts=True)
+            pending[preds] -= counts
+            layer = preds[pending[preds] == 0]
+
+        if not solved.all():
+            raise AttributeError('Граф состояний содержит циклы')
+
+        self.elapsed = perf_counter() - start_time
+        return V
+
+    # Обратные рёбра графа переходов
+    #
+    # Params:
+    # next_id: np.ndarray - номера следующих состояний
+    # n: int - количество состояний
+    #
+    # Returns -> (np.ndarray, np.ndarray):
+    # Номера переходов, упорядоченные по следующему состоянию,
+    # и начала переходов в каждое состояние в этом порядке
+    def __reverse(self, next_id, n):
+        known = next_id >= 0
+        order = np.argsort(np.where(known, next_id, n))
+        order = order[:known.sum()]
+        return order, np.searchsorted(next_id[order], np.arange(n + 1))
+
+    # Ценности набора состояний по текущим ценностям
+    # следующих состояний
+    #
+    # Params:
+    # layer: np.ndarray - номера состояний
+    # R: np.ndarray - награды состояний
+    # offsets, next_id, prob - переходы в формате CSR
+    # V: np.ndarray - ценности состояний
+    #
+    # Returns -> np.ndarray
+    def __backup(self, layer, R, offsets, next_id, prob, V):
+        edges, seg = segments(offsets[layer * 4], offsets[layer * 4 + 4])
+        targets = next_id[edges]
+        contrib = prob[edges] * np.where(targets >= 0, V[targets], 0)
+        total = np.bincount(seg, weights=contrib, minlength=len(layer))
+        rewards = R[layer]
+        return np.where(rewards == config.WIN_REWARD, config.WIN_REWARD,
+                        rewards + self.gamma * total)
+
+    # Обратные рёбра графа переходов модели
+    #
+    # Params:
+    # offsets, next_id - переходы в формате CSR
+    #
+    # Returns -> (np.ndarray, np.ndarray, np.ndarray):
+    # Номер исходного состояния каждого перехода, номера
+    # переходов, упорядоченные по следующему состоянию, и начала
+    # переходов в каждое состояние в этом порядке
+    def graph(self, offsets, next_id):
+        n = (len(offsets) - 1) // 4
+        edge_src = np.repeat(np.arange(n), np.diff(offsets[::4]))
+        return (edge_src,) + self.__reverse(next_id, n)
+
+    # Состояния, ценности которых зависят от изменённых:
+    # сами изменённые состояния и все их предки
+    #
+    # Params:
+    # offsets, next_id - переходы в формате CSR
+    # dirty: np.ndarray - маска изменённых состояний
+    # limit: int - максимальное количество состояний для пересчёта
+    # graph: tuple - обратные рёбра (см. graph), если уже построены
+    #
+    # Returns -> np.ndarray:
+    # Маска состояний для пересчёта или None, если их больше limit
+    def affected(self, offsets, next_id, dirty, limit=None, graph=None):
+        edge_src, order, rev_offsets = self.graph(offsets, next_id) if graph is None else graph
+
+        active = dirty.copy()
+        frontier = np.nonzero(dirty)[0]
+        while len(frontier):
+            back, _ = segments(rev_offsets[frontier], rev_offsets[frontier + 1])
+            preds = edge_src[order[back]]
+            frontier = np.unique(preds[~active[preds]])
+            active[frontier] = True
+            if limit is not None:
+                limit -= len(frontier)
+                if limit < 0:
+                    return None
+        return active
+
+    # Пересчёт ценностей части состояний. Отмеченные состояния
+    # решаются слоями, как в solve, ценности остальных берутся
+    # из V без изменений. Работа пропорциональна количеству
+    # отмеченных состояний и их переходов
+    #
+    # Params:
+    # R: np.ndarray - награды состояний формы (n,)
+    # offsets, next_id, prob - переходы в формате CSR
+    # V: np.ndarray - текущие ценности состояний
+    # active: np.ndarray - маска пересчитываемых состояний,
+    # замкнутая относительно предков (см. affected)
+    #
+    # Returns -> np.ndarray:
+    # Ценности состояний формы (n,)
+    def resolve(self, R, offsets, next_id, prob, V, active):
+        start_time = perf_counter()
+        n = len(R)
+        R = np.asarray(R, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        V = np.array(V, dtype=np.float64)
+        fixed = R == config.WIN_REWARD
+
+        states = np.nonzero(active)[0]
+        local = np.full(n, -1, dtype=np.int64)
+        local[states] = np.arange(len(states))
+
+        # Переходы между пересчитываемыми состояниями
+        edges, seg = segments(offsets[states * 4], offsets[states * 4 + 4])
+        targets = next_id[edges]
+        inner = targets >= 0
+        inner[inner] = active[targets[inner]]
+        inner &= ~fixed[states[seg]]
+        src = seg[inner]
+        dst = local[targets[inner]]
+
+        pending = np.bincount(src, minlength=len(states))
+        order = np.argsort(dst)
+        rev_offsets = np.searchsorted(dst[order], np.arange(len(states) + 1))
+
+        solved = np.zeros(len(states), dtype=bool)
+        layer = np.nonzero(pending == 0)[0]
+        self.layers = 0
+
+        while len(layer):
+            V[states[layer]] = self.__backup(states[layer], R, offsets, next_id, prob, V)
+            solved[layer] = True
+            self.layers += 1
+
+            back, _ = segments(rev_offsets[layer], rev_offsets[layer + 1])
+            preds, counts = np.unique(src[order[back]], return_counts=True)
+            pending[preds] -= counts
+            layer = preds[pending[preds] == 0]
+
+        if not solved.all():
+            raise AttributeError('Граф состояний содержит циклы')
+
+        self.elapsed = perf_counter() - start_time
+        return V
+
+    # Вычисление ценностей модели, массивы которой не помещаются
+    # в память, например отображены в память из файлов. Каждый
+    # переход увеличивает сумму ячеек, поэтому состояния решаются
+    # группами по убыванию суммы, а группа - кусками по chunk
+    # состояний. Порядок состояний строится сортировкой подсчётом
+    # прямо в буфер order. Объём памяти ограничен размером куска
+    # и количеством различных сумм
+    #
+    # Params:
+    # keys: np.ndarray - ключи состояний формы (n,)
+    # R: np.ndarray - награды состояний формы (n,)
+    # offsets, next_id, prob - переходы в формате CSR
+    # V: np.ndarray - массив для ценностей состояний формы (n,)
+    # order: np.ndarray - буфер int64 формы (n,) для номеров
+    # состояний, упорядоченных по убыванию суммы
+    # chunk: int - количество состояний, обрабатываемых за раз
+    #
+    # Returns -> void
+    def solve_by_sum(self, keys, R, offsets, next_id, prob, V, order, chunk=1 << 18):
+        start_time = perf_counter()
+        n = len(keys)
+
+        counts = np.zeros(0, dtype=np.int64)
+        for start in range(0, n, chunk):
+            sums = tile_sums(keys[start:start + chunk])
+            part = np.bincount(sums, minlength=len(counts))
+            part[:len(counts)] += counts
+            counts = part
+
+        # Группа с наибольшей суммой идёт первой
+        counts = counts[::-1]
+        top = len(counts) - 1
+        cursor = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        bounds = np.append(cursor, n)
+        for start in range(0, n, chunk):
+            groups = top - tile_sums(keys[start:start + chunk])
+            sort = np.argsort(groups, kind='stable')
+            groups = groups[sort]
+            run_starts = np.searchsorted(groups, groups)
+            order[cursor[groups] + np.arange(len(groups)) - run_starts] = start + sort
+            cursor += np.bincount(groups, minlength=len(cursor))
+
+        self.layers = 0
+        for group in np.nonzero(counts)[0]:
+            for start in range(bounds[group], bounds[group + 1], chunk):
+                layer = np.asarray(order[start:min(start + chunk, bounds[group + 1])])
+                V[layer] = self.__backup(layer, R, offsets, next_id, prob, V)
+            self.layers += 1
+
+        self.elapsed = perf_counter() - start_time
+
+    # Вычисление ценностей по модели послеходовых состояний.
+    # Ценность послеходового состояния W - сумма pr * V по
+    # появлению новой ячейки, ценность состояния - R + gamma *
+    # максимум W по доступным действиям, победного состояния -
+    # config.WIN_REWARD. Состояния и послеходовые состояния
+    # решаются общими слоями, как в solve
+    #
+    # Params:
+    # R: np.ndarray - награды состояний формы (n,)
+    # afters: np.ndarray - номера послеходовых состояний по
+    # действиям формы (n, 4), -1 если действие недоступно
+    # after_offsets: np.ndarray - начала переходов послеходовых
+    # состояний, форма (m + 1,)
+    # after_next: np.ndarray - номера следующих состояний
+    # after_prob: np.ndarray - вероятности переходов
+    #
+    # Returns -> (np.ndarray, np.ndarray):
+    # Ценности состояний формы (n,) и послеходовых состояний формы (m,)
+    def solve_afterstates(self, R, afters, after_offsets, after_next, after_prob):
+        start_time = perf_counter()
+        n = len(R)
+        m = len(after_offsets) - 1
+        R = np.asarray(R, dtype=np.float64)
+        fixed = R == config.WIN_REWARD
+        valid = (afters >= 0) & ~fixed[:, None]
+
+        # Общий граф: вершины 0..n-1 - состояния, n..n+m-1 -
+        # послеходовые состояния
+        after_src = np.repeat(np.arange(m), np.diff(after_offsets))
+        src = np.concatenate([np.nonzero(valid)[0], n + after_src])
+        dst = np.concatenate([n + afters[valid], after_next])
+        pending = np.bincount(src, minlength=n + m)
+        order, rev_offsets = self.__reverse(dst, n + m)
+
+        V = np.zeros(n, dtype=np.float64)
+        W = np.zeros(m, dtype=np.float64)
+        solved = np.zeros(n + m, dtype=bool)
+        layer = np.nonzero(pending == 0)[0]
+        self.layers = 0
+
+        while len(layer):
+            after_layer = layer[layer >= n] - n
+            if len(after_layer):
+                edges, seg = segments(after_offsets[after_layer], after_offsets[after_layer + 1])
+                W[after_layer] = np.bincount(seg, weights=after_prob[edges] * V[after_next[edges]],
+                                             minlength=len(after_layer))
+
+            state_layer = layer[layer < n]
+            if len(state_layer):
+                state_valid = valid[state_layer]
+                values = np.where(state_valid, W[afters[state_layer]], -np.inf).max(axis=1)
+                values = np.where(state_valid.any(axis=1), values, 0)
+                V[state_layer] = np.where(fixed[state_layer], config.WIN_REWARD,
+                                          R[state_layer] + self.gamma * values)
+
+            solved[layer] = True
+            self.layers += 1
+
+            back, _ = segments(rev_offsets[layer], rev_offsets[layer + 1])
+            preds, counts = np.unique(src[order[back]], return_counts=True)
+            pending[preds] -= counts
+            layer = preds[pending[preds] == 0]
+
+        if not solved.all():
+            raise AttributeError('Граф состояний содержит циклы')
+
+        self.elapsed = perf_counter() - start_time
+        return V, W
+
+    # Вычисление ценностей для модели в хранилище StateStore.
+    # Если часть состояний уже решена, то пересчитываются только
+    # нерешённые состояния и их предки (см. affected). Ценности и флаги решённости записываются
+    # в хранилище. Модель послеходовых состояний
+    # (AfterstateStore) всегда решается целиком, хранилище
+    # в файлах (SpillStore) - целиком по группам сумм ячеек.
+    # Полностью решённая модель не изменяется, поэтому модель,
+    # загруженная из файла, остаётся отображённой в память
+    #
+    # Params:
+    # store: StateStore - посещённые состояния агента
+    #
+    # Returns -> int:
+    # Количество пересчитанных состояний
+    def solve_store(self, store):
+        if isinstance(store, AfterstateStore):
+            count = len(store)
+            if store.solved[:count].all():
+                return 0
+            store.thaw()
+            store.V[:count], store.W[:store.after_count] = \
+                self.solve_afterstates(store.R[:count], *store.afterstates())
+            store.solved[:count] = True
+            store.best_action = None
+            store.version += 1
+            return count
+
+        if isinstance(store, SpillStore):
+            offsets, next_id, prob = store.transitions()
+            count = len(store)
+            if store.solved[:count].all():
+                store.best_action = None
+                return 0
+            self.solve_by_sum(store.keys[:count], store.R[:count], offsets, next_id, prob,
+                              store.V, store.scratch('order', np.int64, count))
+            store.solved[:count] = True
+            store.best_action = None
+            store.version += 1
+            return count
+
+        # Слияние буфера переходов помечает изменённые состояния
+        # нерешёнными, у загруженной модели буфер пуст и массивы
+        # не копируются
+        store.transitions()
+        count = len(store)
+        dirty = ~store.solved[:count]
+        if not dirty.any():
+            return 0
+        store.thaw()
+        offsets, next_id, prob = store.transitions()
+        store.best_action = None
+
+        # Если изменения затронули большую часть модели,
+        # то решение с нуля дешевле. Обратные рёбра строятся
+        # один раз для поиска предков и для решения с нуля
+        limit = int(self.partial_limit * count) - int(dirty.sum())
+        graph = self.graph(offsets, next_id)
+        active = None if limit < 0 else self.affected(offsets, next_id, dirty, limit, graph)
+        if active is None:
+            store.V[:count] = self.solve(store.R[:count], offsets, next_id, prob, graph)
+            store.solved[:count] = True
+            store.version += 1
+            return count
+
+        store.V[:count] = self.resolve(store.R[:count], offsets, next_id, prob,
+                                       store.V[:count], active)
+        store.solved[:count] = True
+        store.version += 1
+        return int(active.sum())
@@ -0,0 +1,534 @@
+import os
+import shutil
+import sys
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import config
+import instrumentation
+from key_index import hash_keys, lookup, place
+from state_store import StateStore, segments
+
+# Оценка объёма одной записи кэша ключей в байтах:
+# элемент OrderedDict, ключ и номер состояния
+ENTRY_BYTES = 176
+# Объём одного перехода в буфере новых переходов
+STAGED_BYTES = 20
+# Количество пар (состояние, действие), сливаемых за раз
+MERGE_CHUNK = 1 << 18
+
+
+# Отображение файла в память. Файл создаётся или дополняется
+# нулями до нужной длины
+#
+# Params:
+# path: string - путь к файлу
+# dtype: np.dtype - тип элементов
+# length: int - количество элементов
+# create: bool - если True, то прежнее содержимое файла удаляется
+#
+# Returns -> np.memmap
+def _map(path, dtype, length, create=False):
+    mode = 'w+' if create or not os.path.exists(path) else 'r+'
+    return np.memmap(path, dtype=dtype, mode=mode, shape=(max(length, 1),))
+
+
+class _DiskIndex:
+
+    # Хеш-таблица с открытой адресацией в файле: ячейка хранит
+    # номер состояния или -1, сам ключ берётся из массива ключей
+    # хранилища. Заполненность таблицы не больше половины
+    #
+    # Params:
+    # path: string - путь к файлу таблицы
+    # keys: np.ndarray - ключи состояний по номерам
+    def __init__(self, path, keys):
+        self.path = path
+        self.keys = keys
+        self.count = 0
+        self.slots = self.__create(path, 1024)
+
+    # Создание пустой таблицы
+    #
+    # Params:
+    # path: string - путь к файлу
+    # capacity: int - количество ячеек, степень двойки
+    #
+    # Returns -> np.memmap
+    def __create(self, path, capacity):
+        slots = _map(path, np.int32, capacity, create=True)
+        slots[:] = -1
+        return slots
+
+    # Поиск номера состояния по ключу
+    #
+    # Params:
+    # key: int - состояние среды
+    #
+    # Returns -> int:
+    # Номер состояния или -1, если ключа нет в таблице
+    def get(self, key):
+        if self.count == 0:
+            return -1
+        mask = len(self.slots) - 1
+        slot = int(hash_keys([key], len(self.slots))[0])
+        while True:
+            state_id = int(self.slots[slot])
+            if state_id < 0 or self.keys[state_id] == key:
+                return state_id
+            slot = (slot + 1) & mask
+
+    # Поиск номеров состояний для набора ключей
+    #
+    # Params:
+    # keys: np.ndarray - состояния среды
+    #
+    # Returns -> np.ndarray:
+    # Номера состояний, -1 - если ключа нет в таблице
+    def get_many(self, keys):
+        if self.count == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        return lookup(self.slots, self.keys, keys)
+
+    # Вставка номеров состояний, ключей которых ещё нет в таблице
+    #
+    # Params:
+    # state_ids: np.ndarray - номера состояний
+    #
+    # Returns -> void
+    def insert(self, state_ids):
+        if 2 * (self.count + len(state_ids)) > len(self.slots):
+            self.__resize(2 * (self.count + len(state_ids)))
+        place(self.slots, self.keys, state_ids)
+        self.count += len(state_ids)
+
+    # Перестроение таблицы с новой ёмкостью
+    #
+    # Params:
+    # needed: int - минимальное количество ячеек
+    #
+    # Returns -> void
+    def __resize(self, needed):
+        capacity = len(self.slots)
+        while capacity < needed:
+            capacity *= 2
+        slots = self.__create(self.path + '.new', capacity)
+        for start in range(0, len(self.slots), MERGE_CHUNK):
+            part = np.asarray(self.slots[start:start + MERGE_CHUNK])
+            place(slots, self.keys, part[part >= 0])
+        slots.flush()
+        del slots
+        self.slots = None
+        os.replace(self.path + '.new', self.path)
+        self.slots = _map(self.path, np.int32, capacity)
+
+
+class SpillStore(StateStore):
+
+    # Хранилище состояний, ограниченное по памяти. Массивы
+    # состояний и переходов CSR лежат в файлах, отображённых
+    # в память, поэтому в памяти находятся только используемые
+    # страницы. Словарь ключей заменён кэшем LRU с бюджетом
+    # в байтах поверх хеш-таблицы в файле (_DiskIndex): состояния,
+    # вытесненные из кэша, ищутся в файле. Новые переходы копятся
+    # в буфере ограниченного размера, полный буфер дописывается
+    # в журнал отсортированным отрезком. Журнал сливается с файлами
+    # CSR, когда он дорастает до их размера или когда нужны
+    # переходы (transitions), поэтому каждый переход переписывается
+    # амортизированно O(1) раз. Модель решается по группам сумм ячеек
+    # (ValueSolver.solve_by_sum).
+    # Счётчики: hits, misses - обращения к кэшу, disk_hits -
+    # ключи, найденные в файле, spills - ключи, записанные в файл,
+    # evictions - ключи, вытесненные из кэша
+    #
+    # Params:
+    # path: string - каталог для файлов, по умолчанию временный
+    # каталог, удаляемый при close
+    # cache_bytes: int - бюджет памяти кэша ключей и буфера
+    # новых переходов
+    def __init__(self, path=None, cache_bytes=config.SPILL_CACHE_BYTES):
+        super().__init__(capacity=1)
+        self.temporary = path is None
+        self.path = tempfile.mkdtemp(prefix='spill') if path is None else path
+        os.makedirs(self.path, exist_ok=True)
+
+        self.cache_limit = max(1024, 3 * cache_bytes // 4 // ENTRY_BYTES)
+        self.index = OrderedDict()
+        self.keys = self.__map('keys', np.uint64, 1024, create=True)
+        self.V = self.__map('V', np.float64, 1024, create=True)
+        self.R = self.__map('R', np.float64, 1024, create=True)
+        self.solved = self.__map('solved', np.bool_, 1024, create=True)
+        self.disk = _DiskIndex(self.__file('index'), self.keys)
+        self.written = 0
+
+        self.__pairs = 0
+        self.__edges = 0
+        self.__offsets = self.__map('offsets', np.int64, 1, create=True)
+        self.__next_id = self.__map('next_id', np.int32, 0, create=True)
+        self.__prob = self.__map('prob', np.float64, 0, create=True)
+
+        self.__logged = 0
+        self.__runs = []
+        self.__log_sa = self.__map('log_sa', np.int64, 0, create=True)
+        self.__log_next = self.__map('log_next', np.int32, 0, create=True)
+        self.__log_prob = self.__map('log_prob', np.float64, 0, create=True)
+
+        staged = max(1024, cache_bytes // 4 // STAGED_BYTES)
+        self.__staged = 0
+        self.__staged_sa = np.zeros(staged, dtype=np.int64)
+        self.__staged_next = np.zeros(staged, dtype=np.int32)
+        self.__staged_prob = np.zeros(staged, dtype=np.float64)
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.spills = 0
+        self.evictions = 0
+
+    # Путь к файлу массива name
+    #
+    # Params:
+    # name: string - название массива
+    #
+    # Returns -> string
+    def __file(self, name):
+        return os.path.join(self.path, name + '.bin')
+
+    # Отображение файла массива name в память
+    #
+    # Params:
+    # name: string - название массива
+    # dtype: np.dtype - тип элементов
+    # length: int - количество элементов
+    # create: bool - если True, то прежнее содержимое удаляется
+    #
+    # Returns -> np.memmap
+    def __map(self, name, dtype, length, create=False):
+        return _map(self.__file(name), dtype, length, create)
+
+    def id_of(self, key):
+        state_id = self.index.get(key)
+        if state_id is not None:
+            self.hits += 1
+            self.index.move_to_end(key)
+            return state_id
+
+        self.misses += 1
+        state_id = self.disk.get(key)
+        if state_id >= 0:
+            self.disk_hits += 1
+            self.__cache(key, state_id)
+        return state_id
+
+    def thaw(self):
+        pass
+
+    # Помещение ключа в кэш с вытеснением давно не использованных
+    # ключей при превышении бюджета. Перед вытеснением все ключи,
+    # которых ещё нет в файле, записываются в хеш-таблицу
+    #
+    # Params:
+    # key: int - состояние среды
+    # state_id: int - номер состояния
+    #
+    # Returns -> void
+    def __cache(self, key, state_id):
+        self.index[key] = state_id
+        if len(self.index) <= self.cache_limit:
+            return
+
+        if self.written < self.count:
+            self.disk.insert(np.arange(self.written, self.count))
+            self.spills += self.count - self.written
+            self.written = self.count
+        for _ in range(self.cache_limit // 8):
+            self.index.popitem(last=False)
+        self.evictions += self.cache_limit // 8
+
+    # Увеличение файлов массивов состояний до end элементов
+    # с удвоением ёмкости
+    #
+    # Params:
+    # end: int - нужное количество состояний
+    #
+    # Returns -> void
+    def __reserve(self, end):
+        if end <= len(self.keys):
+            return
+        capacity = len(self.keys)
+        while capacity < end:
+            capacity *= 2
+        for name in ('keys', 'V', 'R', 'solved'):
+            array = getattr(self, name)
+            array.flush()
+            setattr(self, name, self.__map(name, array.dtype, capacity))
+        self.disk.keys = self.keys
+
+    def add(self, key):
+        state_id = self.id_of(key)
+        if state_id >= 0:
+            return state_id
+
+        self.__reserve(self.count + 1)
+        state_id = self.count
+        self.keys[state_id] = key
+        self.count += 1
+        self.version += 1
+        self.__cache(key, state_id)
+        return state_id
+
+    # Добавление набора состояний. Ключи ищутся в хеш-таблице
+    # в файле одной векторной операцией, новые ключи добавляются
+    # в порядке первого появления и сразу записываются в таблицу
+    def add_many(self, keys):
+        keys = np.asarray(list(keys), dtype=np.uint64)
+        if self.written < self.count:
+            self.disk.insert(np.arange(self.written, self.count))
+            self.spills += self.count - self.written
+            self.written = self.count
+
+        ids = self.disk.get_many(keys)
+        missing = np.nonzero(ids < 0)[0]
+        if len(missing) == 0:
+            return ids
+
+        new_keys, first, inverse = np.unique(keys[missing], return_index=True,
+                                             return_inverse=True)
+        order = np.argsort(first, kind='stable')
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        end = self.count + len(new_keys)
+        self.__reserve(end)
+        self.keys[self.count:end] = new_keys[order]
+        ids[missing] = self.count + rank[inverse.ravel()]
+        self.disk.insert(np.arange(self.count, end))
+        self.spills += end - self.count
+        self.count = self.written = end
+        self.version += 1
+        return ids
+
+    def add_transition(self, key, action, next_key, pr):
+        state_id = self.add(key)
+        next_id = self.add(next_key)
+        if self.__staged == len(self.__staged_sa):
+            self.__spill()
+
+        self.__staged_sa[self.__staged] = state_id * 4 + action
+        self.__staged_next[self.__staged] = next_id
+        self.__staged_prob[self.__staged] = pr
+        self.__staged += 1
+        self.version += 1
+
+    def add_transitions(self, state_ids, actions, next_ids, probs):
+        sa = np.asarray(state_ids, dtype=np.int64) * 4 + np.asarray(actions)
+        next_ids = np.asarray(next_ids)
+        probs = np.asarray(probs)
+        position = 0
+        while position < len(sa):
+            if self.__staged == len(self.__staged_sa):
+                self.__spill()
+            size = min(len(sa) - position, len(self.__staged_sa) - self.__staged)
+            end = self.__staged + size
+            self.__staged_sa[self.__staged:end] = sa[position:position + size]
+            self.__staged_next[self.__staged:end] = next_ids[position:position + size]
+            self.__staged_prob[self.__staged:end] = probs[position:position + size]
+            self.__staged = end
+            position += size
+        self.version += 1
+
+    # Запись полного буфера в журнал и слияние журнала с файлами
+    # CSR, если журнал дорос до их размера
+    #
+    # Returns -> void
+    def __spill(self):
+        self.__flush()
+        if self.__logged >= max(self.__edges, len(self.__staged_sa)):
+            self.compact()
+
+    # Запись буфера новых переходов в журнал отсортированным
+    # отрезком. Повторы внутри буфера и переходы, уже записанные
+    # в файлы CSR, отбрасываются, состояния с новыми переходами
+    # помечаются нерешёнными
+    #
+    # Returns -> void
+    def __flush(self):
+        if self.__staged == 0:
+            return
+
+        sa = self.__staged_sa[:self.__staged]
+        next_id = self.__staged_next[:self.__staged]
+        prob = self.__staged_prob[:self.__staged]
+        order = np.lexsort((next_id, sa))
+        sa, next_id, prob = sa[order], next_id[order], prob[order]
+        unique = np.ones(len(sa), dtype=bool)
+        unique[1:] = (sa[1:] != sa[:-1]) | (next_id[1:] != next_id[:-1])
+
+        # Переходы, уже записанные в файлы
+        old = np.nonzero(unique & (sa < self.__pairs))[0]
+        edges, seg = segments(self.__offsets[sa[old]], self.__offsets[sa[old] + 1])
+        known = np.zeros(len(old), dtype=bool)
+        known[seg[self.__next_id[edges] == next_id[old[seg]]]] = True
+        unique[old[known]] = False
+        if instrumentation.enabled:
+            instrumentation.count('store.duplicate_transitions', int(len(unique) - unique.sum()))
+        sa, next_id, prob = sa[unique], next_id[unique], prob[unique]
+        self.solved[np.unique(sa // 4)] = False
+
+        end = self.__logged + len(sa)
+        if end > len(self.__log_sa):
+            capacity = max(len(self.__log_sa), 1024)
+            while capacity < end:
+                capacity *= 2
+            for name in ('log_sa', 'log_next', 'log_prob'):
+                array = getattr(self, '_SpillStore__' + name)
+                array.flush()
+                setattr(self, '_SpillStore__' + name, self.__map(name, array.dtype, capacity))
+        self.__log_sa[self.__logged:end] = sa
+        self.__log_next[self.__logged:end] = next_id
+        self.__log_prob[self.__logged:end] = prob
+        self.__runs.append((self.__logged, end))
+        self.__logged = end
+        self.__staged = 0
+
+    # Слияние журнала с файлами CSR. Отрезки журнала отсортированы,
+    # поэтому файлы переписываются кусками по MERGE_CHUNK пар
+    # (состояние, действие), и объём памяти ограничен размером
+    # буфера и куска. Из повторов в разных отрезках сохраняется
+    # первый переход
+    #
+    # Returns -> void
+    def compact(self):
+        self.__flush()
+        pairs = 4 * self.count
+        if not self.__runs and self.__pairs == pairs:
+            return
+
+        bound = self.__edges + self.__logged
+        offsets = self.__map('offsets.new', np.int64, pairs + 1, create=True)
+        new_next = self.__map('next_id.new', np.int32, bound, create=True)
+        new_prob = self.__map('prob.new', np.float64, bound, create=True)
+        runs = [(self.__log_sa[start:end], self.__log_next[start:end], self.__log_prob[start:end])
+                for start, end in self.__runs]
+
+        added = 0
+        duplicates = 0
+        for start in range(0, pairs, MERGE_CHUNK):
+            end = min(start + MERGE_CHUNK, pairs)
+            bounds = np.arange(start, end + 1)
+            old_offsets = np.asarray(self.__offsets[np.minimum(bounds, self.__pairs)])
+
+            parts = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32),
+                      np.zeros(0, dtype=np.float64))]
+            for run_sa, run_next, run_prob in runs:
+                low, high = np.searchsorted(run_sa, [start, end])
+                parts.append((run_sa[low:high], run_next[low:high], run_prob[low:high]))
+            sa, next_id, prob = (np.concatenate(arrays) for arrays in zip(*parts))
+            order = np.lexsort((next_id, sa))
+            sa, next_id, prob = sa[order], next_id[order], prob[order]
+            unique = np.ones(len(sa), dtype=bool)
+            unique[1:] = (sa[1:] != sa[:-1]) | (next_id[1:] != next_id[:-1])
+            duplicates += int(len(sa) - unique.sum())
+            sa, next_id, prob = sa[unique], next_id[unique], prob[unique]
+
+            new_bounds = np.searchsorted(sa, bounds)
+            offsets[start:end + 1] = old_offsets + added + new_bounds
+            old_sa = np.repeat(np.arange(start, end), np.diff(old_offsets))
+            chunk_order = np.argsort(np.concatenate([old_sa, sa]), kind='stable')
+            out = slice(old_offsets[0] + added, old_offsets[-1] + added + len(sa))
+            new_next[out] = np.concatenate([self.__next_id[old_offsets[0]:old_offsets[-1]],
+                                            next_id])[chunk_order]
+            new_prob[out] = np.concatenate([self.__prob[old_offsets[0]:old_offsets[-1]],
+                                            prob])[chunk_order]
+            added += len(sa)
+        if instrumentation.enabled:
+            instrumentation.count('store.duplicate_transitions', duplicates)
+
+        edge_count = self.__edges + added
+        for array in (offsets, new_next, new_prob):
+            array.flush()
+        del offsets, new_next, new_prob, runs
+        self.__offsets = self.__next_id = self.__prob = None
+        for name, dtype, length in (('offsets', np.int64, pairs + 1),
+                                    ('next_id', np.int32, edge_count),
+                                    ('prob', np.float64, edge_count)):
+            os.truncate(self.__file(name + '.new'), max(length, 1) * np.dtype(dtype).itemsize)
+            os.replace(self.__file(name + '.new'), self.__file(name))
+            setattr(self, '_SpillStore__' + name, self.__map(name, dtype, length))
+
+        self.__pairs = pairs
+        self.__edges = edge_count
+        self.__runs = []
+        self.__logged = 0
+
+    def transitions(self):
+        self.compact()
+        return (self.__offsets[:self.__pairs + 1], self.__next_id[:self.__edges],
+                self.__prob[:self.__edges])
+
+    def best_actions(self):
+        offsets, next_id, prob = self.transitions()
+        actions = np.zeros(self.count, dtype=np.int8)
+        step = MERGE_CHUNK // 4
+        for start in range(0, self.count, step):
+            end = min(start + step, self.count)
+            bounds = np.asarray(offsets[4 * start:4 * end + 1])
+            sa = np.repeat(np.arange(4 * (end - start)), np.diff(bounds))
+            targets = np.asarray(next_id[bounds[0]:bounds[-1]])
+            values = np.bincount(sa, weights=prob[bounds[0]:bounds[-1]] * self.V[targets],
+                                 minlength=4 * (end - start))
+            actions[start:end] = values.reshape(-1, 4).argmax(axis=1)
+        return actions
+
+    # Буфер в файле для промежуточных данных решателя
+    #
+    # Params:
+    # name: string - название буфера
+    # dtype: np.dtype - тип элементов
+    # length: int - количество элементов
+    #
+    # Returns -> np.memmap
+    def scratch(self, name, dtype, length):
+        return self.__map(name, dtype, length, create=True)
+
+    # Счётчики кэша ключей
+    #
+    # Returns -> dict
+    def metrics(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0,
+            'disk_hits': self.disk_hits,
+            'spills': self.spills,
+            'evictions': self.evictions,
+            'cached': len(self.index),
+            'on_disk': self.disk.count,
+        }
+
+    def memory_usage(self):
+        report = {
+            'index': sys.getsizeof(self.index) + len(self.index) * ENTRY_BYTES,
+            'staged': self.__staged_sa.nbytes + self.__staged_next.nbytes +
+                      self.__staged_prob.nbytes,
+        }
+        report['total'] = sum(report.values())
+        report['disk'] = sum(os.path.getsize(os.path.join(self.path, name))
+                             for name in os.listdir(self.path))
+        return report
+
+    # Закрытие хранилища: файлы сбрасываются на диск, временный
+    # каталог удаляется
+    #
+    # Returns -> void
+    def close(self):
+        for array in (self.keys, self.V, self.R, self.solved, self.disk.slots,
+                      self.__offsets, self.__next_id, self.__prob,
+                      self.__log_sa, self.__log_next, self.__log_prob):
+            array.flush()
+        if self.temporary:
+            self.keys = self.V = self.R = self.solved = None
+            self.disk = None
+            self.__offsets = self.__next_id = self.__prob = None
+            self.__log_sa = self.__log_next = self.__log_prob = None
+            shutil.rmtree(self.path, ignore_errors=True)
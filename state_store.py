@@ -0,0 +1,462 @@
+import sys
+import numpy as np
+import instrumentation
+
+
+# Увеличение ёмкости массива с копированием данных
+#
+# Params:
+# array: np.ndarray - исходный массив
+# capacity: int - новая ёмкость
+#
+# Returns -> np.ndarray
+def _grow(array, capacity):
+    grown = np.zeros(capacity, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+# Индексы элементов для набора отрезков [starts[k], ends[k])
+#
+# Params:
+# starts: np.ndarray - начала отрезков
+# ends: np.ndarray - концы отрезков
+#
+# Returns -> (np.ndarray, np.ndarray):
+# Индексы элементов и номер отрезка для каждого индекса
+def segments(starts, ends):
+    lengths = ends - starts
+    segment_ids = np.repeat(np.arange(len(starts)), lengths)
+    shifts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return np.arange(len(segment_ids)) + shifts, segment_ids
+
+
+class StateStore:
+
+    # Компактное хранилище посещённых состояний агента.
+    # Ключ состояния отображается в плотный номер, ценности, награды
+    # и флаги решённости хранятся в типизированных массивах.
+    # Переходы хранятся в формате CSR: для пары (состояние, действие)
+    # с номером state_id * 4 + action переходы лежат в отрезке
+    # [offsets[sa], offsets[sa + 1]) массивов next_id и prob.
+    # Новые переходы копятся в буфере и сливаются в CSR при чтении.
+    # Новые состояния, новые переходы и изменённые награды снимают
+    # флаг решённости, по которому ValueSolver дорешивает модель
+    # частично. Счётчик version растёт при каждом изменении модели
+    # или ценностей, по нему пересобирается CompiledPolicy.
+    # Хранилище, загруженное из файла стратегии, доступно только
+    # для чтения: ключи отсортированы и ищутся двоичным поиском,
+    # при первом изменении данные копируются в память
+    #
+    # Params:
+    # capacity: int - начальная ёмкость массивов состояний
+    def __init__(self, capacity=1024):
+        self.index = {}
+        self.count = 0
+        self.keys = np.zeros(capacity, dtype=np.uint64)
+        self.V = np.zeros(capacity, dtype=np.float64)
+        self.R = np.zeros(capacity, dtype=np.float64)
+        self.solved = np.zeros(capacity, dtype=bool)
+        self.best_action = None
+        self.version = 0
+
+        self.__offsets = np.zeros(1, dtype=np.int64)
+        self.__next_id = np.zeros(0, dtype=np.int32)
+        self.__prob = np.zeros(0, dtype=np.float64)
+
+        self.__staged = 0
+        self.__staged_sa = np.zeros(capacity, dtype=np.int64)
+        self.__staged_next = np.zeros(capacity, dtype=np.int32)
+        self.__staged_prob = np.zeros(capacity, dtype=np.float64)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self.id_of(key) >= 0
+
+    # Номер состояния по ключу
+    #
+    # Params:
+    # key: int - состояние среды
+    #
+    # Returns -> int:
+    # Номер состояния или -1, если состояние не посещено
+    def id_of(self, key):
+        if self.index is None:
+            key = np.uint64(key)
+            position = int(np.searchsorted(self.keys[:self.count], key))
+            if position < self.count and self.keys[position] == key:
+                return position
+            return -1
+        return self.index.get(key, -1)
+
+    # Номер посещённого состояния по ключу
+    #
+    # Params:
+    # key: int - состояние среды
+    #
+    # Returns -> int:
+    # Номер состояния, KeyError - если состояние не посещено
+    def __id(self, key):
+        state_id = self.id_of(key)
+        if state_id < 0:
+            raise KeyError(key)
+        return state_id
+
+    # Перевод хранилища, загруженного из файла, в изменяемое:
+    # массивы копируются в память, строится словарь ключей
+    #
+    # Returns -> void
+    def thaw(self):
+        if self.index is not None:
+            return
+
+        capacity = max(self.count, 1024)
+        self.keys = _grow(self.keys[:self.count], capacity)
+        self.V = _grow(self.V[:self.count], capacity)
+        self.R = _grow(self.R[:self.count], capacity)
+        self.solved = _grow(self.solved[:self.count], capacity)
+        self.__offsets = np.array(self.__offsets)
+        self.__next_id = np.array(self.__next_id)
+        self.__prob = np.array(self.__prob)
+        self.index = {key: i for i, key in enumerate(self.keys[:self.count].tolist())}
+        self.best_action = None
+
+    # Добавление состояния, если оно ещё не посещено
+    #
+    # Params:
+    # key: int - состояние среды
+    #
+    # Returns -> int:
+    # Номер состояния
+    def add(self, key):
+        self.thaw()
+        state_id = self.index.get(key)
+        if state_id is not None:
+            return state_id
+
+        if self.count == len(self.keys):
+            capacity = 2 * len(self.keys)
+            self.keys = _grow(self.keys, capacity)
+            self.V = _grow(self.V, capacity)
+            self.R = _grow(self.R, capacity)
+            self.solved = _grow(self.solved, capacity)
+
+        state_id = self.count
+        self.index[key] = state_id
+        self.keys[state_id] = key
+        self.count += 1
+        self.version += 1
+        return state_id
+
+    # Установка награды за состояние
+    #
+    # Params:
+    # key: int - состояние среды
+    # reward: float - награда
+    #
+    # Returns -> void
+    def set_reward(self, key, reward):
+        self.thaw()
+        state_id = self.__id(key)
+        if self.R[state_id] != reward:
+            self.R[state_id] = reward
+            self.solved[state_id] = False
+            self.version += 1
+
+    # Получение ценности состояния
+    #
+    # Params:
+    # key: int - состояние среды
+    #
+    # Returns -> float
+    def get_value(self, key):
+        return float(self.V[self.__id(key)])
+
+    # Фиксирование перехода из состояния key в состояние
+    # next_key после действия action. Отсутствующее следующее
+    # состояние добавляется. Повторные переходы отбрасываются
+    # при слиянии буфера
+    #
+    # Params:
+    # key: int - состояние среды
+    # action: int - действие
+    # next_key: int - состояние среды после действия action
+    # pr: float - вероятность перехода
+    #
+    # Returns -> void
+    def add_transition(self, key, action, next_key, pr):
+        state_id = self.add(key)
+        next_id = self.add(next_key)
+
+        # Буфер растёт вдвое, пока не сравняется с CSR-массивами,
+        # после чего сливается с ними: каждый переход копируется
+        # амортизированно O(1) раз
+        if self.__staged == len(self.__staged_sa):
+            if len(self.__staged_sa) < len(self.__next_id):
+                capacity = 2 * len(self.__staged_sa)
+                self.__staged_sa = _grow(self.__staged_sa, capacity)
+                self.__staged_next = _grow(self.__staged_next, capacity)
+                self.__staged_prob = _grow(self.__staged_prob, capacity)
+            else:
+                self.compact()
+
+        self.__staged_sa[self.__staged] = state_id * 4 + action
+        self.__staged_next[self.__staged] = next_id
+        self.__staged_prob[self.__staged] = pr
+        self.__staged += 1
+        self.version += 1
+
+    # Добавление набора состояний. Новые ключи добавляются
+    # одной операцией в порядке первого появления
+    #
+    # Params:
+    # keys: iterable - состояния среды
+    #
+    # Returns -> np.ndarray:
+    # Номера состояний
+    def add_many(self, keys):
+        self.thaw()
+        keys = list(keys)
+        ids = np.fromiter((self.index.get(key, -1) for key in keys), dtype=np.int64, count=len(keys))
+        missing = np.nonzero(ids < 0)[0]
+        if len(missing) == 0:
+            return ids
+
+        new_keys = list(dict.fromkeys(keys[i] for i in missing.tolist()))
+        end = self.count + len(new_keys)
+        if end > len(self.keys):
+            capacity = len(self.keys)
+            while capacity < end:
+                capacity *= 2
+            self.keys = _grow(self.keys, capacity)
+            self.V = _grow(self.V, capacity)
+            self.R = _grow(self.R, capacity)
+            self.solved = _grow(self.solved, capacity)
+
+        self.keys[self.count:end] = new_keys
+        self.index.update(zip(new_keys, range(self.count, end)))
+        self.count = end
+        self.version += 1
+        ids[missing] = [self.index[keys[i]] for i in missing.tolist()]
+        return ids
+
+    # Фиксирование набора переходов между уже добавленными
+    # состояниями одной векторной операцией
+    #
+    # Params:
+    # state_ids: np.ndarray - номера состояний
+    # actions: np.ndarray - действия
+    # next_ids: np.ndarray - номера следующих состояний
+    # probs: np.ndarray - вероятности переходов
+    #
+    # Returns -> void
+    def add_transitions(self, state_ids, actions, next_ids, probs):
+        self.thaw()
+        count = len(state_ids)
+        needed = self.__staged + count
+        if needed > len(self.__staged_sa):
+            capacity = max(needed, 2 * len(self.__staged_sa))
+            self.__staged_sa = _grow(self.__staged_sa, capacity)
+            self.__staged_next = _grow(self.__staged_next, capacity)
+            self.__staged_prob = _grow(self.__staged_prob, capacity)
+
+        end = self.__staged + count
+        self.__staged_sa[self.__staged:end] = np.asarray(state_ids) * 4 + np.asarray(actions)
+        self.__staged_next[self.__staged:end] = next_ids
+        self.__staged_prob[self.__staged:end] = probs
+        self.__staged = end
+        self.version += 1
+
+        if self.__staged > len(self.__next_id):
+            self.compact()
+
+    # Слияние буфера новых переходов с CSR-массивами
+    # с удалением повторов пары (состояние, действие, следующее
+    # состояние). Сохраняется вероятность первого перехода.
+    # Состояния, у которых появились новые переходы, помечаются
+    # нерешёнными. Количество отброшенных повторов учитывается
+    # счётчиком store.duplicate_transitions
+    #
+    # Returns -> void
+    def compact(self):
+        pairs = 4 * self.count
+        if self.__staged == 0 and len(self.__offsets) == pairs + 1:
+            return
+
+        old_sa = np.repeat(np.arange(len(self.__offsets) - 1), np.diff(self.__offsets))
+        sa = np.concatenate([old_sa, self.__staged_sa[:self.__staged]])
+        next_id = np.concatenate([self.__next_id, self.__staged_next[:self.__staged]])
+        prob = np.concatenate([self.__prob, self.__staged_prob[:self.__staged]])
+
+        _, first = np.unique(sa * max(self.count, 1) + next_id, return_index=True)
+        if instrumentation.enabled:
+            instrumentation.count('store.duplicate_transitions', len(sa) - len(first))
+        added = first[first >= len(old_sa)]
+        self.solved[sa[added] // 4] = False
+        self.__next_id = next_id[first]
+        self.__prob = prob[first]
+        self.__offsets = np.searchsorted(sa[first], np.arange(pairs + 1)).astype(np.int64)
+        self.__staged = 0
+
+    # CSR-массивы переходов
+    #
+    # Returns -> (np.ndarray, np.ndarray, np.ndarray):
+    # offsets, next_id и prob
+    def transitions(self):
+        self.compact()
+        return self.__offsets, self.__next_id, self.__prob
+
+    # Переходы из состояния key после действия action
+    #
+    # Params:
+    # key: int - состояние среды
+    # action: int - действие
+    #
+    # Returns -> (np.ndarray, np.ndarray):
+    # Номера следующих состояний и вероятности переходов
+    def get_transitions(self, key, action):
+        offsets, next_id, prob = self.transitions()
+        sa = self.__id(key) * 4 + action
+        start, end = offsets[sa], offsets[sa + 1]
+        return next_id[start:end], prob[start:end]
+
+    # Ожидаемые ценности следующих состояний для каждого
+    # действия: сумма pr * V по переходам действия
+    #
+    # Params:
+    # key: int - состояние среды
+    #
+    # Returns -> np.ndarray:
+    # Массив из 4 ценностей
+    def action_values(self, key):
+        offsets, next_id, prob = self.transitions()
+        sa = self.__id(key) * 4
+        bounds = offsets[sa:sa + 5]
+        start, end = bounds[0], bounds[4]
+        actions = np.repeat(np.arange(4), np.diff(bounds))
+        weights = prob[start:end] * self.V[next_id[start:end]]
+        return np.bincount(actions, weights=weights, minlength=4)
+
+    # Ценности действий для всех состояний: сумма pr * V
+    # по переходам каждого действия, посчитанная одной векторной
+    # операцией
+    #
+    # Returns -> np.ndarray:
+    # Массив формы (count, 4)
+    def q_values(self):
+        offsets, next_id, prob = self.transitions()
+        sa = np.repeat(np.arange(4 * self.count), np.diff(offsets))
+        values = np.bincount(sa, weights=prob * self.V[next_id],
+                             minlength=4 * self.count)
+        return values.reshape(self.count, 4)
+
+    # Лучшие действия для всех состояний: сохранённые в файле
+    # стратегии (best_action, см. from_arrays) или argmax ценностей
+    # действий (см. q_values)
+    #
+    # Returns -> np.ndarray:
+    # Массив int8 формы (count,)
+    def best_actions(self):
+        if self.best_action is not None:
+            return self.best_action[:self.count]
+        return self.q_values().argmax(axis=1).astype(np.int8)
+
+    # Отчёт об использовании памяти
+    #
+    # Returns -> dict:
+    # Количество байт по каждой части хранилища и общий объём
+    def memory_usage(self):
+        report = {
+            'index': 0 if self.index is None else
+                     sys.getsizeof(self.index) +
+                     sum(sys.getsizeof(key) for key in self.index),
+            'keys': self.keys.nbytes,
+            'values': self.V.nbytes + self.R.nbytes + self.solved.nbytes,
+            'transitions': self.__offsets.nbytes + self.__next_id.nbytes +
+                           self.__prob.nbytes,
+            'staged': self.__staged_sa.nbytes + self.__staged_next.nbytes +
+                      self.__staged_prob.nbytes,
+        }
+        report['total'] = sum(report.values())
+        return report
+
+    # Представление хранилища в формате вложенных словарей
+    # (прежний формат Agent.states)
+    #
+    # Returns -> dict
+    def to_dict(self):
+        offsets, next_id, prob = self.transitions()
+        states = {}
+        for state_id in range(self.count):
+            actions = {}
+            for action in range(4):
+                sa = state_id * 4 + action
+                start, end = offsets[sa], offsets[sa + 1]
+                actions[action] = {
+                    'Prs': [[float(pr), int(self.keys[next_state])]
+                            for pr, next_state in zip(prob[start:end], next_id[start:end])]
+                }
+            states[int(self.keys[state_id])] = {
+                'solved_V': bool(self.solved[state_id]),
+                'R': float(self.R[state_id]),
+                'V': float(self.V[state_id]),
+                'actions': actions
+            }
+        return states
+
+    # Создание хранилища из формата вложенных словарей
+    #
+    # Params:
+    # states: dict - состояния в прежнем формате Agent.states,
+    # ключи могут быть строками (после JSON)
+    #
+    # Returns -> StateStore
+    @staticmethod
+    def from_dict(states):
+        store = StateStore()
+        for key, state in states.items():
+            state_id = store.add(int(key))
+            store.R[state_id] = state['R']
+            store.V[state_id] = state['V']
+        for key, state in states.items():
+            for action, data in state['actions'].items():
+                for pr, next_state in data['Prs']:
+                    store.add_transition(int(key), int(action), int(next_state), pr)
+        # Слияние переходов снимает флаги решённости, поэтому
+        # флаги из словаря записываются после него
+        store.compact()
+        for key, state in states.items():
+            store.solved[store.id_of(int(key))] = state['solved_V']
+        return store
+
+    # Создание хранилища только для чтения поверх готовых
+    # массивов, например отображённых в память из файла
+    #
+    # Params:
+    # keys: np.ndarray - отсортированные ключи состояний
+    # V: np.ndarray - ценности состояний
+    # R: np.ndarray - награды состояний
+    # offsets: np.ndarray - начала переходов пар (состояние, действие)
+    # next_id: np.ndarray - номера следующих состояний
+    # prob: np.ndarray - вероятности переходов
+    # best_action: np.ndarray - лучшие действия, может быть None
+    # solved: np.ndarray - флаги решённости, если не заданы,
+    # то все состояния считаются решёнными
+    #
+    # Returns -> StateStore
+    @classmethod
+    def from_arrays(cls, keys, V, R, offsets, next_id, prob, best_action=None, solved=None):
+        store = cls(capacity=1)
+        store.index = None
+        store.count = len(keys)
+        store.keys = keys
+        store.V = V
+        store.R = R
+        store.solved = np.ones(len(keys), dtype=bool) if solved is None else solved
+        store.best_action = best_action
+        store.__offsets = offsets
+        store.__next_id = next_id
+        store.__prob = prob
+        return store
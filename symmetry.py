@@ -0,0 +1,149 @@
+from array import array
+from bitboard import BitEngine
+
+
+# Смещения по строке и столбцу для действий
+# 0 - влево, 1 - вверх, 2 - вправо, 3 - вниз
+DIRECTIONS = [(0, -1), (-1, 0), (0, 1), (1, 0)]
+
+
+class Symmetry:
+
+    # Канонизация состояний относительно симметрий поля.
+    # Квадратное поле имеет 8 симметрий (повороты и отражения),
+    # прямоугольное - 4. Каждая симметрия задаётся тройкой
+    # (транспонирование, отражение по вертикали, отражение
+    # по горизонтали), применяемой в этом порядке.
+    # Состояния - упакованные поля в формате BitGame2048.get_state
+    #
+    # Params:
+    # rows: int - количество строк на игровом поле
+    # cols: int - количество столбцов на игровом поле
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.engine = BitEngine(rows, cols)
+        self.__reverse = self.__reverse_table(cols)
+
+        self.transforms = []
+        for transpose in ([False, True] if rows == cols else [False]):
+            for flip_rows in (False, True):
+                for flip_cols in (False, True):
+                    self.transforms.append((transpose, flip_rows, flip_cols))
+
+        self.__to_canonical = [self.__action_map(t) for t in self.transforms]
+        self.__from_canonical = []
+        for actions in self.__to_canonical:
+            inverse = [0] * 4
+            for action, mapped in enumerate(actions):
+                inverse[mapped] = action
+            self.__from_canonical.append(inverse)
+
+    # Таблица отражения линии: ячейки линии в обратном порядке
+    #
+    # Params:
+    # length: int - количество ячеек в линии
+    #
+    # Returns -> array
+    def __reverse_table(self, length):
+        table = array('Q', bytes(8 * (1 << (4 * length))))
+        for packed in range(len(table)):
+            reversed_line = 0
+            for k in range(length):
+                reversed_line |= ((packed >> (4 * k)) & 0xF) << (4 * (length - 1 - k))
+            table[packed] = reversed_line
+        return table
+
+    # Соответствие действий до и после симметрии
+    #
+    # Params:
+    # transform: tuple - симметрия
+    #
+    # Returns -> list:
+    # Действие после симметрии для каждого исходного действия
+    def __action_map(self, transform):
+        transpose, flip_rows, flip_cols = transform
+        actions = []
+        for di, dj in DIRECTIONS:
+            if transpose:
+                di, dj = dj, di
+            if flip_rows:
+                di = -di
+            if flip_cols:
+                dj = -dj
+            actions.append(DIRECTIONS.index((di, dj)))
+        return actions
+
+    # Все образы поля под действием симметрий
+    #
+    # Params:
+    # state: int - упакованное поле
+    #
+    # Returns -> list:
+    # Упакованные поля в порядке self.transforms
+    def images(self, state):
+        shift = 4 * self.cols
+        images = []
+        for transpose in ([False, True] if self.rows == self.cols else [False]):
+            lines = self.engine.get_cols(state) if transpose else self.engine.get_rows(state)
+            reversed_lines = [self.__reverse[line] for line in lines]
+            for flip_rows in (False, True):
+                for flip_cols in (False, True):
+                    board_lines = reversed_lines if flip_cols else lines
+                    if flip_rows:
+                        board_lines = board_lines[::-1]
+                    board = 0
+                    for i, line in enumerate(board_lines):
+                        board |= line << (shift * i)
+                    images.append(board)
+        return images
+
+    # Каноническое представление поля - наименьший из образов
+    #
+    # Params:
+    # state: int - упакованное поле
+    #
+    # Returns -> (int, int):
+    # Каноническое поле и номер использованной симметрии
+    def canonical(self, state):
+        images = self.images(state)
+        transform = min(range(len(images)), key=images.__getitem__)
+        return images[transform], transform
+
+    # Перевод действия на исходном поле в действие
+    # на каноническом поле
+    #
+    # Params:
+    # transform: int - номер симметрии
+    # action: int - действие на исходном поле
+    #
+    # Returns -> int
+    def to_canonical_action(self, transform, action):
+        return self.__to_canonical[transform][action]
+
+    # Перевод действия на каноническом поле в действие
+    # на исходном поле
+    #
+    # Params:
+    # transform: int - номер симметрии
+    # action: int - действие на каноническом поле
+    #
+    # Returns -> int
+    def from_canonical_action(self, transform, action):
+        return self.__from_canonical[transform][action]
+
+    # Перевод маски действий на исходном поле в маску действий
+    # на каноническом поле
+    #
+    # Params:
+    # transform: int - номер симметрии
+    # mask: int - маска действий (бит action - действие action)
+    #
+    # Returns -> int
+    def to_canonical_mask(self, transform, mask):
+        actions = self.__to_canonical[transform]
+        result = 0
+        for action in range(4):
+            if mask >> action & 1:
+                result |= 1 << actions[action]
+        return result
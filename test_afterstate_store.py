@@ -0,0 +1,46 @@
+import numpy as np
+import config
+from afterstate_store import AfterstateStore
+from agent import Agent
+from bitboard import BitGame2048
+
+
+# Решённая модель послеходовых состояний удовлетворяет своему
+# определению: W - сумма pr * V по появлению новой ячейки,
+# V - R + gamma * максимум W по действиям модели, а агент
+# выбирает доступное действие с наибольшей W
+def test_afterstate_max_backup():
+    environment = BitGame2048(2, 2, seed=1)
+    environment.init()
+    agent = Agent()
+    agent.build(environment=environment, bound_of_states=None,
+                needed=config.NEEDED, afterstates=True, verbose=False)
+    agent.create_policy(environment)
+    store = agent.states
+    assert isinstance(store, AfterstateStore)
+
+    count = len(store)
+    afters, after_offsets, after_next, after_prob = store.afterstates()
+    assert store.after_count > 0 and (afters >= 0).any()
+    for after in range(store.after_count):
+        edges = slice(after_offsets[after], after_offsets[after + 1])
+        assert np.isclose(after_prob[edges].sum(), 1)
+        assert np.isclose(store.W[after], (after_prob[edges] * store.V[after_next[edges]]).sum())
+
+    for state_id, key in enumerate(store.keys[:count].tolist()):
+        valid = afters[state_id] >= 0
+        if store.R[state_id] == config.WIN_REWARD:
+            assert store.V[state_id] == config.WIN_REWARD
+            continue
+        best = store.W[afters[state_id][valid]].max() if valid.any() else 0
+        assert np.isclose(store.V[state_id], store.R[state_id] + config.Y * best)
+
+        environment.set_state(key)
+        legal = np.array([environment.legal_actions() >> action & 1 for action in range(4)],
+                         dtype=bool)
+        assert valid[legal].all()
+        if legal.any():
+            action = agent.forward(key, environment.legal_actions())
+            assert legal[action]
+            assert np.isclose(store.W[afters[state_id][action]],
+                              store.W[afters[state_id][legal]].max())
@@ -0,0 +1,46 @@
+import os
+import pytest
+import config
+
+pg = pytest.importorskip('pygame')
+
+
+# Первая отрисовка обновляет экран целиком, затем
+# перерисовываются только ячейки и строки, которые изменились,
+# а поверхности ячеек берутся из кэша
+def test_draw_updates_only_dirty_rects(monkeypatch):
+    monkeypatch.setenv('SDL_VIDEODRIVER', 'dummy')
+    monkeypatch.setattr(config, 'FPS', 0)
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__)))
+    from app import App, get_tile_surface
+    from game import Game2048
+
+    flips = []
+    updates = []
+    monkeypatch.setattr(pg.display, 'flip', lambda: flips.append(True))
+    monkeypatch.setattr(pg.display, 'update', lambda rects: updates.append(list(rects)))
+
+    environment = Game2048(3, 3, seed=1)
+    environment.init()
+    app = App(environment)
+    try:
+        app.update(environment)
+        app.draw(0.5, 'Влево')
+        assert len(flips) == 1 and updates == []
+
+        app.draw(0.5, 'Влево')
+        assert len(flips) == 1 and updates == []
+
+        board = [row[:] for row in environment.game]
+        board[2][1] = 64 if board[2][1] != 64 else 128
+        app.game.update(board)
+        app.draw(0.5, 'Влево')
+        assert updates == [[app.game.tiles[2][1].bg]]
+
+        app.draw(0.25, 'Влево')
+        assert len(updates) == 2 and len(updates[1]) == 2
+        assert app.game.tiles[2][1].bg not in updates[1]
+
+        assert get_tile_surface(64, 10, 10) is get_tile_surface(64, 10, 10)
+    finally:
+        pg.quit()
@@ -0,0 +1,40 @@
+import numpy as np
+from batch_game import BatchGame2048
+from bitboard import BitGame2048
+
+
+# Одна игра пакета с тем же зерном и теми же действиями
+# проходит через те же поля, что и BitGame2048, с теми же
+# масками доступных действий, максимальной ячейкой и окончанием игры
+def test_batch_game_matches_bit_game():
+    actions = np.random.default_rng(0)
+    for rows, cols in ((2, 2), (2, 3), (3, 3), (4, 4)):
+        for seed in range(20):
+            single = BitGame2048(rows, cols, seed=seed)
+            batch = BatchGame2048(1, rows, cols, seed=seed)
+            single.init()
+            batch.init()
+            while True:
+                assert int(batch.get_state()[0]) == single.get_state()
+                assert int(batch.legal_actions()[0]) == single.legal_actions()
+                assert int(batch.max_tile_value[0]) == single.max_tile_value
+                assert bool(batch.game_over[0]) == single.game_over
+                if single.game_over:
+                    break
+                action = int(actions.integers(0, 4))
+                single.forward(action)
+                batch.forward([action])
+
+
+# Пакет без зерна воспроизводится через np.random.seed,
+# как и одиночные игры
+def test_batch_game_follows_global_seed():
+    runs = []
+    for _ in range(2):
+        np.random.seed(7)
+        batch = BatchGame2048(64, 3, 3)
+        batch.init()
+        for action in range(12):
+            batch.forward(np.full(64, action % 4))
+        runs.append(batch.get_state())
+    assert (runs[0] == runs[1]).all()
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+import codec
+from game import Game2048
+
+
+# Ключ - показатели степени по 4 бита на ячейку, упаковка
+# взаимно однозначна до 32768, а пакетные функции совпадают
+# с поштучными
+def test_codec_round_trip_and_batch():
+    assert codec.encode([[0, 0], [16, 4]]) == 0x2400
+    rng = np.random.default_rng(0)
+    for rows, cols in ((2, 2), (2, 3), (3, 3), (4, 4)):
+        exps = rng.integers(0, 16, size=(500, rows, cols))
+        boards = np.where(exps > 0, np.left_shift(1, exps), 0)
+        states = codec.encode_batch(boards)
+        assert len(np.unique(states)) == len(np.unique(exps.reshape(500, -1), axis=0))
+        assert states.tolist() == [codec.encode(board.tolist()) for board in boards]
+        assert np.array_equal(codec.decode_batch(states, rows, cols), boards)
+        assert np.array_equal(codec.encode_batch(exps, exponents=True), states)
+        assert np.array_equal(codec.decode_batch(states, rows, cols, exponents=True), exps)
+        assert [codec.decode(int(state), rows, cols) for state in states] == boards.tolist()
+        assert np.array_equal(codec.tile_sums(states), boards.reshape(500, -1).sum(axis=1))
+
+
+# Ключи Game2048 получаются той же упаковкой, а пакетная
+# упаковка не принимает поля больше 16 ячеек
+def test_codec_matches_game_and_rejects_large_boards():
+    game = Game2048(3, 3)
+    game.init()
+    for action in range(20):
+        assert game.get_state() == codec.encode(game.game)
+        game.forward(action % 4)
+    with pytest.raises(Exception):
+        codec.encode_batch(np.zeros((1, 5, 4), dtype=np.int64))
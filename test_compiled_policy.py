@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import config
+from agent import Agent
+from bitboard import BitGame2048
+
+
+# Пакетный выбор действий с масками доступных действий
+# совпадает с выбором по одному состоянию
+@pytest.mark.parametrize('canonical', [False, True])
+def test_forward_many_matches_forward_with_legal(canonical):
+    environment = BitGame2048(2, 2, seed=1)
+    environment.init()
+    agent = Agent(canonical=canonical)
+    agent.build(environment=environment, bound_of_states=None,
+                needed=config.NEEDED, verbose=False)
+    agent.create_policy(environment)
+
+    states, legal = [], []
+    for state in agent.states.keys[:len(agent.states)].tolist():
+        environment.set_state(state)
+        if environment.legal_actions():
+            states.append(state)
+            legal.append(environment.legal_actions())
+    legal = np.array(legal)
+
+    actions = agent.forward_many(states, legal)
+    assert actions.tolist() == [agent.forward(state, mask)
+                                for state, mask in zip(states, legal.tolist())]
+    assert (legal >> actions & 1).all()
+    assert (agent.forward_many(states) != actions).any()
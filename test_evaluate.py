@@ -0,0 +1,25 @@
+import evaluate
+from agent import Agent
+from bitboard import BitGame2048
+
+
+# Случайные ходы из неизвестных состояний не тратят поток
+# случайных чисел игры: игра повторяется по зерну и действиям
+def test_random_fallback_keeps_game_replayable(monkeypatch):
+    environment = BitGame2048(3, 3)
+    actions = []
+    forward = environment.forward
+
+    def record(action):
+        actions.append(action)
+        forward(action)
+
+    monkeypatch.setattr(environment, 'forward', record)
+    monkeypatch.setattr(evaluate, '_agent', Agent())
+    monkeypatch.setattr(evaluate, '_environment', environment)
+    monkeypatch.setattr(evaluate, '_needed', 2 ** 30)
+
+    result = evaluate._play((1234, 200))
+    assert result['unknown_moves'] == result['moves'] > 0
+    final_state = environment.get_state()
+    assert BitGame2048(3, 3).replay(1234, actions) == final_state
@@ -0,0 +1,61 @@
+import config
+from bitboard import BitEngine, BitGame2048
+from expectimax import ExpectimaxPlanner
+
+
+# Поле после нескольких случайных ходов
+def _board(size=4):
+    environment = BitGame2048(size, size, seed=2)
+    environment.init()
+    for action in (0, 1, 2, 3, 0, 1):
+        environment.forward(action)
+    return environment.get_state()
+
+
+# Поиск глубины 1 без модели агента совпадает с прямым
+# вычислением: среднее по появлению новой ячейки от доли
+# свободных ячеек после хода
+def test_depth_one_matches_reference():
+    state = _board()
+    engine = BitEngine(4, 4)
+    planner = ExpectimaxPlanner(4, 4, depth=1, time_limit_ms=10 ** 6)
+
+    def evaluate(board):
+        if engine.is_game_over(board):
+            return 0
+        return engine.free_cells(board) / 16 * config.WIN_REWARD
+
+    values = []
+    for action in range(4):
+        if not engine.legal_actions(state) >> action & 1:
+            values.append(-1)
+            continue
+        after, _ = engine.move(state, action)
+        shifts = [4 * cell for cell in range(16) if not (after >> (4 * cell)) & 0xF]
+        total = sum(config.PROB_OF_2 * evaluate(after | 1 << shift) +
+                    config.PROB_OF_4 * evaluate(after | 2 << shift) for shift in shifts)
+        values.append(config.Y * total / len(shifts))
+    assert planner.search(state) == max(range(4), key=values.__getitem__)
+    assert planner.reached_depth == 1
+
+
+# Поиск укладывается во время на ход, останавливая итеративное
+# углубление, а таблица транспозиций не превышает заданный
+# размер и повторный поиск находит в ней узлы
+def test_time_budget_and_lru_table():
+    state = _board()
+    engine = BitEngine(4, 4)
+    planner = ExpectimaxPlanner(4, 4, depth=8, time_limit_ms=30)
+    action = planner.search(state)
+    assert engine.legal_actions(state) >> action & 1
+    assert 1 <= planner.reached_depth < 8
+    assert planner.last_latency_ms < 30 * 10
+
+    state = _board(3)
+    full = ExpectimaxPlanner(3, 3, depth=3, time_limit_ms=10 ** 6, table_size=10 ** 6)
+    small = ExpectimaxPlanner(3, 3, depth=3, time_limit_ms=10 ** 6, table_size=50)
+    assert small.search(state) == full.search(state)
+    assert len(full.table) > 50 and len(small.table) == 50
+    full.hits = 0
+    assert full.search(state) == small.search(state)
+    assert full.hits > 0
@@ -0,0 +1,47 @@
+import numpy as np
+import codec
+from bitboard import BitEngine, BitGame2048
+from game import Game2048
+
+
+# Маска доступных действий по определению: ход сдвигает поле
+def _legal(engine, board):
+    return sum(1 << action for action in range(4) if engine.move(board, action)[0] != board)
+
+
+# Маска доступных действий обеих сред совпадает с ходами,
+# которые сдвигают поле, а игра окончена ровно при пустой маске
+def test_legal_actions_match_moves():
+    actions = np.random.default_rng(0)
+    for game_class in (Game2048, BitGame2048):
+        for rows, cols in ((2, 2), (2, 3), (3, 3), (4, 4)):
+            engine = BitEngine(rows, cols)
+            environment = game_class(rows, cols, seed=5)
+            for _ in range(5):
+                environment.init()
+                while True:
+                    legal = _legal(engine, environment.get_state())
+                    assert environment.legal_actions() == legal
+                    assert environment.game_over == (legal == 0)
+                    if environment.game_over:
+                        break
+                    environment.forward(int(actions.integers(0, 4)))
+
+
+# Окончание игры определяется после появления новой ячейки:
+# ход влево из поля [[2, 4], [0, 8]] оставляет свободную ячейку,
+# и игра окончена, только если в ней появилась 2
+def test_game_over_after_spawn():
+    for game_class in (Game2048, BitGame2048):
+        outcomes = set()
+        for seed in range(100):
+            environment = game_class(2, 2, seed=seed)
+            environment.set_state(codec.encode([[2, 4], [0, 8]]))
+            assert not environment.game_over
+            environment.forward(0)
+            spawned = environment.game[1][1]
+            assert spawned in (2, 4)
+            assert environment.game_over == (spawned == 2)
+            assert (environment.legal_actions() == 0) == (spawned == 2)
+            outcomes.add(spawned)
+        assert outcomes == {2, 4}
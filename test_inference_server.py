@@ -0,0 +1,83 @@
+import asyncio
+import math
+import threading
+from contextlib import contextmanager
+import pytest
+import config
+from agent import Agent
+from bitboard import BitGame2048
+from inference_client import PolicyClient
+from inference_server import InferenceServer
+
+
+# Агент с решённой моделью поля 2x2
+def _agent(environment):
+    agent = Agent()
+    agent.build(environment=environment, bound_of_states=None,
+                needed=config.NEEDED, verbose=False)
+    agent.create_policy(environment)
+    return agent
+
+
+# Сервер стратегии в отдельном потоке и подключённый к нему клиент
+@contextmanager
+def _serve(agent, path):
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    server = InferenceServer(agent, max_delay_ms=0)
+    asyncio.run_coroutine_threadsafe(server.start(path=path), loop).result()
+    client = PolicyClient(path=path, timeout=10)
+    try:
+        yield server, client
+    finally:
+        client.close()
+        asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+
+# Клиент сервера стратегии выбирает те же действия, что и агент
+# в процессе, в том числе когда лучшее действие модели недоступно
+def test_client_matches_agent_on_illegal_best_action(tmp_path):
+    environment = BitGame2048(2, 2, seed=1)
+    environment.init()
+    agent = _agent(environment)
+
+    states, legal = [], []
+    for state in agent.states.keys[:len(agent.states)].tolist():
+        environment.set_state(state)
+        mask = environment.legal_actions()
+        if mask and not mask >> int(agent.forward(state)) & 1:
+            states.append(state)
+            legal.append(mask)
+    assert states
+
+    with _serve(agent, str(tmp_path / 'policy.sock')) as (_, client):
+        expected = [agent.forward(state, mask) for state, mask in zip(states, legal)]
+        assert [client.forward(state, mask) for state, mask in zip(states, legal)] == expected
+        assert client.forward_many(states, legal) == expected
+
+
+# Ошибка поиска в стратегии не оставляет запросы без ответа,
+# и сервер продолжает отвечать на следующие запросы
+def test_lookup_error_answers_batch(tmp_path, monkeypatch):
+    environment = BitGame2048(2, 2, seed=1)
+    environment.init()
+    agent = _agent(environment)
+    state = environment.start_state
+    lookup_many = agent.lookup_many
+
+    def fail_once(states, legal=None):
+        monkeypatch.setattr(agent, 'lookup_many', lookup_many)
+        raise RuntimeError('lookup failed')
+
+    with _serve(agent, str(tmp_path / 'policy.sock')) as (server, client):
+        monkeypatch.setattr(agent, 'lookup_many', fail_once)
+        action, value = client.lookup_many([state])[0]
+        assert action == -1 and math.isnan(value)
+        assert server.stats()['errors'] == 1
+        with pytest.raises(KeyError):
+            monkeypatch.setattr(agent, 'lookup_many', fail_once)
+            client.forward(state)
+        assert client.forward(state) == agent.forward(state)
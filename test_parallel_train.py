@@ -0,0 +1,24 @@
+import config
+from agent import Agent
+from bitboard import BitGame2048
+from parallel_train import ParallelTrainer
+
+
+# Модель канонических состояний после параллельного изучения
+# отвечает на запросы о S0 без сохранения и загрузки
+def test_canonical_parallel_train_answers_start_state():
+    environment = BitGame2048(2, 2, seed=1)
+    environment.init()
+    agent = Agent(canonical=True)
+    trainer = ParallelTrainer(environment, config.NEEDED, workers=2, shard_states=50)
+    trainer.train(agent, 200, verbose=False)
+    agent.create_policy(environment)
+
+    start_state = environment.start_state
+    assert agent.symmetry is not None
+    assert agent.is_known_state(start_state)
+    environment.set_state(start_state)
+    legal = environment.legal_actions()
+    assert legal >> agent.forward(start_state, legal) & 1
+    assert agent.get_state_value(start_state) == agent.states.get_value(
+        agent.symmetry.canonical(start_state)[0])
@@ -0,0 +1,50 @@
+import numpy as np
+import config
+from afterstate_store import AfterstateStore
+from agent import Agent
+from bitboard import BitGame2048
+
+
+# Модель послеходовых состояний после сохранения и загрузки
+# выбирает те же действия, что и до сохранения
+def test_afterstate_policy_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'POLICIES_PATH', str(tmp_path) + '/')
+    environment = BitGame2048(2, 2, seed=1)
+    environment.init()
+
+    agent = Agent()
+    agent.build(environment=environment, bound_of_states=None,
+                needed=config.NEEDED, afterstates=True, verbose=False)
+    agent.create_policy(environment)
+    filename = agent.save(environment)
+
+    loaded = Agent()
+    loaded.load(filename)
+    assert isinstance(loaded.states, AfterstateStore)
+    assert len(loaded.states) == len(agent.states)
+
+    for state in agent.states.keys[:len(agent.states)].tolist():
+        environment.set_state(state)
+        legal = environment.legal_actions()
+        assert loaded.forward(state) == agent.forward(state)
+        assert loaded.forward(state, legal) == agent.forward(state, legal)
+
+
+# Решение уже решённой загруженной модели не копирует
+# отображённые в память массивы
+def test_create_policy_keeps_solved_policy_mapped(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'POLICIES_PATH', str(tmp_path) + '/')
+    environment = BitGame2048(2, 2, seed=1)
+    environment.init()
+
+    for afterstates in (False, True):
+        agent = Agent()
+        agent.build(environment=environment, bound_of_states=None,
+                    needed=config.NEEDED, afterstates=afterstates, verbose=False)
+        agent.create_policy(environment)
+
+        loaded = Agent()
+        loaded.load(agent.save(environment))
+        assert loaded.create_policy(environment) == 0
+        assert loaded.states.index is None
+        assert isinstance(loaded.states.V, np.memmap)
@@ -0,0 +1,77 @@
+import numpy as np
+import config
+from agent import Agent
+from bitboard import BitGame2048
+from solver import ValueSolver
+
+
+# Частичный пересчёт изменённых состояний и их предков
+# даёт те же ценности, что и решение модели с нуля
+def test_partial_resolve_matches_full_solve():
+    np.random.seed(0)
+    environment = BitGame2048(3, 3, seed=1)
+    environment.init()
+    agent = Agent()
+    agent.train(environment, 20000, config.NEEDED, verbose=False)
+    agent.create_policy(environment)
+    agent.train(environment, 20050, config.NEEDED, verbose=False)
+
+    store = agent.states
+    offsets, next_id, prob = store.transitions()
+    count = len(store)
+    full = ValueSolver().solve(store.R[:count], offsets, next_id, prob)
+
+    solver = ValueSolver(partial_limit=1)
+    resolved = solver.solve_store(store)
+    assert 0 < resolved < count
+    assert store.solved[:count].all()
+    assert np.allclose(store.V[:count], full, rtol=0, atol=1e-9)
+
+
+# Ценности по определению: R + gamma * сумма pr * V по всем
+# действиям, для победного состояния - config.WIN_REWARD
+def _reference_values(R, offsets, next_id, prob, gamma):
+    values = {}
+
+    def value(state):
+        if state not in values:
+            if R[state] == config.WIN_REWARD:
+                values[state] = config.WIN_REWARD
+            else:
+                edges = range(offsets[4 * state], offsets[4 * state + 4])
+                values[state] = R[state] + gamma * sum(
+                    prob[edge] * value(next_id[edge]) for edge in edges if next_id[edge] >= 0)
+        return values[state]
+
+    return np.array([value(state) for state in range(len(R))])
+
+
+# Послойное решение совпадает с рекурсивным вычислением
+# ценностей, а частичный пересчёт предков изменённых
+# состояний - с решением изменённой модели с нуля
+def test_layered_solve_and_partial_resolve():
+    environment = BitGame2048(2, 2, seed=1)
+    environment.init()
+    agent = Agent()
+    agent.build(environment=environment, bound_of_states=None,
+                needed=config.NEEDED, verbose=False)
+    store = agent.states
+    offsets, next_id, prob = store.transitions()
+    count = len(store)
+    R = store.R[:count].copy()
+
+    solver = ValueSolver()
+    V = solver.solve(R, offsets, next_id, prob)
+    assert solver.layers > 1
+    assert np.allclose(V, _reference_values(R, offsets, next_id, prob, solver.gamma),
+                       rtol=0, atol=1e-9)
+
+    dirty = np.zeros(count, dtype=bool)
+    changed = np.nonzero(R != config.WIN_REWARD)[0][::7]
+    R[changed] += 1
+    dirty[changed] = True
+    active = solver.affected(offsets, next_id, dirty)
+    assert active[dirty].all() and active.sum() < count
+    resolved = solver.resolve(R, offsets, next_id, prob, V, active)
+    assert np.allclose(resolved, solver.solve(R, offsets, next_id, prob), rtol=0, atol=1e-9)
+    assert np.array_equal(resolved[~active], V[~active])
@@ -0,0 +1,52 @@
+import numpy as np
+import config
+from agent import Agent
+from bitboard import BitGame2048
+from spill_store import SpillStore
+from state_store import StateStore
+
+
+# Множество переходов хранилища: тройки (пара (состояние,
+# действие) в ключах, ключ следующего состояния, вероятность)
+def _edges(store):
+    offsets, next_id, prob = store.transitions()
+    count = len(store)
+    keys = np.asarray(store.keys[:count])
+    sa = np.repeat(np.arange(4 * count), np.diff(np.asarray(offsets)))
+    return set(zip((keys[sa // 4] * 4 + sa % 4).tolist(),
+                   keys[np.asarray(next_id)].tolist(), np.asarray(prob).tolist()))
+
+
+# Модель в файлах с буфером много меньше модели совпадает
+# с моделью в памяти: те же переходы и те же ценности
+def test_spill_store_matches_state_store():
+    agents = []
+    for states in (StateStore(), SpillStore(cache_bytes=4096)):
+        np.random.seed(0)
+        environment = BitGame2048(3, 3, seed=1)
+        environment.init()
+        agent = Agent(states=states)
+        agent.train(environment, 5000, config.NEEDED, verbose=False)
+        agent.create_policy(environment)
+        agents.append(agent)
+
+    memory, spill = agents[0].states, agents[1].states
+    assert len(spill) == len(memory)
+    assert _edges(spill) == _edges(memory)
+    for key in memory.keys[:len(memory)].tolist()[::50]:
+        assert np.isclose(spill.get_value(key), memory.get_value(key))
+    spill.close()
+
+
+# Пакетное добавление возвращает номера в порядке первого
+# появления и находит уже добавленные ключи
+def test_spill_store_add_many():
+    store = SpillStore(cache_bytes=4096)
+    assert store.add(50) == 0
+    ids = store.add_many([7, 50, 9, 7, 11])
+    assert ids.tolist() == [1, 0, 2, 1, 3]
+    assert store.keys[:4].tolist() == [50, 7, 9, 11]
+    assert [store.add(key) for key in (11, 9, 13)] == [3, 2, 4]
+    assert store.add_many(range(3000))[[7, 9, 11, 50]].tolist() == [1, 2, 3, 0]
+    assert len(store) == 3000
+    store.close()
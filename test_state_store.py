@@ -0,0 +1,49 @@
+import numpy as np
+from state_store import StateStore
+
+
+# Переходы копятся в буфере и сливаются в CSR при чтении:
+# повторы отбрасываются с сохранением первой вероятности,
+# состояния с новыми переходами перестают быть решёнными
+def test_state_store_transitions():
+    store = StateStore(capacity=2)
+    for key, action, next_key, pr in ((10, 0, 20, 0.9), (10, 0, 30, 0.1), (10, 2, 20, 1.0),
+                                      (20, 1, 30, 1.0), (10, 0, 20, 0.5)):
+        store.add_transition(key, action, next_key, pr)
+    assert len(store) == 3 and 20 in store and 40 not in store
+    next_id, prob = store.get_transitions(10, 0)
+    assert store.keys[next_id].tolist() == [20, 30]
+    assert prob.tolist() == [0.9, 0.1]
+
+    store.V[:3] = [0, 2, 4]
+    store.solved[:3] = True
+    assert np.allclose(store.action_values(10), [0.9 * 2 + 0.1 * 4, 0, 2, 0])
+    assert np.allclose(store.q_values()[0], store.action_values(10))
+    assert store.best_actions().tolist() == [0, 1, 0]
+
+    store.add_transition(20, 3, 10, 1.0)
+    store.add_transition(10, 2, 20, 1.0)
+    store.transitions()
+    assert store.solved[:3].tolist() == [True, False, True]
+
+
+# Хранилище только для чтения поверх массивов копируется
+# в память при первом изменении и сохраняет данные, прежний
+# формат вложенных словарей переводится в хранилище без потерь
+def test_state_store_from_arrays_and_dict():
+    store = StateStore()
+    store.add_transition(1, 0, 2, 0.9)
+    store.add_transition(1, 0, 3, 0.1)
+    store.add_transition(2, 3, 3, 1.0)
+    store.set_reward(3, 5.0)
+    offsets, next_id, prob = store.transitions()
+
+    frozen = StateStore.from_arrays(store.keys[:3].copy(), store.V[:3].copy(),
+                                    store.R[:3].copy(), offsets.copy(), next_id.copy(),
+                                    prob.copy())
+    assert frozen.index is None and 2 in frozen
+    assert frozen.add(4) == 3
+    assert frozen.index is not None and not frozen.solved[3]
+    assert frozen.to_dict() == StateStore.from_dict(frozen.to_dict()).to_dict()
+    assert frozen.to_dict()[1]['actions'][0]['Prs'] == [[0.9, 2], [0.1, 3]]
+    assert frozen.to_dict()[3]['R'] == 5.0
@@ -0,0 +1,67 @@
+import numpy as np
+import config
+from agent import Agent
+from bitboard import BitGame2048
+from symmetry import Symmetry
+
+
+# Поля, встреченные при случайной игре
+def _boards(rows, cols, count):
+    environment = BitGame2048(rows, cols, seed=3)
+    actions = np.random.default_rng(3)
+    boards = []
+    while len(boards) < count:
+        environment.init()
+        while not environment.game_over and len(boards) < count:
+            boards.append(environment.get_state())
+            environment.forward(int(actions.integers(0, 4)))
+    return boards
+
+
+# Ход коммутирует с симметрией: образ поля после хода action
+# равен образу поля, сдвинутому действием to_canonical_action,
+# маски доступных действий переводятся так же, а все образы
+# поля имеют одно каноническое представление
+def test_symmetry_commutes_with_moves():
+    for rows, cols, transforms in ((3, 3, 8), (2, 3, 4)):
+        symmetry = Symmetry(rows, cols)
+        engine = symmetry.engine
+        assert len(symmetry.transforms) == transforms
+        for board in _boards(rows, cols, 300):
+            images = symmetry.images(board)
+            canonical, transform = symmetry.canonical(board)
+            assert canonical == min(images) == images[transform]
+            assert all(symmetry.canonical(image)[0] == canonical for image in images)
+            for t, image in enumerate(images):
+                assert symmetry.to_canonical_mask(t, engine.legal_actions(board)) == \
+                    engine.legal_actions(image)
+                for action in range(4):
+                    mapped = symmetry.to_canonical_action(t, action)
+                    assert symmetry.from_canonical_action(t, mapped) == action
+                    moved, score = engine.move(board, action)
+                    assert engine.move(image, mapped) == (symmetry.images(moved)[t], score)
+
+
+# Модель канонических состояний даёт те же ценности, что и полная
+# модель, и выбирает действие с той же ценностью
+def test_canonical_model_matches_full_model():
+    environment = BitGame2048(2, 2, seed=1)
+    environment.init()
+    agents = []
+    for canonical in (False, True):
+        agent = Agent(canonical=canonical)
+        agent.build(environment=environment, bound_of_states=None,
+                    needed=config.NEEDED, verbose=False)
+        agent.create_policy(environment)
+        agents.append(agent)
+    full, canonical = agents
+    assert len(canonical.states) < len(full.states)
+
+    for state in full.states.keys[:len(full.states)].tolist():
+        assert np.isclose(canonical.get_state_value(state), full.get_state_value(state))
+        environment.set_state(state)
+        legal = environment.legal_actions()
+        if legal:
+            values = full.states.action_values(state)
+            assert np.isclose(values[canonical.forward(state, legal)],
+                              values[full.forward(state, legal)])
@@ -0,0 +1,49 @@
+import numpy as np
+import config
+from agent import Agent
+from bitboard import BitGame2048
+from trajectory_log import FLAG_EPISODE_START, FLAG_GAME_OVER, TrajectoryWriter, read_trajectory
+
+
+# Множество переходов модели в ключах состояний
+def _edges(store):
+    offsets, next_id, prob = store.transitions()
+    count = len(store)
+    keys = store.keys[:count]
+    sa = np.repeat(np.arange(4 * count), np.diff(offsets))
+    return {(int(keys[s // 4]), int(s % 4), int(keys[n])): round(float(p), 12)
+            for s, n, p in zip(sa.tolist(), next_id.tolist(), prob.tolist())}
+
+
+# Журнал хранит каждый ход среды с началом эпизода
+# и окончанием игры, а модель, построенная по журналу, совпадает
+# с моделью, записанной при обучении
+def test_log_rebuilds_trained_model(tmp_path):
+    path = str(tmp_path / 'run.trj')
+    np.random.seed(0)
+    environment = BitGame2048(3, 3, seed=1)
+    environment.init()
+    environment.log = TrajectoryWriter(path, 3, 3, buffer_size=64)
+    trained = Agent()
+    trained.train(environment, 3000, config.NEEDED, verbose=False)
+    environment.log.close()
+
+    header, records = read_trajectory(path)
+    assert (header['rows'], header['cols']) == (3, 3)
+    assert len(records) == environment.log.count > 0
+    starts = records['flags'] & FLAG_EPISODE_START != 0
+    continued = ~starts[1:]
+    assert starts[0] and starts.sum() > 1
+    assert (records['state'][1:][continued] == records['next_state'][:-1][continued]).all()
+    assert (records['flags'] & FLAG_GAME_OVER != 0).any()
+
+    rebuilt = Agent()
+    rebuilt.build_from_logs([path], config.NEEDED, verbose=False)
+    assert rebuilt.start_state == environment.start_state
+    assert set(rebuilt.states.keys[:len(rebuilt.states)].tolist()) == \
+        set(trained.states.keys[:len(trained.states)].tolist())
+    assert _edges(rebuilt.states) == _edges(trained.states)
+    wins = [{int(key) for key in agent.states.keys[:len(agent.states)]
+             [agent.states.R[:len(agent.states)] == config.WIN_REWARD]}
+            for agent in (trained, rebuilt)]
+    assert wins[0] and wins[0] == wins[1]
@@ -0,0 +1,242 @@
+import os
+import struct
+from time import perf_counter
+import numpy as np
+import codec
+import config
+from exception import AttributeError
+
+
+MAGIC = b'TRJ2048\0'
+VERSION = 1
+
+# Заголовок: сигнатура, версия, строки, столбцы, резерв
+HEADER = struct.Struct('<8sIIII')
+
+# Запись о шаге среды фиксированной ширины (24 байта)
+RECORD = np.dtype([
+    ('state', '<u8'),
+    ('next_state', '<u8'),
+    ('value_delta', '<i2'),
+    ('action', 'u1'),
+    ('flags', 'u1'),
+    ('reserved', '<u4'),
+])
+
+# Флаги записи
+FLAG_GAME_OVER = 1
+FLAG_EPISODE_START = 2
+
+
+# Открытие журнала траекторий для чтения. Записи отображаются
+# в память без копирования, недописанная последняя запись
+# отбрасывается
+#
+# Params:
+# path: string - путь к файлу журнала
+#
+# Returns -> (dict, np.ndarray):
+# Поля заголовка и массив записей RECORD
+def read_trajectory(path):
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise AttributeError('Файл ' + path + ' не является журналом траекторий')
+    magic, version, rows, cols, _ = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise AttributeError('Файл ' + path + ' не является журналом траекторий')
+    if version != VERSION:
+        raise AttributeError('Неподдерживаемая версия журнала траекторий: ' + str(version))
+
+    header = {'version': version, 'rows': rows, 'cols': cols}
+    count = (size - HEADER.size) // RECORD.itemsize
+    if count == 0:
+        return header, np.zeros(0, dtype=RECORD)
+    return header, np.memmap(path, dtype=RECORD, mode='r', offset=HEADER.size, shape=(count,))
+
+
+class TrajectoryWriter:
+
+    # Буферизованная запись шагов среды в журнал траекторий.
+    # Журнал дописывается: если файл уже есть, то размер поля
+    # в его заголовке должен совпадать. Запись, состояние которой
+    # не совпадает со следующим состоянием предыдущей записи,
+    # помечается началом эпизода. Подключается к среде через
+    # атрибут log (см. Game2048.forward)
+    #
+    # Params:
+    # path: string - путь к файлу журнала
+    # rows: int - количество строк на игровом поле
+    # cols: int - количество столбцов на игровом поле
+    # buffer_size: int - количество записей в буфере
+    def __init__(self, path, rows, cols, buffer_size=config.TRAJECTORY_BUFFER):
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            header, _ = read_trajectory(path)
+            if (header['rows'], header['cols']) != (rows, cols):
+                raise AttributeError('Журнал ' + path + ' записан для поля ' +
+                                     str(header['rows']) + 'x' + str(header['cols']))
+            self.file = open(path, 'ab')
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(HEADER.pack(MAGIC, VERSION, rows, cols, 0))
+
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.last_state = None
+        self.count = 0
+
+    # Запись шага среды
+    #
+    # Params:
+    # state: int - состояние до действия
+    # action: int - действие
+    # next_state: int - состояние после действия
+    # value_delta: int - изменение числового значения среды
+    # game_over: bool - True, если игра окончена
+    #
+    # Returns -> void
+    def write(self, state, action, next_state, value_delta, game_over):
+        flags = FLAG_GAME_OVER if game_over else 0
+        if state != self.last_state:
+            flags |= FLAG_EPISODE_START
+        self.buffer.append((state, next_state, value_delta, action, flags, 0))
+        self.last_state = next_state
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    # Сброс буфера в файл
+    #
+    # Returns -> void
+    def flush(self):
+        if self.buffer:
+            self.file.write(np.array(self.buffer, dtype=RECORD).tobytes())
+            self.count += len(self.buffer)
+            self.buffer = []
+        self.file.flush()
+
+    # Закрытие журнала
+    #
+    # Returns -> void
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class TrajectoryBuilder:
+
+    # Построение модели переходов агента по журналам траекторий
+    # без повторного проигрывания игры. Журнал читается кусками
+    # по chunk записей, каждый кусок обрабатывается векторно:
+    # холостые ходы и ходы из победных состояний отбрасываются,
+    # вероятность перехода считается по количеству свободных
+    # ячеек следующего состояния и значению новой ячейки, как
+    # в Agent.train. Память ограничена размером куска и модели
+    #
+    # Params:
+    # store: StateStore - хранилище посещённых состояний агента
+    # needed: int - победное значение ячейки
+    # symmetry: Symmetry - если задана, то состояния и действия
+    # переводятся в каноническую форму
+    # chunk: int - количество записей, обрабатываемых за раз
+    def __init__(self, store, needed, symmetry=None, chunk=1 << 20):
+        self.store = store
+        self.needed = needed
+        self.needed_exp = int(needed).bit_length() - 1
+        self.symmetry = symmetry
+        self.chunk = chunk
+        self.start_state = None
+        self.records = 0
+        self.transitions = 0
+        self.elapsed = 0
+
+        if symmetry is not None:
+            self.to_canonical = np.array([[symmetry.to_canonical_action(t, a) for a in range(4)]
+                                          for t in range(len(symmetry.transforms))])
+
+    # Количество обработанных записей в секунду
+    #
+    # Returns -> float
+    @property
+    def records_per_sec(self):
+        return self.records / self.elapsed if self.elapsed > 0 else 0
+
+    # Обработка журнала path
+    #
+    # Params:
+    # path: string - путь к файлу журнала
+    #
+    # Returns -> int:
+    # Количество добавленных переходов (с повторами)
+    def ingest(self, path):
+        start_time = perf_counter()
+        header, records = read_trajectory(path)
+        added = 0
+        for start in range(0, len(records), self.chunk):
+            added += self.__ingest(np.asarray(records[start:start + self.chunk]),
+                                   header['rows'], header['cols'])
+        self.records += len(records)
+        self.transitions += added
+        self.elapsed += perf_counter() - start_time
+        return added
+
+    # Канонические состояния и номера симметрий для набора
+    # состояний. Каждое различное состояние канонизируется один раз
+    #
+    # Params:
+    # states: np.ndarray - состояния
+    #
+    # Returns -> (np.ndarray, np.ndarray)
+    def __canonical(self, states):
+        unique, inverse = np.unique(states, return_inverse=True)
+        pairs = [self.symmetry.canonical(state) for state in unique.tolist()]
+        canonical = np.array([state for state, _ in pairs], dtype=np.uint64)
+        transforms = np.array([transform for _, transform in pairs], dtype=np.int64)
+        return canonical[inverse], transforms[inverse]
+
+    # Обработка куска записей
+    #
+    # Params:
+    # records: np.ndarray - записи RECORD
+    # rows: int - количество строк на игровом поле
+    # cols: int - количество столбцов на игровом поле
+    #
+    # Returns -> int:
+    # Количество добавленных переходов
+    def __ingest(self, records, rows, cols):
+        if self.start_state is None and len(records):
+            starts = np.nonzero(records['flags'] & FLAG_EPISODE_START)[0]
+            if len(starts):
+                self.start_state = int(records['state'][starts[0]])
+
+        states = records['state']
+        next_states = records['next_state']
+        max_exp = codec.decode_batch(states, rows, cols, exponents=True).reshape(len(records), -1).max(axis=1)
+        keep = (next_states != states) & (max_exp < self.needed_exp)
+        states = states[keep]
+        next_states = next_states[keep]
+        actions = records['action'][keep].astype(np.int64)
+        delta = records['value_delta'][keep]
+        if len(states) == 0:
+            return 0
+
+        next_exps = codec.decode_batch(next_states, rows, cols, exponents=True).reshape(len(states), -1)
+        probs = 1 / ((next_exps == 0).sum(axis=1) + 1)
+        probs *= np.where(delta == 2, config.PROB_OF_2, np.where(delta == 4, config.PROB_OF_4, 1))
+        wins = np.unique(next_states[next_exps.max(axis=1) == self.needed_exp])
+
+        if self.symmetry is not None:
+            states, transforms = self.__canonical(states)
+            actions = self.to_canonical[transforms, actions]
+            next_states, _ = self.__canonical(next_states)
+            if len(wins):
+                wins, _ = self.__canonical(wins)
+
+        keys, inverse = np.unique(np.concatenate([states, next_states]), return_inverse=True)
+        ids = self.store.add_many(keys.tolist())[inverse]
+        for key in np.unique(wins).tolist():
+            self.store.set_reward(key, config.WIN_REWARD)
+        self.store.add_transitions(ids[:len(states)], actions, ids[len(states):], probs)
+        return len(states)